@@ -1,46 +1,31 @@
-import { useEffect, useState } from "react";
 import { useNavigate } from "react-router-dom";
-import { API_BASE } from "../helpers/constants";
 import type { PreviewType } from "../types";
 
 type Props = {
 	id: number;
 	previewMetadata: PreviewType;
+	sprite?: string;
 };
-export default function Preview({ id, previewMetadata }: Props) {
+export default function Preview({ id, previewMetadata, sprite }: Props) {
 	const navigate = useNavigate();
 	
-	// ! if image not preloaded in public folder
-
-	const [_thumbnail, setThumbnail] = useState<string>("");
-	useEffect(() => {
-		const getPreview = async () => {
-			try {
-			const res = await fetch(`${API_BASE}/api/get_image_preview/${id}`);
-				if (!res.ok) {
-					throw new Error(
-						`Failed to fetch preview: ${res.status} ${res.statusText}`
-					);
-				}
-				const data = await res.blob();
-				const url = URL.createObjectURL(data);
-				setThumbnail(url);
-			} catch (e) {
-				console.error(e);
-			}
-		};
-		getPreview();
-	}, [id]);
-
 	if (!previewMetadata) return null;
 
+	// thumbnails come from the sprite sheet of /get_preview_bundle; fall back to the preloaded image
+	const tile = previewMetadata.thumbnail;
+
 	return (
 		<div className="flex flex-col gap-2 shadow-md p-4 rounded bg-blue-950">
 			<div className="flex flex-col gap-1">
 				<div className="w-[400px] h-[300px] relative">
 
-				<img src={`/case_${id}_slice.png`} alt="Preview" className="w-full h-full object-cover absolute top-0 left-0 opacity-95"/>
-				{/* <img src={thumbnail} alt="Preview" className="w-full h-full object-cover absolute top-0 left-0 opacity-50"/> */}
+				{sprite && tile ? (
+					<svg viewBox={`${tile.x} ${tile.y} ${tile.width} ${tile.height}`} preserveAspectRatio="xMidYMid slice" className="w-full h-full absolute top-0 left-0 opacity-95">
+						<image href={sprite} x={0} y={0} />
+					</svg>
+				) : (
+					<img src={`/case_${id}_slice.png`} alt="Preview" className="w-full h-full object-cover absolute top-0 left-0 opacity-95"/>
+				)}
 				</div>
 				<p className="font-bold text-lg">Case {id}</p>
 				<div>Age: {previewMetadata.age || "-"}</div>
@@ -10,6 +10,7 @@ export default function DataPage() {
 	const [previewMetadata, setPreviewMetadata] = useState<{
 		[key: string]: PreviewType;
 	}>({});
+	const [sprite, setSprite] = useState<string>("");
 
 	const PREVIEW_IDS = Array.from(
 		{ length: ITEMS_PER_DATA_PAGE },
@@ -34,11 +35,12 @@ export default function DataPage() {
 		const fetchFiles = async () => {
 			try {
 				const res = await fetch(
-					`${API_BASE}/api/get_preview/${PREVIEW_IDS.join(",")}`
+					`${API_BASE}/api/get_preview_bundle/${PREVIEW_IDS.join(",")}`
 				);
-				const data = await res.json();
-                console.log(data)
-				for (const key in data) {   
+				const bundle = await res.json();
+				const data = bundle.cases;
+				setSprite(bundle.sprite);
+				for (const key in data) {
 					data[key]["age"] = Number(data[key]["age"]);
 					setPreviewMetadata((prev) => {
 						return {
@@ -52,7 +54,9 @@ export default function DataPage() {
 			}
 		};
 		fetchFiles();
-	}, [PREVIEW_IDS]);
+		// PREVIEW_IDS is rebuilt on every render; refetch the bundle only when the page changes
+		// eslint-disable-next-line react-hooks/exhaustive-deps
+	}, [page]);
 
 	const aboutRef = useRef<HTMLDivElement>(null);
 	const handleAboutClick = () => {
@@ -96,8 +100,14 @@ export default function DataPage() {
                 
 				{PREVIEW_IDS.map((id) => {
                     if (!previewMetadata[id]) return null;
+                    const tile = previewMetadata[id].thumbnail;
                     return (
 					<div className="flex flex-col gap-0.5 justify-center hover:shadow-sm shadow-white items-center border rounded bg-blue-950 p-4 cursor-pointer hover:bg-blue-900" onClick={() => navigate(`/case/${id}`)}>
+						{sprite && tile && (
+							<svg viewBox={`${tile.x} ${tile.y} ${tile.width} ${tile.height}`} preserveAspectRatio="xMidYMid slice" className="w-full h-32">
+								<image href={sprite} x={0} y={0} />
+							</svg>
+						)}
 						<p className="text-lg font-bold">Case {id}</p>
 						<p className="text-sm">Type: {id >= 9000 ? "Test" : "Train"} set</p>
 						<p className="text-sm">Age: {previewMetadata[id].age === 0 ? "-" : previewMetadata[id].age ?? "-"}</p>
@@ -12,6 +12,7 @@ export default function Homepage() {
 	const [previewMetadata, setPreviewMetadata] = useState<{
 		[key: string]: PreviewType;
 	}>({});
+	const [sprite, setSprite] = useState<string>("");
 
 	// const navigate = useNavigate();
 
@@ -24,9 +25,11 @@ export default function Homepage() {
 		const fetchFiles = async () => {
 			try {
 				const res = await fetch(
-					`${API_BASE}/api/get_preview/${PREVIEW_IDS.join(",")}`
+					`${API_BASE}/api/get_preview_bundle/${PREVIEW_IDS.join(",")}`
 				);
-				const data = await res.json();
+				const bundle = await res.json();
+				const data = bundle.cases;
+				setSprite(bundle.sprite);
 				for (const key in data) {
 					data[key]["age"] = Number(data[key]["age"]);
 					setPreviewMetadata((prev) => {
@@ -63,6 +66,7 @@ export default function Homepage() {
 								key={idx.toString()}
 								id={el}
 								previewMetadata={previewMetadata[el]}
+								sprite={sprite}
 							></Preview>
 						);
 					})}
@@ -47,6 +47,14 @@ export type FileContextType = {
 export type PreviewType = {
 	sex: string;
 	age: number;
+	thumbnail?: SpriteOffset | null;
+}
+
+export type SpriteOffset = {
+	x: number;
+	y: number;
+	width: number;
+	height: number;
 }
 
 export type Interactions = "Bounding Box" | "Scribble" | "Point" | "";
@@ -1,12 +1,22 @@
-from flask import Blueprint, send_file, make_response, request, jsonify
+from flask import Blueprint, send_file, make_response, request, jsonify, current_app, Response, stream_with_context
 from services.nifti_processor import NiftiProcessor
 from services.session_manager import SessionManager, generate_uuid
-from services.auto_segmentor import run_auto_segmentation
+from services.auto_segmentor import run_auto_segmentation, available_models
+from services.segmentation_scheduler import SegmentationScheduler
+from services.progress_store import ProgressStore
+from services.job_events import JobEvents, SHUTDOWN, format_sse
+from services.volume_store import VolumeStore
+from services.volume_pyramid import VolumePyramid
+from services.thumbnail_cache import ThumbnailCache, build_sprite_sheet
+from services.report_queue import ReportQueue
+from services.zip_stream import ZipArchiveCache
+from services.blob_store import BlobStore, link_or_copy, file_suffix
+from werkzeug.utils import secure_filename
 from models.application_session import ApplicationSession
 from models.combined_labels import CombinedLabels
 from models.base import db
 from constants import Constants
-import zipfile
+import base64
 import pandas as pd
 
 from pathlib import Path
@@ -17,6 +27,8 @@ from reportlab.lib.units import cm
 
 from sqlalchemy.orm import aliased
 import os
+import queue
+import math
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -29,7 +41,6 @@ from .utils import *
 api_blueprint = Blueprint('api', __name__)
 last_session_check = datetime.now()
 from flask import Blueprint, request, jsonify
-progress_tracker = {}  # {session_id: (start_time, expected_total_seconds)}
 
 
 from flask import request, jsonify
@@ -39,7 +50,6 @@ from scipy.ndimage import distance_transform_edt, label
 from collections import defaultdict
 from constants import Constants
 import os
-from openpyxl import load_workbook
 
 
 SESSIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "tmp")
@@ -48,42 +58,46 @@ os.makedirs(SESSIONS_DIR, exist_ok=True)
 @api_blueprint.route('/get_preview/<clabel_ids>', methods=['GET'])
 def get_preview(clabel_ids):
     # get age and thumbnail
-    clabel_ids = clabel_ids.split(",")
-    wb = load_workbook(os.path.join(Constants.PANTS_PATH, "data", "metadata.xlsx"))
-    sheet = wb["PanTS_metadata"]
-    res = {
-        x: {
-            "sex": "",
-            "age": ""
-        } for x in clabel_ids
-    }
+    return jsonify(get_preview_metadata(clabel_ids.split(",")))
+
+@api_blueprint.route('/get_preview_bundle/<clabel_ids>', methods=['GET'])
+def get_preview_bundle(clabel_ids):
+    """
+    Metadata and thumbnails of a page of cases in one response. Thumbnails are packed
+    into a single base64 PNG sprite sheet; each case carries its offsets in the sheet
+    (null when the case has no CT).
+    """
+    clabel_ids = [x for x in clabel_ids.split(",") if x]
+    if not clabel_ids or len(clabel_ids) > Constants.PREVIEW_BUNDLE_MAX_CASES:
+        return jsonify({"error": f"Request between 1 and {Constants.PREVIEW_BUNDLE_MAX_CASES} cases"}), 400
+    try:
+        [int(x) for x in clabel_ids]
+    except ValueError:
+        return jsonify({"error": "Case IDs must be integers"}), 400
+
+    res = get_preview_metadata(clabel_ids)
+    paths = ThumbnailCache.instance().get_or_render_many(clabel_ids)
+    tile_size = ThumbnailCache.instance().max_size
+    sprite, offsets = build_sprite_sheet(paths, tile_size)
     for clabel_id in clabel_ids:
-        for row in sheet.iter_rows(values_only=True):
-            if row[0] == get_panTS_id(clabel_id):
-                res[clabel_id]["sex"] = row[4]
-                res[clabel_id]["age"] = row[5]
-                break
+        res[clabel_id]["thumbnail"] = offsets[clabel_id]
 
-    return jsonify(res)
+    return jsonify({
+        "cases": res,
+        "tile_size": tile_size,
+        "sprite": "data:image/png;base64," + base64.b64encode(sprite).decode("ascii"),
+    })
 
 # if not preloaded
 @api_blueprint.route('/get_image_preview/<clabel_id>', methods=['GET'])
 def get_image_preview(clabel_id):
-    # get age and thumbnail
-    # subfolder = "LabelTr" if int(clabel_id) < 9000 else "LabelTe"
-    subfolder = "ImageTr" if int(clabel_id) < 9000 else "ImageTe"
-    # path = os.path.join(Constants.PANTS_PATH, "data", subfolder, get_panTS_id(clabel_id), Constants.COMBINED_LABELS_FILENAME)
-    # if not os.path.exists(path):
-    #     print(f"File not found: {path}. Making file")
-    #     npz_processor = NpzProcessor()
-    #     npz_processor.combine_labels(int(clabel_id))
-
-    path = os.path.join(Constants.PANTS_PATH, "data", subfolder, get_panTS_id(clabel_id), "ct.npz")
-    arr = np.load(path)["data"]
-    bytes = volume_to_png(arr)
+    # served from the on-disk thumbnail cache; misses are rendered and stored
+    path = ThumbnailCache.instance().get_or_render(clabel_id)
+    if path is None:
+        return jsonify({"error": f"No CT found for case {clabel_id}"}), 404
     return send_file(
-        bytes,
-        mimetype="image/png",   
+        path,
+        mimetype="image/png",
         as_attachment=False,
         download_name=f"{clabel_id}_slice.png"
     )
@@ -93,37 +107,144 @@ def get_image_preview(clabel_id):
 
 @api_blueprint.route('/get-label-colormap/<clabel_id>', methods=['GET'])
 def get_label_colormap(clabel_id):
-    subfolder = "LabelTr"
-    if not id_is_training(int(clabel_id)):
-        subfolder = "LabelTe"
-    
-    clabel_path = os.path.join(Constants.PANTS_PATH, "data", subfolder, get_panTS_id(int(clabel_id)),  'combined_labels.npz')
+    try:
+        color_map = get_case_colormap(clabel_id)
+        return jsonify(color_map)
+
+    except Exception as e:
+        print("[❌ EXCEPTION]", str(e))
+        return jsonify({"error": str(e)}), 500
 
-    if not os.path.exists(clabel_path):
-        print(f"File not found: {clabel_path}. Making file")
-        combine_label_npz(int(clabel_id))
 
+def float_arg(name):
+    """Optional query parameter as a finite float; a ValueError names the bad parameter."""
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        number = float(value)
+    except ValueError:
+        number = math.nan
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    return number
+
+
+@api_blueprint.route('/get_slice/<clabel_id>/<axis>/<index>', methods=['GET'])
+def get_slice(clabel_id, axis, index):
+    """
+    Render one CT slice server-side.
+
+    Query parameters:
+        wc, ww   -- window centre/width in HU (default: min/max of the slice)
+        overlay  -- "true" to blend the case's label colormap on top
+        format   -- "png" (default) or "webp"
+    """
+    axis = SLICE_AXES.get(axis.lower(), axis)
+    try:
+        axis = int(axis)
+        index = int(index)
+    except ValueError:
+        return jsonify({"error": "axis and index must be integers"}), 400
     try:
-        clabel_array = np.load(clabel_path)["data"]
-        print("[DEBUG] NPZ loaded, shape =", clabel_array.shape)
+        window_center = float_arg("wc")
+        window_width = float_arg("ww")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if window_width is not None and window_width <= 0:
+        return jsonify({"error": f"ww must be positive, got {window_width}"}), 400
+
+    image_format = request.args.get("format", "png").lower()
+    if image_format not in ("png", "webp"):
+        return jsonify({"error": f"Unsupported format: {image_format}"}), 400
+    with_overlay = request.args.get("overlay", "false").lower() == "true"
+
+    ct_path = get_ct_npz_path(clabel_id)
+    if not os.path.exists(ct_path):
+        return jsonify({"error": f"Could not find CT for case {clabel_id}"}), 404
+
+    try:
+        volume = VolumeStore.instance().load(ct_path)
+        if axis not in (0, 1, 2) or not 0 <= index < volume.shape[axis]:
+            return jsonify({"error": f"Slice {axis}/{index} is out of bounds for shape {volume.shape}"}), 400
+
+        labels, color_map = None, None
+        if with_overlay:
+            color_map = get_case_colormap(clabel_id)
+            labels = VolumeStore.instance().load(get_clabel_npz_path(clabel_id))
+
+        buf = volume_to_image(
+            volume, axis=axis, index=index,
+            window_center=window_center, window_width=window_width,
+            labels=labels, color_map=color_map,
+            image_format=image_format.upper()
+        )
+        return send_file(
+            buf,
+            mimetype=f"image/{image_format}",
+            as_attachment=False,
+            download_name=f"{clabel_id}_{axis}_{index}.{image_format}"
+        )
+
+    except Exception as e:
+        print(f"❌ [get_slice ERROR] {e}")
+        return jsonify({"error": str(e)}), 500
 
-        filled_array = fill_voids_with_nearest_label(clabel_array)
-        print("[DEBUG] fill_voids_with_nearest_label done")
 
-        adjacency = build_adjacency_graph(filled_array)
-        print("[DEBUG] build_adjacency_graph done")
 
-        unique_labels = sorted(adjacency.keys())
-        color_map, color_usage_count = assign_colors_with_high_contrast(unique_labels, adjacency)
-        print("[DEBUG] Color map generated:", color_map, color_usage_count)
 
-        return jsonify(color_map)
+def get_case_pyramid(clabel_id, kind):
+    """Return (pyramid, manifest) for a case, building the pyramid first if it is missing or stale."""
+    npz_path = get_ct_npz_path(clabel_id) if kind == "ct" else get_clabel_npz_path(clabel_id)
+    if kind == "labels" and not os.path.exists(npz_path):
+        combine_label_npz(int(clabel_id))
+    if not os.path.exists(npz_path):
+        return None, None
+    pyramid = VolumePyramid.for_case(clabel_id, kind)
+    manifest = pyramid.build_from_npz(npz_path, is_label=(kind == "labels"))
+    return pyramid, manifest
+
 
+@api_blueprint.route('/pyramid/<clabel_id>/<kind>/manifest', methods=['GET'])
+def get_pyramid_manifest(clabel_id, kind):
+    if kind not in ("ct", "labels"):
+        return jsonify({"error": "kind must be 'ct' or 'labels'"}), 400
+    try:
+        pyramid, manifest = get_case_pyramid(clabel_id, kind)
+        if manifest is None:
+            return jsonify({"error": f"Could not find {kind} volume for case {clabel_id}"}), 404
+        manifest = {k: v for k, v in manifest.items() if k != "source_mtime_ns"}
+        return jsonify(manifest)
     except Exception as e:
-        print("[❌ EXCEPTION]", str(e))
+        print(f"❌ [pyramid manifest ERROR] {e}")
         return jsonify({"error": str(e)}), 500
 
 
+@api_blueprint.route('/pyramid/<clabel_id>/<kind>/<int:level>/<int:cx>/<int:cy>/<int:cz>', methods=['GET'])
+def get_pyramid_chunk(clabel_id, kind, level, cx, cy, cz):
+    """
+    One gzip-encoded, C-order chunk of a pyramid level. The chunk's shape and dtype are
+    sent in X-Chunk-Shape / X-Chunk-Dtype; level is the downsampling factor (1, 2, 4).
+    """
+    if kind not in ("ct", "labels"):
+        return jsonify({"error": "kind must be 'ct' or 'labels'"}), 400
+    try:
+        pyramid, manifest = get_case_pyramid(clabel_id, kind)
+        if manifest is None:
+            return jsonify({"error": f"Could not find {kind} volume for case {clabel_id}"}), 404
+        chunk_path = pyramid.chunk_path(level, cx, cy, cz)
+        if not os.path.exists(chunk_path):
+            return jsonify({"error": f"No chunk {cx}/{cy}/{cz} at level {level}"}), 404
+
+        response = make_response(send_file(chunk_path, mimetype='application/octet-stream'))
+        response.headers['Content-Encoding'] = 'gzip'
+        response.headers['X-Chunk-Shape'] = ",".join(str(n) for n in pyramid.chunk_shape(manifest, level, cx, cy, cz))
+        response.headers['X-Chunk-Dtype'] = manifest["dtype"]
+        response.headers['Access-Control-Expose-Headers'] = 'X-Chunk-Shape, X-Chunk-Dtype'
+        return response
+    except Exception as e:
+        print(f"❌ [pyramid chunk ERROR] {e}")
+        return jsonify({"error": str(e)}), 500
 
 
 @api_blueprint.before_request
@@ -144,20 +265,72 @@ def home():
 
 @api_blueprint.route('/progress/<session_id>', methods=['GET'])
 def get_progress(session_id):
-    if session_id not in progress_tracker:
-        return jsonify({"progress": 100})
-
-    start_time, expected_time, done_flag = progress_tracker[session_id]
-    elapsed = (datetime.now() - start_time).total_seconds()
-
-    if done_flag:
-        if progress < 100:
-            progress = 100
-    else:
-        progress = min(95, int((elapsed / expected_time) * 100))
+    # read from the database, so it does not matter which server process ran the job
+    return jsonify(session_progress(session_id))
+
+
+
+def session_progress(session_id):
+    job = SegmentationScheduler.instance().latest(session_id)
+    db.session.rollback()  # end the read transaction so the next check sees new commits
+    if job is None:
+        return {"progress": 0, "status": "pending"}
+    return ProgressStore.instance().progress(job)
+
+
+def progress_events(session_id, heartbeat=None, poll=None, max_seconds=None):
+    """
+    Server-Sent Events for the job of session_id: a "progress" event whenever its status
+    or percentage changes, then "complete" once it is done or failed. Changes made in
+    this process arrive through JobEvents right away, jobs run by other processes are
+    re-checked every poll seconds. A ": heartbeat" comment is sent when nothing else
+    was for heartbeat seconds, which also notices closed connections. The stream ends
+    with "shutdown" when the server stops and "timeout" after max_seconds; browsers
+    reconnect on their own after the advertised retry delay.
+    """
+    heartbeat = heartbeat or Constants.PROGRESS_STREAM_HEARTBEAT_SECONDS
+    poll = poll or Constants.PROGRESS_STREAM_POLL_SECONDS
+    max_seconds = max_seconds or Constants.PROGRESS_STREAM_MAX_SECONDS
+    events = JobEvents.instance()
+    subscriber = events.subscribe(session_id)
+    try:
+        started = last_sent = time.monotonic()
+        last_state = None
+        retry = 3000
+        while True:
+            progress = session_progress(session_id)
+            state = (progress["status"], progress["progress"])
+            if state != last_state:
+                yield format_sse(progress, event="progress", retry=retry)
+                retry, last_state, last_sent = None, state, time.monotonic()
+                if progress["status"] in ("done", "failed"):
+                    yield format_sse(progress, event="complete")
+                    return
+
+            now = time.monotonic()
+            if now - started >= max_seconds:
+                yield format_sse({"session_id": session_id}, event="timeout")
+                return
+            try:
+                message = subscriber.get(timeout=max(min(poll, heartbeat - (now - last_sent), max_seconds - (now - started)), 0))
+            except queue.Empty:
+                message = None
+            if message is SHUTDOWN:
+                yield format_sse({"session_id": session_id}, event="shutdown")
+                return
+            if time.monotonic() - last_sent >= heartbeat:
+                yield ": heartbeat\n\n"
+                last_sent = time.monotonic()
+    finally:
+        events.unsubscribe(session_id, subscriber)
 
-    return jsonify({"progress": progress})
 
+@api_blueprint.route('/progress/stream/<session_id>', methods=['GET'])
+def stream_progress(session_id):
+    response = Response(stream_with_context(progress_events(session_id)), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"  # let nginx pass events through unbuffered
+    return response
 
 
 @api_blueprint.route('/upload', methods=['POST'])
@@ -219,98 +392,145 @@ def get_mask_data():
         return jsonify({"error": "Missing sessionKey"}), 400
 
     result = get_mask_data_internal(session_key)
-    return jsonify(result)
+    # only the metrics are public; label_stats, input_hash and fingerprint are cache internals
+    return jsonify({key: result[key] for key in ("organ_metrics", "error") if key in result})
 
   
+def send_nifti(nifti_path, download_name):
+    """
+    Send a stored .nii.gz with Range support. By default it is labelled
+    Content-Encoding: gzip so viewers receive the decoded NIfTI; with ?mode=file it is
+    served as a plain application/gzip resource so byte ranges map onto the stored file.
+    """
+    as_file = request.args.get("mode", "encoded") == "file"
+    response = send_file_ranged(
+        nifti_path,
+        mimetype='application/gzip',
+        download_name=download_name if as_file else None,
+        content_encoding=None if as_file else 'gzip'
+    )
+    response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
+    response.headers['Cross-Origin-Embedder-Policy'] = 'require-corp'
+    response.headers['Access-Control-Expose-Headers'] = 'Accept-Ranges, Content-Range, Content-Length, ETag'
+    return response
+
+
 @api_blueprint.route('/get-main-nifti/<clabel_id>', methods=['GET'])
 def get_main_nifti(clabel_id):
     subfolder = "ImageTr" if int(clabel_id) < 9000 else "ImageTe" 
     main_nifti_path = f"{Constants.PANTS_PATH}/data/{subfolder}/{get_panTS_id(clabel_id)}/{Constants.MAIN_NIFTI_FILENAME}"
 
-    if os.path.exists(main_nifti_path):
-        response = make_response(send_file(main_nifti_path, mimetype='application/gzip'))
-
-        response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
-        response.headers['Cross-Origin-Embedder-Policy'] = 'require-corp'
-        response.headers['Content-Encoding'] = 'gzip'
-
-    else:
+    if not os.path.exists(main_nifti_path):
         print(f"Could not find filepath: {main_nifti_path}. Creating a new one")
         npz_path = main_nifti_path.replace(".nii.gz", ".npz")
         if not os.path.exists(npz_path):   
             return jsonify({"error": "Could not find npz filepath"}), 404
         npz_processor = NpzProcessor()
         npz_processor.npz_to_nifti(int(clabel_id), combined_label=False, save=True)  
-        
-        response = make_response(send_file(main_nifti_path, mimetype='application/gzip'))
 
-        response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
-        response.headers['Cross-Origin-Embedder-Policy'] = 'require-corp'
-        response.headers['Content-Encoding'] = 'gzip'
+    return send_nifti(main_nifti_path, download_name=f"{get_panTS_id(clabel_id)}_{Constants.MAIN_NIFTI_FILENAME}")
 
-    return response
 
 
 
+def report_inputs(id):
+    """Files a case report is built from; their content hash keys the report cache."""
+    if not os.path.exists(get_clabel_npz_path(id)):
+        NpzProcessor().combine_labels(int(id), save=True)
+    return [
+        get_ct_npz_path(id),
+        get_clabel_npz_path(id),
+        os.getenv("TEMPLATE_PATH", "report_template_3.pdf"),
+        f"{SESSIONS_DIR}/{id}/info.csv",
+    ]
 
-@api_blueprint.route('/get-report/<id>', methods=['POST'])
-def get_report(id):
+
+def build_case_report(id, output_pdf_path):
+    """Generate the PDF report of case id into output_pdf_path (runs on the report queue)."""
+    organ_metadata = {}
     try:
-        try:
-            organ_metrics = get_mask_data_internal(id)
-            if organ_metrics.get("error"):
-                organ_metrics = get_mask_data_internal(id, fallback=True)
-            organ_metrics = organ_metrics.get("organ_metrics", [])
-        except Exception as e:
-            pass
-            # return jsonify({"error": f"Error loading organ metrics: {str(e)}"}), 500
-
-        subfolder = "ImageTr" if int(id) < 9000 else "ImageTe"
-        label_subfolder = "LabelsTr" if int(id) < 9000 else "LabelsTe"
-
-        base_path = f"{SESSIONS_DIR}/{id}"
-        ct_path = f"{Constants.PANTS_PATH}/data/{subfolder}/{get_panTS_id(id)}/{Constants.MAIN_NIFTI_FILENAME}"
-        masks = f"{Constants.PANTS_PATH}/data/{label_subfolder}/{get_panTS_id(id)}/{Constants.COMBINED_LABELS_NIFTI_FILENAME}"
-        
-        npz_processor = NpzProcessor()
-        if (not os.path.exists(ct_path)):
-            npz_processor.npz_to_nifti(int(id), combined_label=False, save=True)
+        organ_metadata = get_mask_data_internal(id)
+        if organ_metadata.get("error"):
+            organ_metadata = get_mask_data_internal(id, fallback=True)
+    except Exception as e:
+        pass
+        # return jsonify({"error": f"Error loading organ metrics: {str(e)}"}), 500
+
+    subfolder = "ImageTr" if int(id) < 9000 else "ImageTe"
+    label_subfolder = "LabelTr" if int(id) < 9000 else "LabelTe"
+
+    base_path = f"{SESSIONS_DIR}/{id}"
+    ct_path = f"{Constants.PANTS_PATH}/data/{subfolder}/{get_panTS_id(id)}/{Constants.MAIN_NIFTI_FILENAME}"
+    masks = f"{Constants.PANTS_PATH}/data/{label_subfolder}/{get_panTS_id(id)}/{Constants.COMBINED_LABELS_NIFTI_FILENAME}"
+    
+    npz_processor = NpzProcessor()
+    if (not os.path.exists(ct_path)):
+        npz_processor.npz_to_nifti(int(id), combined_label=False, save=True)
 
-        if (not os.path.exists(masks)): 
+    if (not os.path.exists(masks)): 
+        if not os.path.exists(get_clabel_npz_path(id)):
             npz_processor.combine_labels(int(id), save=True)
-            npz_processor.npz_to_nifti(int(id), combined_label=True, save=True)
-            
-            
-            
-        template_pdf = os.getenv("TEMPLATE_PATH", "report_template_3.pdf")
-
-        temp_pdf_path = f"{SESSIONS_DIR}/{id}_temp.pdf"
-        output_pdf_path = f"{SESSIONS_DIR}/{id}_final.pdf"
-
-        extracted_data = None
-        column_headers = None
-        try:
-            csv_path = f"{base_path}/info.csv"
-            df = pd.read_csv(csv_path)
-            extracted_data = df.iloc[0] if len(df) > 0 else None
-            column_headers = df.columns.tolist()
-        except Exception:
-            pass
-
-        generate_pdf_with_template(
-            output_pdf=output_pdf_path,
-            folder_name=id,
-            ct_path=ct_path,
-            mask_path=masks,
-            template_pdf=template_pdf,
-            temp_pdf_path=temp_pdf_path,
-            session_key=id,
-            extracted_data=extracted_data,
-            column_headers=column_headers
-        )
+        npz_processor.npz_to_nifti(int(id), combined_label=True, save=True)
+
+    template_pdf = os.getenv("TEMPLATE_PATH", "report_template_3.pdf")
+    temp_pdf_path = f"{output_pdf_path}.content.pdf"
+
+    extracted_data = None
+    column_headers = None
+    try:
+        csv_path = f"{base_path}/info.csv"
+        df = pd.read_csv(csv_path)
+        extracted_data = df.iloc[0] if len(df) > 0 else None
+        column_headers = df.columns.tolist()
+    except Exception:
+        pass
+
+    generate_pdf_with_template(
+        output_pdf=output_pdf_path,
+        folder_name=id,
+        ct_path=ct_path,
+        mask_path=masks,
+        template_pdf=template_pdf,
+        temp_pdf_path=temp_pdf_path,
+        id=id,
+        extracted_data=extracted_data,
+        column_headers=column_headers,
+        label_stats=organ_metadata.get("label_stats")
+    )
+
+
+def submit_report(id):
+    """Queue the report of case id (no-op if it is cached or queued); returns the job ID."""
+    app = current_app._get_current_object()
+
+    def build(output_pdf_path):
+        with app.app_context():
+            build_case_report(id, output_pdf_path)
+
+    return ReportQueue.instance().submit(id, report_inputs(id), build)
+
+
+def report_status_response(status):
+    api_base = f"{Constants.BASE_PATH.rstrip('/')}/api"
+    return dict(
+        status,
+        status_url=f"{api_base}/report/status/{status['job_id']}",
+        download_url=f"{api_base}/report/download/{status['job_id']}"
+    )
+
+
+@api_blueprint.route('/get-report/<id>', methods=['POST'])
+def get_report(id):
+    # synchronous variant: waits for the queued job, returns at once for cached reports
+    try:
+        report_queue = ReportQueue.instance()
+        job_id = submit_report(id)
+        status = report_queue.wait(job_id)
+        if status["status"] != "done":
+            return jsonify({"error": f"Unhandled error: {status.get('error')}"}), 500
 
         return send_file(
-            output_pdf_path,
+            report_queue.report_path(job_id),
             mimetype="application/pdf",
             as_attachment=True,
             download_name=f"report_{id}.pdf"
@@ -319,9 +539,48 @@ def get_report(id):
     except Exception as e:
         return jsonify({"error": f"Unhandled error: {str(e)}"}), 500
 
-    finally:
-        if os.path.exists(temp_pdf_path):
-            os.remove(temp_pdf_path)
+
+@api_blueprint.route('/report/<id>', methods=['POST'])
+def submit_report_job(id):
+    if not str(id).isdigit():
+        return jsonify({"error": "Case ID must be an integer"}), 400
+    try:
+        job_id = submit_report(id)
+    except Exception as e:
+        return jsonify({"error": f"Could not queue report: {str(e)}"}), 500
+
+    status = ReportQueue.instance().status(job_id)
+    return jsonify(report_status_response(status)), 200 if status["status"] == "done" else 202
+
+
+@api_blueprint.route('/report/status/<job_id>', methods=['GET'])
+def get_report_status(job_id):
+    status = ReportQueue.instance().status(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown report job {job_id}"}), 404
+    return jsonify(report_status_response(status))
+
+
+@api_blueprint.route('/report/download/<job_id>', methods=['GET'])
+def download_report(job_id):
+    report_queue = ReportQueue.instance()
+    status = report_queue.status(job_id)
+    if status is None:
+        return jsonify({"error": f"Unknown report job {job_id}"}), 404
+    if status["status"] == "error":
+        return jsonify(report_status_response(status)), 500
+    if status["status"] != "done":
+        response = jsonify(report_status_response(status))
+        response.status_code = 202
+        response.headers["Retry-After"] = "2"
+        return response
+
+    return send_file(
+        report_queue.report_path(job_id),
+        mimetype="application/pdf",
+        as_attachment=True,
+        download_name=f"report_{job_id.rsplit('-', 1)[0]}.pdf"
+    )
 
 
 @api_blueprint.route('/get-segmentations/<combined_labels_id>', methods=['GET'])
@@ -339,34 +598,11 @@ def get_segmentations(combined_labels_id):
             
         npz_processor.npz_to_nifti(int(combined_labels_id), combined_label=True, save=True)   
 
-    img = nib.load(nifti_path)
-    data = img.get_fdata()
-    if img.get_data_dtype() != np.uint8:
-        print("⚠️ Detected float label map, converting to uint8 for Niivue compatibility...")
-
     try:
-        img = nib.load(nifti_path)
-        data = img.get_fdata()
-
-        if img.get_data_dtype() != np.uint8:
-            
-            data_uint8 = data.astype(np.uint8)
-            new_img = nib.Nifti1Image(data_uint8, img.affine, header=img.header)
-            new_img.set_data_dtype(np.uint8)
+        if nib.load(nifti_path).get_data_dtype() != np.uint8:
+            print("⚠️ Detected float label map, Niivue expects uint8 labels")
 
-            converted_path = nifti_path#.replace(".nii.gz", "_uint8.nii.gz")
-
-            if not os.path.exists(converted_path):
-                nib.save(new_img, converted_path)
-        else:
-            converted_path = nifti_path
-
-        response = make_response(send_file(converted_path, mimetype='application/gzip'))
-        response.headers['Cross-Origin-Opener-Policy'] = 'same-origin'
-        response.headers['Cross-Origin-Embedder-Policy'] = 'require-corp'
-        response.headers['Content-Encoding'] = 'gzip'
-
-        return response
+        return send_nifti(nifti_path, download_name=f"{get_panTS_id(combined_labels_id)}_{Constants.COMBINED_LABELS_NIFTI_FILENAME}")
 
     except Exception as e:
         print(f"❌ [get-segmentations ERROR] {e}")
@@ -392,6 +628,23 @@ def terminate_session():
         return jsonify({'message': 'Session does not exist!'})
 
 
+def zip_response(key, members, download_name):
+    """
+    Zip download of members ((arcname, path) pairs): the cached archive when there is
+    one (with range and conditional request support), otherwise streamed while it is
+    written and cached for the next download.
+    """
+    cache = ZipArchiveCache.instance()
+    cached_path = cache.get(key, members)
+    if cached_path is not None:
+        return send_file(cached_path, mimetype="application/zip", as_attachment=True,
+                         download_name=download_name, conditional=True)
+
+    response = Response(cache.stream(key, members), mimetype="application/zip")
+    response.headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
+    return response
+
+
 @api_blueprint.route('/download/<id>', methods=['GET'])
 def download_segmentation_zip(id):
     try:
@@ -401,23 +654,8 @@ def download_segmentation_zip(id):
         if not os.path.exists(outputs_ct_folder):
             return jsonify({"error": "Outputs/ct folder not found"}), 404
         
-        files = list(outputs_ct_folder.glob("*"))
-
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for file_path in files:
-                zip_file.write(file_path, arcname=file_path.name) 
-
-        zip_buffer.seek(0)  # rewind
-
-        return send_file(
-            zip_buffer,
-            mimetype="application/zip",
-            as_attachment=True,
-            download_name=f"case_{id}_segmentations.zip"
-        )
-
-
+        members = [(file_path.name, str(file_path)) for file_path in sorted(outputs_ct_folder.glob("*")) if file_path.is_file()]
+        return zip_response(f"{get_panTS_id(id)}_segmentations", members, f"case_{id}_segmentations.zip")
 
     except Exception as e:
         print(f"❌ [Download Error] {e}")
@@ -427,10 +665,6 @@ def download_segmentation_zip(id):
 def start_session():
     session_id = generate_uuid()
     SessionManager.instance().register_session(session_id)
-
-    start_time = datetime.now()
-    expected_time = 35 
-    progress_tracker[session_id] = (start_time, expected_time, False)
     #print(session_id)
     print('start_session',session_id)
     return jsonify({"session_id": session_id}), 200
@@ -450,65 +684,89 @@ def auto_segment(session_id):
     # Check if model name is valid
     if model_name is None:
         return {"error": "MODEL_NAME is required."}, 400
+    if model_name not in available_models():
+        return {"error": f"Unknown MODEL_NAME {model_name}, expected one of {available_models()}."}, 400
+    try:
+        priority = int(request.form.get("PRIORITY", 0))
+    except ValueError:
+        return {"error": "PRIORITY must be an integer."}, 400
     # Step 1: Create a unique session directory to store CT and mask
     session_path = os.path.join(SESSIONS_DIR, session_id)
     os.makedirs(session_path, exist_ok=True)
 
-    # Step 2: Save CT file under this session
-    input_path = os.path.join(session_path, ct_file.filename)
-    ct_file.save(input_path)
+    # Step 2: Store the CT once by content hash (hashed while it is written) and link it into the session
+    input_hash, blob_path = BlobStore.instance().put_stream(ct_file.stream, suffix=file_suffix(ct_file.filename))
+    input_path = os.path.join(session_path, secure_filename(ct_file.filename) or f"ct{file_suffix(ct_file.filename)}")
+    link_or_copy(blob_path, input_path)
 
-    def do_segmentation_and_zip():
-        time.sleep(10)
-        output_mask_dir = run_auto_segmentation(input_path, session_dir=session_path, model=model_name)
-
-        if output_mask_dir is None or not os.path.exists(output_mask_dir):
-            print(f"❌ Auto segmentation failed for session {session_id}")
-            return ##the logic still needs to be improved in the future. when output_mask_dir is none here, no error output at user's end
-
-        zip_path = os.path.join(session_path, "auto_masks.zip")
-        with zipfile.ZipFile(zip_path, 'w') as zipf:
-            for filename in os.listdir(output_mask_dir):
-                if filename.endswith(".nii.gz"):
-                    abs_path = os.path.join(output_mask_dir, filename)
-                    zipf.write(abs_path, arcname=filename)
+    # Step 3: queue the model run; the scheduler bounds concurrent runs, zips the masks and
+    # answers a CT segmented by the same model before from its cache
+    job = SegmentationScheduler.instance().submit(session_id, input_path, model_name, priority=priority,
+                                                  input_hash=input_hash)
+    print("[Server] auto_segment request is returning now")
+    message = "Segmentation finished (cached)" if job["cached"] else "Segmentation started"
+    return jsonify({"message": message, "job_id": job["job_id"], "status": job["status"]}), 200
 
-        start_time, expected_time, _ = progress_tracker[session_id]
-        progress_tracker[session_id] = (start_time, expected_time, True)
-        progress_tracker.pop(session_id, None)
 
-        
-        
-        print(f"✅ Finished segmentation and zipping for session {session_id}")
+@api_blueprint.route('/auto_segment/status/<session_id>', methods=['GET'])
+def auto_segment_status(session_id):
+    job = SegmentationScheduler.instance().latest(session_id)
+    if job is None:
+        return jsonify({"error": f"No segmentation job for session {session_id}"}), 404
+    job.pop("output_path", None)
+    job.pop("zip_path", None)
+    return jsonify(job)
 
-    #threading.Thread(target=do_segmentation_and_zip).start()
-    threading.Thread(target=do_segmentation_and_zip, ).start()
-    print("[Server] auto_segment request is returning now")
-    return jsonify({"message": "Segmentation started"}), 200
 
+def finished_job(session_id):
+    job = SegmentationScheduler.instance().latest(session_id)
+    db.session.rollback()  # end the read transaction so the next check sees new commits
+    return job if job is not None and job["status"] in ("done", "failed") else None
 
 
 @api_blueprint.route('/get_result/<session_id>', methods=['GET'])
 def get_result(session_id):
-    session_path = os.path.join(SESSIONS_DIR, session_id)
-    zip_path = os.path.join(session_path, "auto_masks.zip")
-
-    wait_for_file(zip_path, timeout=30)
+    """
+    The mask zip of the session's segmentation job, sent as soon as the job is done.
+    With ?wait=<seconds> (up to RESULT_MAX_WAIT_SECONDS) the request is held until the
+    job finishes, woken by the job's notification in this process or the database
+    re-check for jobs of other processes. A result that is not ready is answered with
+    202 Accepted, the job's progress and a Retry-After derived from its ETA.
+    """
+    try:
+        wait = min(max(float(request.args.get("wait", 0)), 0), Constants.RESULT_MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "wait must be a number of seconds"}), 400
+
+    job = SegmentationScheduler.instance().latest(session_id)
+    zip_path = os.path.join(SESSIONS_DIR, session_id, "auto_masks.zip")
+    if job is None and not os.path.exists(zip_path):
+        return jsonify({"error": f"No segmentation job for session {session_id}"}), 404
+
+    if job is not None:
+        job = JobEvents.instance().wait_for(session_id, lambda: finished_job(session_id), timeout=wait,
+                                            poll=Constants.PROGRESS_STREAM_POLL_SECONDS) \
+            or SegmentationScheduler.instance().latest(session_id)
+        if job["status"] == "failed":
+            return jsonify({"error": job["error"] or "Auto segmentation failed", "status": "failed"}), 500
+        if job["status"] != "done":
+            progress = ProgressStore.instance().progress(job)
+            retry_after = math.ceil(min(max(progress["eta_seconds"], 1), Constants.RESULT_RETRY_AFTER_MAX_SECONDS))
+            response = jsonify(dict(progress, session_id=session_id, retry_after=retry_after))
+            response.status_code = 202
+            response.headers["Retry-After"] = str(retry_after)
+            return response
+        zip_path = job["zip_path"] or zip_path
 
     response = send_file(
         zip_path,
         as_attachment=True,
-        download_name="auto_masks.zip"
+        download_name="auto_masks.zip",
+        conditional=True
     )
     response.headers["X-Session-Id"] = session_id
     return response
 
-#
-#@api_blueprint.route('/progress_end/<session_id>', methods=['GET'])
-#def progress_end(session_id):
-#    progress_tracker.pop(session_id, None)
-#    return jsonify({"message": "Progress End"}), 200
-
 @api_blueprint.route('/ping', methods=['GET'])
 def ping():
     return jsonify({"message": "pong"}), 200
@@ -1,4 +1,5 @@
-from flask import Blueprint, send_file, make_response, request, jsonify
+from flask import Blueprint, send_file, make_response, request, jsonify, Response
+from werkzeug.http import http_date, parse_range_header, parse_etags
 from services.nifti_processor import NiftiProcessor
 from services.session_manager import SessionManager, generate_uuid
 from services.auto_segmentor import run_auto_segmentation
@@ -20,15 +21,22 @@ import numpy as np
 import nibabel as nib
 from scipy.ndimage import distance_transform_edt
 from collections import defaultdict
-from services.npz_processor import NpzProcessor
-from PIL import Image
-from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import threading
+from services.npz_processor import NpzProcessor, get_ct_npz_path, get_clabel_npz_path, case_organ_intensities
+from services.volume_store import VolumeStore
+from services.colormap_cache import ColormapCache
+from services.slice_renderer import SLICE_AXES, window_slice, overlay_labels, volume_to_image
+from PIL import Image, ImageColor
+from reportlab.lib.utils import ImageReader
+from services.key_images import render_key_image, key_images, RED, YELLOW
+from services.metadata_index import MetadataIndex
+from services.organ_metrics import label_statistics, summarise_organs, LabelStatistics, as_label_array
+from services.organ_metadata import OrganMetadataStore
 # Track last session validation time
 last_session_check = datetime.now()
 
-# Progress tracking structure: {session_id: (start_time, expected_total_seconds)}
-progress_tracker = {}
-
 def id_is_training(index):
     return index < 9000
 
@@ -44,6 +52,22 @@ def get_panTS_id(index):
     cur_case_id = "PanTS_" + cur_case_id    
     return cur_case_id
 
+def get_preview_metadata(clabel_ids):
+    """Sex and age of each case for the preview cards; blanks for unlisted cases."""
+    metadata_index = MetadataIndex.instance()
+    res = {
+        x: {
+            "sex": "",
+            "age": ""
+        } for x in clabel_ids
+    }
+    for clabel_id in clabel_ids:
+        row = metadata_index.get(get_panTS_id(clabel_id))
+        if row is not None:
+            res[clabel_id]["sex"] = row["sex"]
+            res[clabel_id]["age"] = row["age"]
+    return res
+
 def clean_nan(obj):
     """Recursively replace NaN with None for JSON serialization."""
     if isinstance(obj, dict):
@@ -64,22 +88,52 @@ def organname_to_name(filename):
     name = filename.replace(".nii.gz", "").replace("_", " ")
     return name.title()
 
+def compute_case_organ_metadata(case_id):
+    """Organ metrics of a PanTS case straight from its npz volumes."""
+    panTS_id = get_panTS_id(case_id)
+    spacing = MetadataIndex.instance().spacing(panTS_id)
+    if not spacing:
+        raise ValueError(f"Could not find metadata for PanTS ID: {panTS_id}")
+    ct_array = VolumeStore.instance().load(get_ct_npz_path(case_id))
+    clabel_array = VolumeStore.instance().load(get_clabel_npz_path(case_id))
+
+    organ_metadata, stats = summarise_organs(
+        clabel_array, ct_array, case_organ_intensities(case_id), np.prod(spacing) / 1000
+    )
+    organ_metadata["label_stats"] = stats.to_dict()
+    return clean_nan(organ_metadata)
+
 def get_mask_data_internal(id, fallback=False):
-    """Retrieve or compute organ metadata from NIfTI and mask paths for a session."""
+    """
+    Organ metadata of a PanTS case (numeric id) or an upload session (session id).
+    Served from CombinedLabels.organ_metadata and only recomputed when the CT or labels
+    changed; fallback=True forces a recompute.
+    """
     try:
-        subfolder = "ImageTr" if id < 9000 else "ImageTe"
-        label_subfolder = "LabelTr" if id < 9000 else "LabelTe"
-        main_nifti_path = f"{Constants.PANTS_PATH}/data/{subfolder}/{get_panTS_id(id)}/{Constants.MAIN_NIFTI_FILENAME}"
-        combined_labels_path = f"{Constants.PANTS_PATH}/data/{subfolder}/{get_panTS_id(id)}/{Constants.COMBINED_LABELS_NIFTI_FILENAME}"
-        print(f"[INFO] Processing NIFTI for id {id}")
-        nifti_processor = NiftiProcessor(main_nifti_path, combined_labels_path)
-        # nifti_processor.set_organ_intensities(organ_intensities)
-        # organ_metadata = nifti_processor.calculate_metrics()
-        # organ_metadata = clean_nan(organ_metadata)
-
-        # stmt = db.select(CombinedLabels).where(CombinedLabels.combined_labels_id == row.combined_labels_id)
+        store = OrganMetadataStore.instance()
+        if str(id).isdigit():
+            case_id = int(id)
+            ct_path, clabel_path = get_ct_npz_path(case_id), get_clabel_npz_path(case_id)
+            if not os.path.exists(clabel_path):
+                NpzProcessor().combine_labels(case_id, save=True)
+            print(f"[INFO] Loading organ metadata for case {case_id}")
+            return store.get(
+                get_panTS_id(case_id), [ct_path, clabel_path],
+                lambda: compute_case_organ_metadata(case_id),
+                organ_intensities=case_organ_intensities(case_id), force=fallback
+            )
 
-        return organ_metadata
+        session = SessionManager.instance().get_session(id)
+        if not isinstance(session, ApplicationSession) or session.combined_labels_id is None:
+            return {"error": f"No combined labels found for session {id}"}
+        row = store.get_row(session.combined_labels_id)
+        if row is None:
+            return {"error": f"No combined labels found for session {id}"}
+        nifti_processor = NiftiProcessor(session.main_nifti_path, row.combined_labels_path, organ_intensities=row.organ_intensities)
+        return store.get(
+            row.combined_labels_id, [session.main_nifti_path, row.combined_labels_path],
+            lambda: clean_nan(nifti_processor.calculate_metrics()), force=fallback
+        )
 
     except Exception as e:
         print(f"[ERROR] get_mask_data_internal: {e}")
@@ -92,131 +146,407 @@ def generate_distinct_colors(n):
     RGB_tuples = [tuple(int(c * 255) for c in colorsys.hsv_to_rgb(*hsv)) for hsv in HSV_tuples]
     return RGB_tuples
 
-def fill_voids_with_nearest_label(label_array):
-    """Fill all 0-valued voxels with the nearest non-zero label."""
-    mask = label_array == 0
-    if not np.any(mask):
-        return label_array
+# scipy's EDT working set per voxel: float64 distances, int32 (3,) feature indices, bool mask
+_EDT_BYTES_PER_VOXEL = 8 + 3 * 4 + 1
+
+def _fill_window(window):
+    """Nearest-label fill of a whole window with scipy's EDT."""
+    mask = window == 0
+    _, indices = distance_transform_edt(mask, return_indices=True)
+    filled = window.copy()
+    filled[mask] = window[tuple(indices[:, mask])]
+    return filled
+
+def _slab_bytes_per_voxel(dtype):
+    """Working set of _fill_slab per voxel: int64 weights in and out, the line stacks and two label copies."""
+    return 3 * 8 + 2 * np.dtype(dtype).itemsize
+
+def _next_labels(label_array, next_pos, next_label, last_pos, stop):
+    """
+    Move the per-column pointer to the first labelled voxel at or below plane `stop`.
+    Only columns whose pointer fell behind and that still have a label ahead are
+    scanned, so every plane is read at most once over the whole sweep.
+    """
+    pending = np.flatnonzero((next_pos < stop) & (last_pos >= stop))
+    next_pos[next_pos < stop] = -1
+    plane = stop
+    while pending.size:
+        values = label_array[plane].reshape(-1)[pending]
+        hit = values != 0
+        next_pos[pending[hit]] = plane
+        next_label[pending[hit]] = values[hit]
+        pending = pending[~hit]
+        plane += 1
+
+def _lower_envelope(weights, labels):
+    """
+    One pass of the separable feature transform along the columns of (n, lines) arrays.
+
+    weights holds the squared distance already covered along the earlier axes (-1 for
+    no label). This is scipy's _VoronoiFT vectorised over the lines, with the same
+    integer pop test and tie breaking, so the result matches distance_transform_edt.
+    """
+    n, lines = weights.shape
+    stack = np.empty((n, lines), dtype=np.intp)
+    top = np.full(lines, -1, dtype=np.intp)
+    for ii in range(n):
+        active = np.flatnonzero(weights[ii] >= 0)
+        cand = active[top[active] >= 1]
+        while cand.size:
+            t = top[cand]
+            u, v = stack[t - 1, cand], stack[t, cand]
+            a, b = v - u, ii - v
+            c = a + b
+            pop = c * weights[v, cand] - b * weights[u, cand] - a * weights[ii, cand] - a * b * c > 0
+            cand = cand[pop]
+            top[cand] -= 1
+            cand = cand[top[cand] >= 1]
+        top[active] += 1
+        stack[top[active], active] = ii
+
+    out_weights = np.full((n, lines), -1, dtype=np.int64)
+    out_labels = np.zeros_like(labels)
+    rows = np.flatnonzero(top >= 0)
+    last = top[rows]
+    l = np.zeros(rows.size, dtype=np.intp)
+    for ii in range(n):
+        g = stack[l, rows]
+        d1 = weights[g, rows] + (g - ii) ** 2
+        cand = np.flatnonzero(l < last)
+        while cand.size:
+            g = stack[l[cand] + 1, rows[cand]]
+            d2 = weights[g, rows[cand]] + (g - ii) ** 2
+            step = d1[cand] > d2
+            cand = cand[step]
+            l[cand] += 1
+            d1[cand] = d2[step]
+            cand = cand[l[cand] < last[cand]]
+        out_weights[ii, rows] = d1
+        out_labels[ii, rows] = labels[stack[l, rows], rows]
+    return out_weights, out_labels
+
+def _nearest_along_axis0(label_array, start, stop, columns):
+    """
+    Squared distance (-1 for none) and label of the nearest label along axis 0 for planes
+    start:stop, as (planes, plane voxels) arrays; ties go to the upper plane as in scipy.
+    columns carries the per-column state of the sweep: the last label above the slab and
+    the pointer to the next label below it.
+    """
+    prev_pos, prev_label, next_pos, next_label, last_pos = columns
+    _next_labels(label_array, next_pos, next_label, last_pos, stop)
+
+    weights = np.empty((stop - start, prev_pos.size), dtype=np.int64)
+    labels = np.empty((stop - start, prev_pos.size), dtype=label_array.dtype)
+    below_pos, below_label = next_pos.copy(), next_label.copy()
+    for plane in range(stop - 1, start - 1, -1):
+        values = label_array[plane].reshape(-1)
+        hit = values != 0
+        below_pos[hit] = plane
+        below_label[hit] = values[hit]
+        weights[plane - start] = np.where(below_pos >= 0, below_pos - plane, -1)
+        labels[plane - start] = below_label
+    for plane in range(start, stop):
+        values = label_array[plane].reshape(-1)
+        hit = values != 0
+        prev_pos[hit] = plane
+        prev_label[hit] = values[hit]
+        below = weights[plane - start]
+        above = np.where(prev_pos >= 0, plane - prev_pos, -1)
+        use_above = (above >= 0) & ((below < 0) | (above <= below))
+        below[use_above] = above[use_above]
+        labels[plane - start][use_above] = prev_label[use_above]
+        np.square(below, out=below, where=below >= 0)
+    return weights, labels
+
+def _fill_slab(label_array, start, stop, columns):
+    """Nearest labels of planes start:stop, finished along the in-plane axes one axis at a time."""
+    shape = (stop - start,) + label_array.shape[1:]
+    weights, labels = _nearest_along_axis0(label_array, start, stop, columns)
+    weights, labels = weights.reshape(shape), labels.reshape(shape)
+    for axis in (1, 2):
+        moved = np.moveaxis(weights, axis, 0).shape
+        w = np.moveaxis(weights, axis, 0).reshape(moved[0], -1)
+        lab = np.moveaxis(labels, axis, 0).reshape(moved[0], -1)
+        del weights, labels
+        w, lab = _lower_envelope(w, lab)
+        weights = np.moveaxis(w.reshape(moved), 0, axis)
+        labels = np.moveaxis(lab.reshape(moved), 0, axis)
+        del w, lab
+    return labels
+
+def fill_voids_with_nearest_label(label_array, memory_budget_mb=None):
+    """
+    Fill all 0-valued voxels with the nearest non-zero label.
+
+    The result is that of a whole-volume distance_transform_edt. When its working set
+    does not fit `memory_budget_mb` the volume is swept in slabs of planes along axis 0
+    that do: the nearest label along axis 0 is carried across slab seams (the last label
+    above and a pointer to the next label below every column), and the slab then finishes
+    the transform along its in-plane axes. No slab is wider than the budget allows.
+    """
+    memory_budget_mb = Constants.VOID_FILL_MEMORY_BUDGET_MB if memory_budget_mb is None else memory_budget_mb
+    budget = memory_budget_mb * 1024 * 1024
 
-    nonzero_coords = np.array(np.nonzero(label_array)).T
-    distances, indices = distance_transform_edt(mask, return_indices=True)
-    filled_array = label_array.copy()
-    filled_array[mask] = label_array[tuple(indices[:, mask])]
+    if np.all(label_array != 0) or not np.any(label_array):
+        return label_array
+    if label_array.size * _EDT_BYTES_PER_VOXEL <= budget:
+        return _fill_window(label_array)
+
+    depth = label_array.shape[0]
+    plane_voxels = int(np.prod(label_array.shape[1:]))
+    slab_depth = max(1, int(budget // (_slab_bytes_per_voxel(label_array.dtype) * plane_voxels)))
+
+    last_pos = np.full(plane_voxels, -1, dtype=np.int64)
+    for plane in range(depth):
+        last_pos[label_array[plane].reshape(-1) != 0] = plane
+    columns = (np.full(plane_voxels, -1, dtype=np.int64), np.zeros(plane_voxels, dtype=label_array.dtype),
+               np.full(plane_voxels, -1, dtype=np.int64), np.zeros(plane_voxels, dtype=label_array.dtype),
+               last_pos)
+
+    filled_array = np.empty_like(label_array)
+    for start in range(0, depth, slab_depth):
+        stop = min(start + slab_depth, depth)
+        filled_array[start:stop] = _fill_slab(label_array, start, stop, columns)
     return filled_array
 
+def extract_adjacent_label_pairs(label_array):
+    """
+    Return the unique unordered (label_a, label_b) pairs of distinct non-zero labels
+    that touch along any axis, as an (N, 2) array with label_a < label_b.
+
+    Neighbours are compared through offset slices, so there is no wrap-around between
+    opposite faces of the volume and no full-volume copies; only boundary voxels are
+    gathered and deduplicated.
+    """
+    ndim = label_array.ndim
+    nonzero = label_array != 0
+    boundary_a, boundary_b = [], []
+    for axis in range(ndim):
+        lower = [slice(None)] * ndim
+        upper = [slice(None)] * ndim
+        lower[axis] = slice(None, -1)
+        upper[axis] = slice(1, None)
+        a = label_array[tuple(lower)]
+        b = label_array[tuple(upper)]
+
+        mask = a != b
+        mask &= nonzero[tuple(lower)]
+        mask &= nonzero[tuple(upper)]
+        boundary_a.append(a[mask])
+        boundary_b.append(b[mask])
+
+    boundary_a = np.concatenate(boundary_a)
+    boundary_b = np.concatenate(boundary_b)
+    if boundary_a.size == 0:
+        return np.empty((0, 2), dtype=label_array.dtype)
+
+    # encode each pair as a single integer over the compact label index
+    labels, inverse = np.unique(np.concatenate([boundary_a, boundary_b]), return_inverse=True)
+    inverse = inverse.reshape(2, -1).astype(np.int64)
+    low = np.minimum(inverse[0], inverse[1])
+    high = np.maximum(inverse[0], inverse[1])
+    codes = np.unique(low * len(labels) + high)
+    return np.stack([labels[codes // len(labels)], labels[codes % len(labels)]], axis=1)
+
 def build_adjacency_graph(label_array):
     """Build adjacency graph of label connectivity in 6 directions."""
     adjacency = defaultdict(set)
-    offsets = [(-1, 0, 0), (1, 0, 0),
-               (0, -1, 0), (0, 1, 0),
-               (0, 0, -1), (0, 0, 1)]
-
-    for dx, dy, dz in offsets:
-        shifted = np.roll(label_array, shift=(dx, dy, dz), axis=(0, 1, 2))
-        mask = (label_array != shifted) & (label_array != 0) & (shifted != 0)
-        l1 = label_array[mask]
-        l2 = shifted[mask]
-        for a, b in zip(l1, l2):
-            if a != b:
-                adjacency[a].add(b)
-                adjacency[b].add(a)
+    for a, b in extract_adjacent_label_pairs(label_array):
+        adjacency[a].add(b)
+        adjacency[b].add(a)
     return adjacency
 
 def assign_colors_with_high_contrast(label_ids, adjacency_graph, min_initial_colors=20, max_total_colors=50):
     """
     Assign colors to labels such that adjacent labels have different colors,
     maximizing contrast and balance.
-    """
-    from itertools import combinations
-    import colorsys
-
-    def generate_distinct_colors(n):
-        HSV_tuples = [(x / n, 0.7, 0.9) for x in range(n)]
-        RGB_tuples = [tuple(int(c * 255) for c in colorsys.hsv_to_rgb(*hsv)) for hsv in HSV_tuples]
-        return RGB_tuples
-
-    def can_use_color(label, color_idx, assignments, adjacency_graph):
-        for neighbor in adjacency_graph[label]:
-            if assignments.get(neighbor) == color_idx:
-                return False
-        return True
 
+    Labels are colored in a single DSATUR pass: the next label is the one whose
+    neighbours already use the most distinct colors (ties broken by degree, then by
+    label id), and it takes the least-used color none of its neighbours have. A new
+    palette entry is only added when every existing one is blocked, so the result
+    is deterministic for a given graph.
+    """
     label_ids = sorted(label_ids)
-    assignments = {}
+    rank = {label: i for i, label in enumerate(label_ids)}
+    neighbours = {label: set(adjacency_graph.get(label, ())) - {label} for label in label_ids}
     num_colors = min_initial_colors
     color_usage_count = {i: 0 for i in range(num_colors)}
-
-    while True:
-        colors = generate_distinct_colors(num_colors)
-        assignments.clear()
-        color_usage_count = {i: 0 for i in range(num_colors)}
-        success = True
-
-        for label in label_ids:
-            color_order = sorted(range(num_colors), key=lambda c: (color_usage_count[c], c))
-            for color_idx in color_order:
-                if can_use_color(label, color_idx, assignments, adjacency_graph):
-                    assignments[label] = color_idx
-                    color_usage_count[color_idx] += 1
-                    break
-            else:
-                success = False
-                break
-
-        if success:
-            break
-        elif num_colors >= max_total_colors:
-            print(f"⚠️ Warning: reached max color count {max_total_colors}, some neighbors may share color")
-            break
-        else:
+    assignments = {}
+    neighbour_colors = {label: set() for label in label_ids}
+    uncolored = set(label_ids)
+
+    while uncolored:
+        label = max(uncolored, key=lambda l: (len(neighbour_colors[l]), len(neighbours[l]), -rank[l]))
+        blocked = neighbour_colors[label]
+        free = [c for c in range(num_colors) if c not in blocked]
+        if not free and num_colors < max_total_colors:
+            color_usage_count[num_colors] = 0
+            free = [num_colors]
             num_colors += 1
+        if free:
+            color_idx = min(free, key=lambda c: (color_usage_count[c], c))
+        else:
+            print(f"⚠️ Warning: reached max color count {max_total_colors}, some neighbors may share color")
+            clashes = {c: 0 for c in range(num_colors)}
+            for neighbour in neighbours[label]:
+                if neighbour in assignments:
+                    clashes[assignments[neighbour]] += 1
+            color_idx = min(range(num_colors), key=lambda c: (clashes[c], color_usage_count[c], c))
+
+        assignments[label] = color_idx
+        color_usage_count[color_idx] += 1
+        uncolored.remove(label)
+        for neighbour in neighbours[label]:
+            if neighbour in neighbour_colors:
+                neighbour_colors[neighbour].add(color_idx)
 
     final_colors = generate_distinct_colors(num_colors)
     print(f"✅ Final color count used: {len(set(assignments.values()))}")
 
     color_map = {
         str(label): {
-            "R": final_colors[color_idx][0],
-            "G": final_colors[color_idx][1],
-            "B": final_colors[color_idx][2],
+            "R": final_colors[assignments[label]][0],
+            "G": final_colors[assignments[label]][1],
+            "B": final_colors[assignments[label]][2],
             "A": 128
         }
-        for label, color_idx in assignments.items()
+        for label in label_ids
     }
 
     return color_map, color_usage_count
 
-def wait_for_file(filepath, timeout=30, check_interval=0.5):
-    """Wait until a file exists, or timeout is reached."""
-    start_time = time.time()
-    while not os.path.exists(filepath):
-        if time.time() - start_time > timeout:
-            raise TimeoutError(f"Timeout: File {filepath} not found after {timeout} seconds.")
-        time.sleep(check_interval)
+def compute_label_colormap(clabel_path):
+    """Load a combined labels npz and assign high-contrast colors to its labels."""
+    clabel_array = VolumeStore.instance().load(clabel_path)
+    print("[DEBUG] NPZ loaded, shape =", clabel_array.shape)
+
+    filled_array = fill_voids_with_nearest_label(clabel_array)
+    print("[DEBUG] fill_voids_with_nearest_label done")
+
+    adjacency = build_adjacency_graph(filled_array)
+    print("[DEBUG] build_adjacency_graph done")
+
+    unique_labels = sorted(adjacency.keys())
+    color_map, color_usage_count = assign_colors_with_high_contrast(unique_labels, adjacency)
+    print("[DEBUG] Color map generated:", color_map, color_usage_count)
+    return color_map
+
+def get_case_colormap(clabel_id):
+    """Cached colormap for a PanTS case, building its combined labels first if needed."""
+    clabel_path = get_clabel_npz_path(clabel_id)
+    if not os.path.exists(clabel_path):
+        print(f"File not found: {clabel_path}. Making file")
+        combine_label_npz(int(clabel_id))
+    return ColormapCache.instance().get(clabel_path, compute_label_colormap)
+
+def _read_file_range(path, start, stop, chunk_size=1 << 16):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = stop - start
+        while remaining > 0:
+            data = f.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+def send_file_ranged(path, mimetype, download_name=None, content_encoding=None):
+    """
+    Serve a file with HTTP Range support: Accept-Ranges, 206 for a single range,
+    multipart/byteranges for several, 416 when nothing is satisfiable, and If-Range
+    validation against the file's ETag / Last-Modified.
+
+    Byte offsets always refer to the stored bytes. With content_encoding="gzip" a stored
+    .nii.gz is labelled as gzip-encoded content (what the viewers expect); without it the
+    same bytes are an application/gzip resource, which is the mode to use for resumable
+    downloads.
+    """
+    stat = os.stat(path)
+    length = stat.st_size
+    etag = f"{stat.st_mtime_ns:x}-{length:x}"
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": f'"{etag}"',
+        "Last-Modified": http_date(stat.st_mtime),
+    }
+    if content_encoding:
+        headers["Content-Encoding"] = content_encoding
+    if download_name:
+        headers["Content-Disposition"] = f'attachment; filename="{download_name}"'
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and if_range:
+        if if_range.startswith(('"', 'W/')):
+            if not parse_etags(if_range).contains(etag):
+                range_header = None
+        elif if_range != headers["Last-Modified"]:
+            range_header = None
+
+    ranges = None
+    if range_header:
+        parsed = parse_range_header(range_header)
+        if parsed is not None and parsed.units == "bytes":
+            ranges = []
+            for start, stop in parsed.ranges:
+                if start < 0:
+                    start, stop = max(0, length + start), length
+                stop = length if stop is None else min(stop, length)
+                if start < stop:
+                    ranges.append((start, stop))
+            if not ranges:
+                headers["Content-Range"] = f"bytes */{length}"
+                return Response(status=416, headers=headers)
+
+    if not ranges:
+        headers["Content-Length"] = str(length)
+        return Response(_read_file_range(path, 0, length), status=200, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{length}"
+        headers["Content-Length"] = str(stop - start)
+        return Response(_read_file_range(path, start, stop), status=206, mimetype=mimetype,
+                        headers=headers, direct_passthrough=True)
+
+    boundary = uuid.uuid4().hex
+    parts = []
+    for start, stop in ranges:
+        part_header = (f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+                       f"Content-Range: bytes {start}-{stop - 1}/{length}\r\n\r\n").encode()
+        parts.append((part_header, start, stop))
+    closing = f"\r\n--{boundary}--\r\n".encode()
+
+    def generate():
+        for part_header, start, stop in parts:
+            yield part_header
+            yield from _read_file_range(path, start, stop)
+        yield closing
+
+    headers["Content-Length"] = str(sum(len(h) + stop - start for h, start, stop in parts) + len(closing))
+    # Content-Encoding applies to each part, not to the multipart body
+    headers.pop("Content-Encoding", None)
+    return Response(generate(), status=206, content_type=f"multipart/byteranges; boundary={boundary}",
+                    headers=headers, direct_passthrough=True)
 
 def volume_to_png(volume, axis=2, index=None):
-    if index is None:
-        index = volume.shape[axis] // 2
-    
-    slice_ = np.take(volume, index, axis=axis)
-    # window_center = 40 
-    # window_width = 400 
-    # min_val = window_center - window_width / 2
-    # max_val = window_center + window_width / 2
-
-    # slice_clipped = np.clip(slice_, min_val, max_val)
-    # slice_norm = 255 * (slice_clipped - min_val) / (max_val - min_val)
-    slice_norm = 255 * (slice_ - np.min(slice_)) / (np.max(slice_) - np.min(slice_))
-    slice_norm = slice_norm.astype(np.uint8)
-    
-    slice_norm = np.rot90(slice_norm, k=1)
-    slice_norm = np.flip(slice_norm, axis=0)
-
-    pil_img = Image.fromarray(slice_norm)
-    buf = BytesIO()
-    pil_img.save(buf, format="PNG")
-    buf.seek(0)
-    return buf
+    return volume_to_image(volume, axis=axis, index=index)
+
+_template_lock = threading.Lock()
+
+@lru_cache(maxsize=4)
+def _load_template_page(template_pdf, mtime_ns):
+    from PyPDF2 import PdfReader
+    return PdfReader(template_pdf).pages[0]
+
+def get_template_page(template_pdf):
+    """First page of the report template, parsed once and reused until the file changes."""
+    template_pdf = os.path.abspath(template_pdf)
+    return _load_template_page(template_pdf, os.stat(template_pdf).st_mtime_ns)
+
 def generate_pdf_with_template(
     output_pdf,
     folder_name,
@@ -227,6 +557,7 @@ def generate_pdf_with_template(
     id,
     extracted_data=None,
     column_headers=None,
+    label_stats=None,
 ):
     import os
     import nibabel as nib
@@ -336,13 +667,7 @@ def generate_pdf_with_template(
                 return "N/A" if pd.isna(val) else val
             return default
 
-        wb = load_workbook(os.path.join(Constants.PANTS_PATH, "data", "metadata.xlsx"))
-        sheet = wb["PanTS_metadata"]
-        row = None
-        for x in sheet.iter_rows(values_only=True):
-            if x[0] == get_panTS_id(id):
-                row = x
-                break
+        row = MetadataIndex.instance().get(get_panTS_id(id)) or {}
         
         # Title
         temp_pdf.setFont("Helvetica-Bold", 26)
@@ -357,7 +682,7 @@ def generate_pdf_with_template(
         y_position -= line_height
 
         left_y = write_wrapped_text(left_margin, y_position, f"PanTS ID: {get_panTS_id(id)}")
-        right_y = write_wrapped_text(width / 2, y_position, f"Sex: {row[4]}")
+        right_y = write_wrapped_text(width / 2, y_position, f"Sex: {row.get('sex')}")
         y_position = min(left_y, right_y) - section_spacing
 
         # Imaging detail
@@ -366,7 +691,7 @@ def generate_pdf_with_template(
         y_position -= line_height
 
         ct_nii = nib.load(ct_path)
-        spacing = row[2]
+        spacing = row.get("spacing")
         shape = ct_nii.shape
 
         try:
@@ -382,10 +707,11 @@ def generate_pdf_with_template(
         y_position = write_wrapped_text(left_margin, y_position, f"Contrast: {contrast_used}")
         y_position -= section_spacing
 
-        # Load image data
-        ct_array = ct_nii.get_fdata()
-        mask_array = nib.load(mask_path).get_fdata()
-        voxel_volume = np.prod(nib.load(mask_path).header.get_zooms()) / 1000  # mm³ to cm³
+        # Load image data once, in native dtypes; the CT is only read when the label
+        # statistics are not already stored
+        mask_nii = nib.load(mask_path)
+        mask_array = as_label_array(np.asanyarray(mask_nii.dataobj))
+        voxel_volume = np.prod(mask_nii.header.get_zooms()) / 1000  # mm³ to cm³
 
         # AI Measurements
         temp_pdf.setFont("Helvetica-Bold", 12)
@@ -418,14 +744,19 @@ def generate_pdf_with_template(
 
         draw_table_row(headers, is_header=True)
 
+        # counts and HU sums of every label in one pass instead of a mask per organ,
+        # or straight from the stored organ metadata (label_stats) when the caller has it
+        if label_stats:
+            stats = LabelStatistics.from_dict(label_stats)
+        else:
+            stats = label_statistics(mask_array, np.asanyarray(ct_nii.dataobj))
+
         lession_volume_dict={}
         for organ, label_id in LABELS.items():
             if organ in NAME_TO_ORGAN and NAME_TO_ORGAN[organ] != organ:
-                mask = (mask_array == label_id)
-                if not np.any(mask):
+                if not stats.count(label_id):
                     continue
-                volume = np.sum(mask) * voxel_volume
-                mean_hu = np.mean(ct_array[mask])
+                volume = stats.volume(label_id, voxel_volume)
                 if NAME_TO_ORGAN[organ] in lession_volume_dict:
                     lession_volume_dict[NAME_TO_ORGAN[organ]]["number"] += 1
                     lession_volume_dict[NAME_TO_ORGAN[organ]]["volume"] += volume
@@ -440,11 +771,10 @@ def generate_pdf_with_template(
                 continue
             if label_id == 0:
                 continue
-            mask = (mask_array == label_id)
-            if not np.any(mask):
+            if not stats.count(label_id):
                 continue
-            volume = np.sum(mask) * voxel_volume
-            mean_hu = np.mean(ct_array[mask])
+            volume = stats.volume(label_id, voxel_volume)
+            mean_hu = stats.mean(label_id)
             
             if organ in lession_volume_dict:
                 row = [organ.replace('_', ' '), f"{volume:.2f}", f"{mean_hu:.1f}", f"{lession_volume_dict[organ]['number']}", f"{lession_volume_dict[organ]['volume']:.2f}"]
@@ -461,7 +791,7 @@ def generate_pdf_with_template(
 
         try:
             nifti_processor = NiftiProcessor(ct_path, mask_path)
-            pdac_info = nifti_processor.calculate_pdac_sma_staging()
+            pdac_info = nifti_processor.calculate_pdac_sma_staging(clabel_data=mask_array)
             pdac_text = pdac_info
         except Exception:
             pdac_text = "Error fetching PDAC staging information."
@@ -488,54 +818,46 @@ def generate_pdf_with_template(
             temp_pdf.drawString(left_margin, y_position, "KEY IMAGES")
             y_position -= section_spacing
 
-            organs = {
-                "liver": include_liver,
-                "pancreas": include_pancreas,
-                "kidney_left": include_kidney,
-                "kidney_right": include_kidney
-            }
-            # download_clean_folder(ct_path.replace("/inputs/", "/outputs/").rsplit("/", 1)[0])
-            # for organ in organs:
-            #     organ_data = lession_volume_dict.get(organ)
-            #     if not organ_data or organ_data.get("number", 0) == 0:
-            #         continue
-
-            #     header = f"{organ.replace('_', ' ').upper()} TUMORS"
-            #     check_and_reset_page(line_height)
-            #     temp_pdf.setFont("Helvetica", 12)
-            #     temp_pdf.drawString(left_margin, y_position, header)
-            #     y_position -= line_height
-            #     print(organ, organ_data)
-            #     check_and_reset_page(220)
-            #     overlay_path = f"/tmp/{organ}_overlay.png"
-            #     print(ct_path, mask_path)
-            #     organ_mask_path = mask_path.replace('combined_labels.nii.gz', 'segmentations/'+organ+'.nii.gz')
-            #     if create_overlay_image(ct_path, organ_mask_path, overlay_path, color="red"):
-            #         try:
-            #             temp_pdf.drawImage(overlay_path, left_margin, y_position - 200, width=200, height=200)
-            #         except:
-            #             print(overlay_path)
-            #     check_and_reset_page(220)
-            #     zoom_path = f"/tmp/{organ}_zoomed.png"
-            #     if zoom_into_labeled_area(ct_path, organ_mask_path, zoom_path, color="red"):
-            #         temp_pdf.drawImage(zoom_path, left_margin + 250, y_position - 205, width=210, height=210)
-            #     print('521')
-            #     y_position -= 220
+            # overview and zoomed slice of each organ with lesions, rendered in memory from
+            # the loaded labels; only the chosen CT slices are read
+            organs = {}
+            for organ, included in (("liver", include_liver), ("pancreas", include_pancreas),
+                                    ("kidney_left", include_kidney), ("kidney_right", include_kidney)):
+                if not included:
+                    continue
+                outlines = {LABELS[organ]: RED}
+                outlines.update({LABELS[name]: YELLOW for name, parent in NAME_TO_ORGAN.items()
+                                 if parent == organ and name != organ and name in LABELS})
+                organs[organ] = (LABELS[organ], outlines)
+
+            try:
+                images = key_images(ct_nii.dataobj, mask_array, organs)
+            except Exception as e:  # the rest of the report is still useful without them
+                print(f"❌ [Report] Could not render key images for {folder_name}: {e}")
+                images = {}
+            for organ, (overview, zoomed) in images.items():
+                check_and_reset_page(line_height + 220)
+                temp_pdf.setFont("Helvetica", 12)
+                temp_pdf.drawString(left_margin, y_position, f"{organ.replace('_', ' ').upper()} TUMORS")
+                y_position -= line_height
+                temp_pdf.drawImage(ImageReader(overview), left_margin, y_position - 200, width=200, height=200, preserveAspectRatio=True)
+                temp_pdf.drawImage(ImageReader(zoomed), left_margin + 250, y_position - 205, width=210, height=210, preserveAspectRatio=True)
+                y_position -= 220
 
         temp_pdf.save()
 
-        # Merge with template
-        template_reader = PdfReader(template_pdf)
+        # Merge with template (parsed once per template file and process)
+        template_page = get_template_page(template_pdf)
         content_reader = PdfReader(temp_pdf_path)
         writer = PdfWriter()
 
         for page in content_reader.pages:
-            template_page = template_reader.pages[0]
             merged_page = PageObject.create_blank_page(
                 width=template_page.mediabox.width,
                 height=template_page.mediabox.height
             )
-            merged_page.merge_page(template_page)
+            with _template_lock:
+                merged_page.merge_page(template_page)
             merged_page.merge_page(page)
             writer.add_page(merged_page)
 
@@ -550,136 +872,46 @@ def generate_pdf_with_template(
             os.remove(temp_pdf_path)
 
 
+def _write_key_image(ct_path, mask_path, output_path, color="red", **kwargs):
+    """Render the key image of a single-organ mask file with render_key_image and write it to output_path."""
+    try:
+        mask = as_label_array(np.asanyarray(nib.load(mask_path).dataobj))
+        label_id = int(mask.max()) if mask.size else 0
+        if not label_id:
+            return False
+        buf = render_key_image(nib.load(ct_path).dataobj, mask, label_id,
+                               outlines={label_id: ImageColor.getrgb(color)}, **kwargs)
+        if buf is None:
+            return False
+        with open(output_path, "wb") as f:
+            f.write(buf.getvalue())
+        return True
+    except Exception as e:
+        print(f"❌ Key image for {mask_path} failed: {e}")
+        return False
+
+
 # Helper Function to Process CT and Mask
 def get_most_labeled_slice(ct_path, mask_path, output_png, contrast_min=-150, contrast_max=250):
     """
-    Load CT and mask, ensure RAS orientation, find the most labeled slice, and generate an overlay image.
+    Write the axial slice with the most labelled voxels of mask_path, with the mask outlined on the CT.
     """
-
-    try:
-        import SimpleITK as sitk
-        import matplotlib
-        matplotlib.use('Agg')  # ✅ 关键：不再尝试调用 GUI
-
-        import matplotlib.pyplot as plt
-
-        # Load the CT scan and mask
-        ct_scan = sitk.ReadImage(ct_path)
-        print('543',mask_path)
-        mask = sitk.ReadImage(mask_path)
-        print(mask_path)
-        # Reorient to RAS
-        ct_scan = sitk.DICOMOrient(ct_scan, 'RAS')
-        mask = sitk.DICOMOrient(mask, 'RAS')
-
-        # Convert to numpy arrays
-        ct_array = sitk.GetArrayFromImage(ct_scan)
-        mask_array = sitk.GetArrayFromImage(mask)
-
-        # Check for shape mismatches
-        if ct_array.shape != mask_array.shape:
-            raise ValueError(f"Shape mismatch: CT shape {ct_array.shape}, Mask shape {mask_array.shape}")
-
-        # Find the slice with the most labels
-        slice_sums = np.sum(mask_array, axis=(1, 2))
-        most_labeled_slice_index = np.argmax(slice_sums)
-
-        # Get the CT and mask slices
-        ct_slice = ct_array[most_labeled_slice_index]
-        mask_slice = mask_array[most_labeled_slice_index]
-
-        # Apply mirroring
-        ct_slice = np.fliplr(ct_slice)
-        mask_slice = np.fliplr(mask_slice)
-
-        # Apply contrast adjustment
-        ct_slice = np.clip(ct_slice, contrast_min, contrast_max)
-        ct_slice = (ct_slice - contrast_min) / (contrast_max - contrast_min) * 255
-        ct_slice = ct_slice.astype(np.uint8)
-
-        # Overlay mask contours on CT slice
-        plt.figure(figsize=(6, 6))
-        plt.imshow(ct_slice, cmap='gray', origin='lower')
-        plt.contour(mask_slice, colors='red', linewidths=1)  # Use red contours for the mask
-        plt.axis('off')
-        plt.savefig(output_png, bbox_inches="tight", pad_inches=0)
-        plt.close()
-        print('586')
-        return True
-    except:
-        return False
+    return _write_key_image(ct_path, mask_path, output_png,
+                            window_center=(contrast_min + contrast_max) / 2, window_width=contrast_max - contrast_min)
 
 def create_overlay_image(ct_path, mask_path, output_path, color="red"):
     """
-    Generate overlay images for most labeled slices using the unified RAS orientation logic.
+    Generate overlay images for most labeled slices.
     """
-    return get_most_labeled_slice(ct_path, mask_path, output_path)
+    return _write_key_image(ct_path, mask_path, output_path, color=color)
 
 
 # Helper Function to Zoom into Labeled Area
 def zoom_into_labeled_area(ct_path, mask_path, output_path, color="red"):
     """
-    Create a zoomed-in view of the largest labeled area with consistent RAS orientation.
+    Create a zoomed-in view of the largest labeled area.
     """
-    import SimpleITK as sitk
-    import matplotlib.pyplot as plt
-    try:
-        # Load the CT scan and mask
-        ct_scan = sitk.ReadImage(ct_path)
-        mask = sitk.ReadImage(mask_path)
-
-        # Reorient to RAS
-        ct_scan = sitk.DICOMOrient(ct_scan, 'RAS')
-        mask = sitk.DICOMOrient(mask, 'RAS')
-
-        # Convert to numpy arrays
-        ct_array = sitk.GetArrayFromImage(ct_scan)
-        mask_array = sitk.GetArrayFromImage(mask)
-
-        # Check for shape mismatches
-        if ct_array.shape != mask_array.shape:
-            raise ValueError(f"Shape mismatch: CT shape {ct_array.shape}, Mask shape {mask_array.shape}")
-
-        # Find the slice with the most labels
-        slice_sums = np.sum(mask_array, axis=(1, 2))
-        largest_slice_idx = np.argmax(slice_sums)
-        if slice_sums[largest_slice_idx] == 0:
-            raise ValueError("No labeled area found in the mask.")
-
-        # Get the mask slice and calculate the bounding box
-        mask_slice = mask_array[largest_slice_idx]
-        coords = np.array(np.where(mask_slice))
-        min_row, max_row = np.min(coords[0]), np.max(coords[0])
-        min_col, max_col = np.min(coords[1]), np.max(coords[1])
-        padding = 20
-        min_row = max(min_row - padding, 0)
-        max_row = min(max_row + padding, mask_slice.shape[0])
-        min_col = max(min_col - padding, 0)
-        max_col = min(max_col + padding, mask_slice.shape[1])
-
-        # Extract the zoomed region
-        zoomed_image = ct_array[largest_slice_idx][min_row:max_row, min_col:max_col]
-        zoomed_mask = mask_array[largest_slice_idx][min_row:max_row, min_col:max_col]
-
-        # Apply mirroring
-        zoomed_image = np.fliplr(zoomed_image)
-        zoomed_mask = np.fliplr(zoomed_mask)
-
-        # Apply contrast adjustment to the zoomed CT slice
-        zoomed_image = np.clip(zoomed_image, -150, 250)
-        zoomed_image = (zoomed_image + 150) / 400 * 255
-        zoomed_image = zoomed_image.astype(np.uint8)
-
-        # Save the zoomed-in image with overlay
-        plt.figure(figsize=(6, 6))
-        plt.imshow(zoomed_image, cmap="gray", origin="lower")
-        plt.contour(zoomed_mask, colors=color, linewidths=1)
-        plt.axis("off")
-        plt.savefig(output_path, bbox_inches="tight")
-        plt.close()
-        return True
-    except Exception as e:
-        return False
+    return _write_key_image(ct_path, mask_path, output_path, color=color, zoom=True, size=Constants.KEY_IMAGE_SIZE)
 
 def get_pdac_staging(session_key):
     # Step 1: Validate input
@@ -757,13 +989,21 @@ def download_clean_folder(root):
         seg_folder = os.path.join(root, "segmentations")
         os.makedirs(seg_folder, exist_ok=True)
 
-        # 为每个标签生成单独的 mask 文件
-        for label_name, label_value in labels.items():
+        # 为每个标签生成单独的 mask 文件 (gzip 压缩释放 GIL，多线程并行写出)
+        def save_mask(item):
+            label_name, label_value = item
             mask = (combined_data == label_value).astype(np.uint8)
             label_img = nib.Nifti1Image(mask, affine)
             out_path = os.path.join(seg_folder, f"{label_name}.nii.gz")
             nib.save(label_img, out_path)
-            print(f"✅ Saved: {out_path}")
+            return out_path
+
+        start = time.time()
+        workers = Constants.SEGMENTATION_IO_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for out_path in pool.map(save_mask, labels.items()):
+                print(f"✅ Saved: {out_path}")
+        print(f"[download_clean_folder] split {len(labels)} masks in {time.time() - start:.2f}s ({workers} workers)")
         os.remove(dataset_json_path)
     else:
         print("ℹ️ Folder content does not match the expected file set. Skipping cleanup and split.")
\ No newline at end of file
@@ -16,7 +16,10 @@ from api.api_blueprint import api_blueprint
 from models.base import db
 from models.application_session import ApplicationSession
 from models.combined_labels import CombinedLabels
+from models.segmentation_job import SegmentationJob
+from models.model_runtime import ModelRuntime
 from services.session_manager import SessionManager
+from services.segmentation_scheduler import SegmentationScheduler
 
 def create_session_dir():
     if not os.path.isdir(Constants.SESSIONS_DIR_NAME):
@@ -29,6 +32,8 @@ def create_app():
     app = Flask(__name__)
     app.register_blueprint(api_blueprint, url_prefix=f'{Constants.BASE_PATH}/api')
     app.config['SQLALCHEMY_DATABASE_URI'] = Constants.SQLALCHEMY_DATABASE_URI
+    if Constants.SQLALCHEMY_DATABASE_URI.startswith('sqlite'):
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': Constants.SQLITE_BUSY_TIMEOUT_SECONDS}}
 
     # ✅ 添加 logger filter 来屏蔽 /api/progress/ 日志
     class FilterProgressRequests(logging.Filter):
@@ -47,6 +52,7 @@ def create_app():
 
     with app.app_context():
         db.create_all()
+    SegmentationScheduler.instance().init_app(app)
     return app
 
 
@@ -0,0 +1,79 @@
+"""
+Compare the legacy np.roll + per-voxel loop adjacency extraction against the
+vectorized engine in api/utils.py on the bundled PanTS/data/LabelTr cases.
+
+    python benchmarks/adjacency_benchmark.py [--pants-path ../PanTS] [--repeat 3]
+"""
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import argparse
+import pathlib
+import time
+import numpy as np
+from collections import defaultdict
+
+from api.utils import build_adjacency_graph, fill_voids_with_nearest_label
+
+
+def legacy_build_adjacency_graph(label_array):
+    """Pre-vectorization implementation, kept here as the benchmark baseline."""
+    adjacency = defaultdict(set)
+    offsets = [(-1, 0, 0), (1, 0, 0),
+               (0, -1, 0), (0, 1, 0),
+               (0, 0, -1), (0, 0, 1)]
+
+    for dx, dy, dz in offsets:
+        shifted = np.roll(label_array, shift=(dx, dy, dz), axis=(0, 1, 2))
+        mask = (label_array != shifted) & (label_array != 0) & (shifted != 0)
+        l1 = label_array[mask]
+        l2 = shifted[mask]
+        for a, b in zip(l1, l2):
+            if a != b:
+                adjacency[a].add(b)
+                adjacency[b].add(a)
+    return adjacency
+
+
+def best_of(fn, arr, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(arr)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    default_pants = os.environ.get("PANTS_PATH") or os.path.join(os.path.dirname(__file__), "..", "..", "PanTS")
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pants-path", default=default_pants)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--raw", action="store_true", help="skip void filling (the colormap endpoint fills first)")
+    args = parser.parse_args()
+
+    cases = sorted(pathlib.Path(args.pants_path, "data", "LabelTr").glob("*/combined_labels.npz"))
+    if not cases:
+        print(f"No combined_labels.npz found under {args.pants_path}/data/LabelTr")
+        return 1
+
+    print(f"{'case':<18}{'shape':<18}{'legacy (s)':>12}{'vectorized (s)':>16}{'speedup':>10}  edges")
+    for path in cases:
+        arr = np.load(path)["data"]
+        if not args.raw:
+            arr = fill_voids_with_nearest_label(arr)
+        legacy_t, legacy = best_of(legacy_build_adjacency_graph, arr, args.repeat)
+        fast_t, fast = best_of(build_adjacency_graph, arr, args.repeat)
+
+        # np.roll wraps around the volume edges; the new engine does not
+        legacy_edges = {(a, b) for a, nbrs in legacy.items() for b in nbrs}
+        fast_edges = {(a, b) for a, nbrs in fast.items() for b in nbrs}
+        status = "same" if legacy_edges == fast_edges else f"{len(legacy_edges - fast_edges)} wrap-around only"
+        print(f"{path.parent.name:<18}{str(arr.shape):<18}{legacy_t:>12.3f}{fast_t:>16.3f}{legacy_t / fast_t:>9.1f}x  {status}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -18,8 +18,12 @@ class Constants:
     if all([DB_USER, DB_PASS, DB_HOST, DB_NAME]):
         SQLALCHEMY_DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}'
     else:
-        print("⚠️ Falling back to SQLite")
-        SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:'
+        # a file rather than :memory:, which would give every connection (request threads,
+        # job workers) its own database and keep jobs from the other server processes
+        SQLITE_PATH = os.environ.get('SQLITE_PATH', os.path.join(SESSIONS_DIR_NAME, 'app.sqlite'))
+        print(f"⚠️ Falling back to SQLite at {SQLITE_PATH}")
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///:memory:' if SQLITE_PATH == ':memory:' else f'sqlite:///{os.path.abspath(SQLITE_PATH)}'
+    SQLITE_BUSY_TIMEOUT_SECONDS = 30  # how long a SQLite writer waits for another one
 
     #SQLALCHEMY_DATABASE_URI = f'postgresql://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}'
 
@@ -35,6 +39,72 @@ class Constants:
     COMBINED_LABELS_NIFTI_FILENAME = 'combined_labels.nii.gz'
     SESSION_TIMEDELTA = 3  # in days
 
+    # PanTS_metadata index, persisted as SQLite (defaults to next to metadata.xlsx)
+    METADATA_INDEX_PATH = os.environ.get('METADATA_INDEX_PATH')
+
+    # label colormap cache
+    COLORMAP_CACHE_SIZE = int(os.environ.get('COLORMAP_CACHE_SIZE', 64))  # cases kept in memory
+    COLORMAP_CACHE_VERSION = 5  # bump when the colormap algorithm changes
+    COLORMAP_SIDECAR_SUFFIX = '.colormap.json'
+
+    # uncompressed, memory-mapped copies of ct.npz / combined_labels.npz
+    VOLUME_STORE_ENABLED = os.environ.get('VOLUME_STORE_ENABLED', 'false').lower() == 'true'
+    VOLUME_STORE_DIR = os.environ.get('VOLUME_STORE_DIR')  # defaults to next to each npz
+
+    # multi-resolution chunked volumes for progressive loading
+    PYRAMID_DIR = os.environ.get('PYRAMID_DIR')  # defaults to <case dir>/pyramid
+    PYRAMID_LEVELS = (1, 2, 4)  # downsampling factors
+    PYRAMID_CHUNK_SIZE = 64  # voxels per chunk edge
+
+    # which organ keeps a voxel claimed by several segmentation masks: 'last' or 'first'
+    COMBINE_LABELS_OVERLAP = os.environ.get('COMBINE_LABELS_OVERLAP', 'last')
+    # threads reading/compressing per-organ segmentation files
+    SEGMENTATION_IO_WORKERS = int(os.environ.get('SEGMENTATION_IO_WORKERS', min(8, os.cpu_count() or 1)))
+
+    # preview thumbnails
+    THUMBNAIL_DIR = os.environ.get('THUMBNAIL_DIR')  # defaults to <PANTS_PATH>/data/thumbnails
+    THUMBNAIL_MAX_SIZE = 400  # px, longer edge
+    THUMBNAIL_WORKERS = int(os.environ.get('THUMBNAIL_WORKERS', os.cpu_count() or 1))  # build_all process pool (CLI)
+    THUMBNAIL_MAX_CONCURRENT_RENDERS = int(os.environ.get('THUMBNAIL_MAX_CONCURRENT_RENDERS', 2))  # cache misses rendered at once per server process
+    PREVIEW_BUNDLE_MAX_CASES = 100
+
+    # background report generation
+    REPORT_CACHE_DIR = os.environ.get('REPORT_CACHE_DIR', os.path.join(SESSIONS_DIR_NAME, 'reports'))
+    REPORT_WORKERS = int(os.environ.get('REPORT_WORKERS', 2))
+    REPORT_FORMAT_VERSION = 2  # bump when the report layout changes, so cached PDFs are rebuilt
+    REPORT_JOB_TIMEOUT_SECONDS = int(os.environ.get('REPORT_JOB_TIMEOUT_SECONDS', 1800))  # queued/running jobs older than this were abandoned
+
+    # auto-segmentation jobs
+    SEGMENTATION_MAX_CONCURRENT = int(os.environ.get('SEGMENTATION_MAX_CONCURRENT', 1))  # model runs at once across all server processes
+    SEGMENTATION_CLAIM_RETRY_SECONDS = 2  # wait before retrying a job while the limit is reached
+    # liveness locks of the server processes (must be shared by the processes of a host)
+    SEGMENTATION_WORKER_DIR = os.environ.get('SEGMENTATION_WORKER_DIR', os.path.join(SESSIONS_DIR_NAME, 'workers'))
+    DEFAULT_MODEL_SECONDS = 35  # expected model runtime until a run of the model has finished
+    MODEL_RUNTIME_ALPHA = 0.3  # weight of the latest run in the runtime moving average
+    FAKE_MODEL_ENABLED = os.environ.get('FAKE_MODEL_ENABLED', 'false').lower() == 'true'  # MODEL_NAME=fake, see services/fake_model.py
+    # /progress/stream: keep-alive comment interval, database re-check for jobs run by
+    # other server processes, and the longest a stream stays open (clients reconnect)
+    PROGRESS_STREAM_HEARTBEAT_SECONDS = 15
+    PROGRESS_STREAM_POLL_SECONDS = 2
+    PROGRESS_STREAM_MAX_SECONDS = int(os.environ.get('PROGRESS_STREAM_MAX_SECONDS', 3600))
+    # /get_result: longest ?wait a request may hold a worker thread, and the Retry-After cap
+    RESULT_MAX_WAIT_SECONDS = 25
+    RESULT_RETRY_AFTER_MAX_SECONDS = 10
+    # uploaded CTs stored once by content hash, and model outputs by (CT hash, model);
+    # keep them on the file system of the sessions directory so they can be hard-linked
+    BLOB_STORE_DIR = os.environ.get('BLOB_STORE_DIR', os.path.join(SESSIONS_DIR_NAME, 'blobs'))
+    SEGMENTATION_CACHE_DIR = os.environ.get('SEGMENTATION_CACHE_DIR', os.path.join(SESSIONS_DIR_NAME, 'segmentation_cache'))
+
+    # finished segmentation zip downloads
+    ZIP_CACHE_DIR = os.environ.get('ZIP_CACHE_DIR', os.path.join(SESSIONS_DIR_NAME, 'zips'))
+    # report key images: HU window (-150..250) and longer edge in px
+    KEY_IMAGE_WINDOW_CENTER = 50
+    KEY_IMAGE_WINDOW_WIDTH = 400
+    KEY_IMAGE_SIZE = 400
+
+    # nearest-label void filling
+    VOID_FILL_MEMORY_BUDGET_MB = int(os.environ.get('VOID_FILL_MEMORY_BUDGET_MB', 512))  # working set, not the filled copy
+
     # NiftiProcessor Variables
     EROSION_PIXELS = 2
     CUBE_LEN = (2 * EROSION_PIXELS) + 1
@@ -0,0 +1,13 @@
+"""
+gunicorn settings read by the Dockerfile's CMD (worker count and gthread workers are
+passed on the command line).
+"""
+import signal
+
+from services.job_events import JobEvents
+
+
+def post_worker_init(worker):
+    # end open /progress/stream responses when the worker is told to stop, so gthread
+    # can join their threads instead of waiting out graceful_timeout
+    JobEvents.shutdown_on(signal.SIGTERM, signal.SIGINT, signal.SIGQUIT)
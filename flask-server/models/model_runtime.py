@@ -0,0 +1,18 @@
+from models.base import db
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import Integer, String, Float, DateTime
+
+class ModelRuntime(db.Model):
+    __tablename__ = "model_runtime"
+
+    model_name: Mapped[str] = mapped_column(primary_key=True, type_=String)
+    average_seconds: Mapped[float] = mapped_column(type_=Float)  # exponential moving average of finished runs
+    runs: Mapped[int] = mapped_column(type_=Integer, default=0)
+    updated: Mapped[DateTime] = mapped_column(type_=DateTime)
+
+    def __str__(self):
+        return f'''
+        ModelRuntime OBJECT:
+            model_name: {self.model_name}
+            average_seconds: {self.average_seconds}
+            runs: {self.runs}'''
@@ -0,0 +1,50 @@
+from models.base import db
+from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy import Integer, String, DateTime, Text
+from typing import Optional
+
+class SegmentationJob(db.Model):
+    __tablename__ = "segmentation_job"
+
+    job_id: Mapped[str] = mapped_column(primary_key=True, type_=String)
+    session_id: Mapped[str] = mapped_column(type_=String, index=True)
+    model_name: Mapped[str] = mapped_column(type_=String)
+    priority: Mapped[int] = mapped_column(type_=Integer, default=0)
+    status: Mapped[str] = mapped_column(type_=String, index=True)  # queued, running, done, failed
+    input_path: Mapped[str] = mapped_column(type_=String)
+    input_hash: Mapped[Optional[str]] = mapped_column(type_=String, nullable=True)  # sha256 of the CT, key of the result cache
+    output_path: Mapped[Optional[str]] = mapped_column(type_=String, nullable=True)
+    zip_path: Mapped[Optional[str]] = mapped_column(type_=String, nullable=True)
+    error: Mapped[Optional[str]] = mapped_column(type_=Text, nullable=True)
+    progress: Mapped[Optional[int]] = mapped_column(type_=Integer, nullable=True)  # percent parsed from the model output
+    worker: Mapped[Optional[str]] = mapped_column(type_=String, nullable=True)  # <host>:<pid>:<boot token> running the job, "cache" for a cached result
+    submitted: Mapped[DateTime] = mapped_column(type_=DateTime)
+    started: Mapped[Optional[DateTime]] = mapped_column(type_=DateTime, nullable=True)
+    finished: Mapped[Optional[DateTime]] = mapped_column(type_=DateTime, nullable=True)
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "session_id": self.session_id,
+            "model_name": self.model_name,
+            "priority": self.priority,
+            "status": self.status,
+            "progress": self.progress,
+            "cached": self.worker == "cache",
+            "output_path": self.output_path,
+            "zip_path": self.zip_path,
+            "error": self.error,
+            "submitted": self.submitted.isoformat() if self.submitted else None,
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+            "run_seconds": (self.finished - self.started).total_seconds() if self.started and self.finished else None,
+        }
+
+    def __str__(self):
+        return f'''
+        SegmentationJob OBJECT:
+            job_id: {self.job_id}
+            session_id: {self.session_id}
+            model_name: {self.model_name}
+            status: {self.status}
+            submitted: {self.submitted}'''
@@ -2,7 +2,10 @@ import os
 import uuid
 import subprocess
 import re
+import sys
 from dotenv import load_dotenv
+from constants import Constants
+from services.blob_store import link_or_copy
 
 # Load environment variables
 load_dotenv()
@@ -29,9 +32,57 @@ def get_least_used_gpu(default_gpu=None):
         return str(default_gpu)
 
 
-def run_auto_segmentation(input_path, session_dir, model):
+# "45%|####  " (tqdm), "progress: 45%", "45.5 %"
+PROGRESS_PATTERN = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+
+
+def parse_progress(line):
+    """Last percentage in a line of model output, or None."""
+    matches = PROGRESS_PATTERN.findall(line)
+    if not matches:
+        return None
+    percent = float(matches[-1])
+    return int(percent) if percent <= 100 else None
+
+
+def run_with_progress(cmd, progress_callback=None):
+    """
+    Run a shell command, echoing its output and passing every new percentage it prints
+    to progress_callback. Carriage returns count as line ends, so tqdm bars are read as
+    they redraw; PYTHONUNBUFFERED keeps Python models from holding their output back.
+    Raises CalledProcessError on a non-zero exit status.
+    """
+    process = subprocess.Popen(cmd, shell=True, executable="/bin/bash", stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT, text=True, bufsize=1,
+                               env=dict(os.environ, PYTHONUNBUFFERED="1"))
+    last = None
+    for line in process.stdout:  # universal newlines: "\r" ends a line too
+        line = line.rstrip()
+        if line:
+            print(line)
+        percent = parse_progress(line)
+        if percent is not None and percent != last and progress_callback is not None:
+            last = percent
+            try:
+                progress_callback(percent)
+            except Exception as e:
+                print("⚠️ Progress callback failed:", e)
+    returncode = process.wait()
+    if returncode:
+        raise subprocess.CalledProcessError(returncode, cmd)
+
+
+def available_models():
+    models = ["SuPreM", "ePAI"]
+    if Constants.FAKE_MODEL_ENABLED:
+        models.append("fake")
+    return models
+
+
+def run_auto_segmentation(input_path, session_dir, model, progress_callback=None):
     """
     Run auto segmentation model using Apptainer inside the given session directory.
+    progress_callback(percent) is called with the progress the model prints.
     """
     subfolder_name = "ct"
 
@@ -43,7 +94,7 @@ def run_auto_segmentation(input_path, session_dir, model):
 
     input_filename = os.path.basename(input_path)
     container_input_path = os.path.join(input_case_ct_dir, input_filename)
-    os.system(f"cp {input_path} {container_input_path}")
+    link_or_copy(input_path, container_input_path)
 
     conda_activate_cmd = ""
 
@@ -65,6 +116,9 @@ def run_auto_segmentation(input_path, session_dir, model):
     elif model == 'ePAI':
         conda_activate_cmd = f"source {conda_path} && conda activate {epai_env_name} &&"
         apptainer_cmd = ["bash", epai_script_path, session_dir]
+    elif model == 'fake' and Constants.FAKE_MODEL_ENABLED:
+        fake_model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fake_model.py")
+        apptainer_cmd = [sys.executable, fake_model_path, input_case_dir, outputs_root]
     else:
         print(f"[ERROR] Unknown model: {model}")
         return None
@@ -75,12 +129,12 @@ def run_auto_segmentation(input_path, session_dir, model):
     try:
         print(f"[INFO] Running {model} auto segmentation for file: {input_filename}")
         full_cmd = f"{conda_activate_cmd} {' '.join(apptainer_cmd)}"
-        subprocess.run(full_cmd, shell=True, executable="/bin/bash", check=True)
+        run_with_progress(full_cmd, progress_callback)
     except subprocess.CalledProcessError as e:
         print(f"[ERROR] {model} inference failed:", e)
         return None
 
-    if model == 'SuPreM':
+    if model in ('SuPreM', 'fake'):
         output_path = os.path.join(outputs_root, subfolder_name, "segmentations")
         if not os.path.exists(output_path):
             print("[ERROR] Output mask not found at:", output_path)
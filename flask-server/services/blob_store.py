@@ -0,0 +1,132 @@
+from constants import Constants
+import threading
+import hashlib
+import shutil
+import os
+
+
+CHUNK_SIZE = 1 << 20
+
+
+def file_suffix(filename):
+    """Extension of filename including double extensions such as .nii.gz."""
+    name = os.path.basename(filename or "").lower()
+    for suffix in (".nii.gz", ".tar.gz"):
+        if name.endswith(suffix):
+            return suffix
+    return os.path.splitext(name)[1]
+
+
+def link_or_copy(src, dst):
+    """Hard-link src to dst (replacing dst), or copy it when linking is not possible (other file system)."""
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+class BlobStore(object):
+    """
+    Content-addressed file store: every distinct upload is kept once as
+    BLOB_STORE_DIR/<first 2 hex digits>/<sha256><suffix> and hard-linked into the
+    session directories that use it. Blobs are never modified in place, so a link can
+    be handed to a model run safely.
+    """
+    _instance = None
+
+    def __init__(self, root=None):
+        self.root = root or Constants.BLOB_STORE_DIR
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def path(self, digest, suffix=""):
+        return os.path.join(self.root, digest[:2], f"{digest}{suffix}")
+
+    def put_stream(self, stream, suffix=""):
+        """
+        Store the contents of a binary stream, hashing it while it is written to disk.
+        Returns (sha256 hex digest, blob path); an existing blob is kept as it is.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = os.path.join(self.root, f".upload.{os.getpid()}.{threading.get_ident()}.tmp")
+        digest = hashlib.sha256()
+        try:
+            with open(tmp_path, "wb") as f:
+                for block in iter(lambda: stream.read(CHUNK_SIZE), b""):
+                    digest.update(block)
+                    f.write(block)
+            path = self.path(digest.hexdigest(), suffix)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return digest.hexdigest(), path
+
+
+class SegmentationCache(object):
+    """
+    Model outputs by (CT content hash, model name), so a scan that was segmented before
+    is answered without running the model again.
+
+    An entry is the directory SEGMENTATION_CACHE_DIR/<model>/<sha256>/ with the masks
+    (masks/*.nii.gz) and their auto_masks.zip. Entries are assembled in a temporary
+    directory and renamed into place, so a present entry is always complete.
+    """
+    _instance = None
+
+    def __init__(self, root=None):
+        self.root = root or Constants.SEGMENTATION_CACHE_DIR
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def entry_dir(self, input_hash, model_name):
+        return os.path.join(self.root, model_name, input_hash)
+
+    def get(self, input_hash, model_name):
+        """(masks dir, zip path) of a cached result, or None."""
+        entry = self.entry_dir(input_hash, model_name)
+        zip_path = os.path.join(entry, "auto_masks.zip")
+        return (os.path.join(entry, "masks"), zip_path) if os.path.exists(zip_path) else None
+
+    def put(self, input_hash, model_name, output_dir, zip_path):
+        """Cache the *.nii.gz masks of output_dir and their zip, linked where possible."""
+        entry = self.entry_dir(input_hash, model_name)
+        if os.path.exists(entry):
+            return
+        tmp_entry = f"{entry}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            for filename in os.listdir(output_dir):
+                if filename.endswith(".nii.gz"):
+                    link_or_copy(os.path.join(output_dir, filename), os.path.join(tmp_entry, "masks", filename))
+            link_or_copy(zip_path, os.path.join(tmp_entry, "auto_masks.zip"))
+            os.replace(tmp_entry, entry)
+        except OSError:
+            if not os.path.exists(entry):  # a concurrent put that won the rename is fine
+                raise
+        finally:
+            shutil.rmtree(tmp_entry, ignore_errors=True)
+
+    def restore(self, input_hash, model_name, session_path):
+        """
+        Link a cached result into session_path as auto_masks.zip.
+        Returns (masks dir, zip path) or None on a cache miss.
+        """
+        cached = self.get(input_hash, model_name)
+        if cached is None:
+            return None
+        masks_dir, cached_zip = cached
+        return masks_dir, link_or_copy(cached_zip, os.path.join(session_path, "auto_masks.zip"))
@@ -0,0 +1,153 @@
+from collections import OrderedDict
+from constants import Constants
+import threading
+import hashlib
+import json
+import os
+
+
+def file_fingerprint(path):
+    """
+    Cheap identity of a file on disk: (mtime_ns, size).
+    """
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    """
+    Content hash of a file, read in chunks so large volumes are never held in memory.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ColormapCache(object):
+    """
+    Two-tier cache for label colormaps.
+
+    Tier 1 is an in-process LRU keyed by (label path, mtime_ns, size).
+    Tier 2 is a JSON sidecar written next to the combined labels file which records
+    the mtime, size and sha256 of the labels it was computed from. A sidecar whose
+    mtime/size no longer match is still reused if the content hash is unchanged, so
+    touching or copying the labels does not force a recompute, while regenerating
+    them does.
+    """
+    _instance = None
+
+    def __init__(self, max_entries=Constants.COLORMAP_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # (path, mtime_ns, size) -> color_map
+        self._lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    @staticmethod
+    def sidecar_path(clabel_path):
+        base = str(clabel_path)
+        for ext in (".nii.gz", ".npz", ".npy"):
+            if base.endswith(ext):
+                base = base[:-len(ext)]
+                break
+        return base + Constants.COLORMAP_SIDECAR_SUFFIX
+
+    def get(self, clabel_path, compute_fn):
+        """
+        Return the colormap for clabel_path, calling compute_fn(clabel_path) only if
+        neither the memory nor the disk tier holds a colormap for the current labels.
+        """
+        clabel_path = os.path.abspath(clabel_path)
+        mtime_ns, size = file_fingerprint(clabel_path)
+        key = (clabel_path, mtime_ns, size)
+
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        sha256 = None
+        color_map = None
+        sidecar = self._read_sidecar(clabel_path)
+        if sidecar is not None:
+            source = sidecar["source"]
+            if source["mtime_ns"] == mtime_ns and source["size"] == size:
+                color_map = sidecar["color_map"]
+            elif source["size"] == size:
+                sha256 = file_sha256(clabel_path)
+                if source["sha256"] == sha256:
+                    color_map = sidecar["color_map"]
+                    # refresh the fingerprint so the next lookup skips hashing
+                    self._write_sidecar(clabel_path, mtime_ns, size, sha256, color_map)
+
+        if color_map is None:
+            color_map = compute_fn(clabel_path)
+            if sha256 is None:
+                sha256 = file_sha256(clabel_path)
+            self._write_sidecar(clabel_path, mtime_ns, size, sha256, color_map)
+
+        self._put(key, color_map)
+        return color_map
+
+    def invalidate(self, clabel_path):
+        """Drop every cached colormap for clabel_path, in memory and on disk."""
+        clabel_path = os.path.abspath(clabel_path)
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == clabel_path]:
+                del self._entries[key]
+        try:
+            os.remove(self.sidecar_path(clabel_path))
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _put(self, key, color_map):
+        with self._lock:
+            # an older fingerprint of the same file can never be hit again
+            for stale in [k for k in self._entries if k[0] == key[0] and k != key]:
+                del self._entries[stale]
+            self._entries[key] = color_map
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _read_sidecar(self, clabel_path):
+        path = self.sidecar_path(clabel_path)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, "r") as f:
+                sidecar = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Ignoring unreadable colormap sidecar {path}: {e}")
+            return None
+        if sidecar.get("version") != Constants.COLORMAP_CACHE_VERSION:
+            return None
+        return sidecar
+
+    def _write_sidecar(self, clabel_path, mtime_ns, size, sha256, color_map):
+        path = self.sidecar_path(clabel_path)
+        sidecar = {
+            "version": Constants.COLORMAP_CACHE_VERSION,
+            "source": {"mtime_ns": mtime_ns, "size": size, "sha256": sha256},
+            "color_map": color_map,
+        }
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(sidecar, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # read-only dataset mounts still get the in-memory tier
+            print(f"⚠️ Could not write colormap sidecar {path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,54 @@
+"""
+Stand-in for the SuPreM/ePAI containers, for development and tests without a GPU.
+
+Reads the CT in <inputs>/ct/, waits --seconds while printing progress, and writes
+SuPreM-style masks to <outputs>/ct/segmentations/<organ>.nii.gz (a box in the middle
+of the volume per organ). Selected with MODEL_NAME=fake when FAKE_MODEL_ENABLED is set.
+"""
+import argparse
+import os
+import sys
+import time
+import nibabel as nib
+import numpy as np
+
+
+ORGANS = ("liver", "pancreas", "spleen")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake auto-segmentation model")
+    parser.add_argument("inputs", help="directory with a ct/ subfolder holding the CT")
+    parser.add_argument("outputs", help="directory the ct/segmentations masks are written to")
+    parser.add_argument("--seconds", type=float, default=float(os.environ.get("FAKE_MODEL_SECONDS", 1)))
+    parser.add_argument("--fail", action="store_true", default=os.environ.get("FAKE_MODEL_FAIL", "").lower() == "true")
+    args = parser.parse_args(argv)
+
+    ct_dir = os.path.join(args.inputs, "ct")
+    ct_files = sorted(f for f in os.listdir(ct_dir) if f.endswith((".nii", ".nii.gz")))
+    if not ct_files:
+        print(f"no CT in {ct_dir}", file=sys.stderr)
+        return 1
+    ct = nib.load(os.path.join(ct_dir, ct_files[0]))
+
+    steps = 10
+    for step in range(1, steps + 1):
+        time.sleep(args.seconds / steps)
+        print(f"progress: {100 * step // steps}%", flush=True)
+    if args.fail:
+        print("fake model failure", file=sys.stderr)
+        return 1
+
+    seg_dir = os.path.join(args.outputs, "ct", "segmentations")
+    os.makedirs(seg_dir, exist_ok=True)
+    shape = ct.shape[:3]
+    for i, organ in enumerate(ORGANS):
+        mask = np.zeros(shape, dtype=np.uint8)
+        box = tuple(slice(n * (i + 1) // (len(ORGANS) + 2), n * (i + 2) // (len(ORGANS) + 2) + 1) for n in shape)
+        mask[box] = 1
+        nib.save(nib.Nifti1Image(mask, ct.affine), os.path.join(seg_dir, f"{organ}.nii.gz"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+from collections import defaultdict
+import threading
+import atexit
+import signal
+import os
+import queue
+import json
+import time
+
+
+SHUTDOWN = object()
+
+
+def format_sse(data, event=None, retry=None):
+    """One Server-Sent Events message with JSON data."""
+    lines = []
+    if retry is not None:
+        lines.append(f"retry: {int(retry)}")
+    if event is not None:
+        lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data)}")
+    return "\n".join(lines) + "\n\n"
+
+
+class JobEvents(object):
+    """
+    In-process fan-out of job notifications to open progress streams, keyed by session
+    ID. A notification only wakes the streams of the session up; they read the job state
+    from the database themselves, so the same code serves jobs running in other server
+    processes (found when the stream polls). shutdown() ends every stream. It is run at
+    interpreter exit, and through shutdown_on() from the signal that stops a gunicorn
+    worker: gthread workers wait for their request threads before atexit hooks run.
+    """
+    _instance = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+        self.closed = False
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+            atexit.register(cls._instance.shutdown)
+        return cls._instance
+
+    @classmethod
+    def shutdown_on(cls, *signums):
+        """
+        Run shutdown() when one of signums arrives, then the handler installed before
+        (e.g. gunicorn's graceful exit). shutdown() runs on its own thread so a signal
+        that interrupts a thread holding the lock cannot deadlock.
+        """
+        for signum in signums:
+            previous = signal.getsignal(signum)
+
+            def handler(sig, frame, previous=previous):
+                threading.Thread(target=cls.instance().shutdown, daemon=True).start()
+                if callable(previous):
+                    previous(sig, frame)
+                elif previous == signal.SIG_DFL:
+                    signal.signal(sig, signal.SIG_DFL)
+                    os.kill(os.getpid(), sig)
+
+            signal.signal(signum, handler)
+
+    def subscribe(self, session_id):
+        subscriber = queue.Queue()
+        with self._lock:
+            self._subscribers[session_id].add(subscriber)
+            if self.closed:
+                subscriber.put(SHUTDOWN)
+        return subscriber
+
+    def unsubscribe(self, session_id, subscriber):
+        with self._lock:
+            self._subscribers[session_id].discard(subscriber)
+            if not self._subscribers[session_id]:
+                del self._subscribers[session_id]
+
+    def subscriber_count(self, session_id):
+        with self._lock:
+            return len(self._subscribers.get(session_id, ()))
+
+    def publish(self, session_id, event=None):
+        with self._lock:
+            subscribers = list(self._subscribers.get(session_id, ()))
+        for subscriber in subscribers:
+            subscriber.put(event)
+
+    def wait_for(self, session_id, check, timeout, poll):
+        """
+        Call check() until it returns something truthy or timeout seconds have passed,
+        re-checking whenever session_id is notified and at least every poll seconds (for
+        changes made by other processes). Returns the last result of check().
+        """
+        subscriber = self.subscribe(session_id)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                result = check()
+                remaining = deadline - time.monotonic()
+                if result or remaining <= 0:
+                    return result
+                try:
+                    if subscriber.get(timeout=min(poll, remaining)) is SHUTDOWN:
+                        return check()
+                except queue.Empty:
+                    pass
+        finally:
+            self.unsubscribe(session_id, subscriber)
+
+    def shutdown(self):
+        with self._lock:
+            self.closed = True
+            subscribers = [s for group in self._subscribers.values() for s in group]
+        for subscriber in subscribers:
+            subscriber.put(SHUTDOWN)
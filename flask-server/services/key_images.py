@@ -0,0 +1,128 @@
+from constants import Constants
+from services.organ_metrics import as_label_array
+from services.slice_renderer import window_slice, display_orientation
+from io import BytesIO
+from PIL import Image
+import numpy as np
+
+
+RED = (255, 0, 0)
+YELLOW = (255, 255, 0)
+
+
+def slice_label_counts(labels, axis=2, n_labels=None):
+    """
+    Voxel count of every label on every slice along axis, as an (n_labels, n_slices)
+    array, from a single pass over the volume with one bincount per slice. Counting
+    slice by slice keeps the labels in their own dtype instead of building a
+    volume-sized int64 (label, slice) index, which is several times slower.
+    """
+    labels = as_label_array(labels)
+    n_labels = (int(labels.max()) + 1 if labels.size else 1) if n_labels is None else n_labels
+    counts = np.zeros((n_labels, labels.shape[axis]), dtype=np.int64)
+    for index in range(labels.shape[axis]):
+        # labels >= n_labels are cut off
+        counts[:, index] = np.bincount(take_slice(labels, index, axis).ravel(order="K"), minlength=n_labels)[:n_labels]
+    return counts
+
+
+def most_labeled_slices(labels, label_ids=None, axis=2):
+    """{label_id: index of the slice along axis with the most voxels of that label}; absent labels are left out."""
+    counts = slice_label_counts(labels, axis)
+    if label_ids is None:
+        label_ids = range(1, len(counts))
+    return {
+        int(label_id): int(np.argmax(counts[label_id]))
+        for label_id in label_ids if 0 < label_id < len(counts) and counts[label_id].any()
+    }
+
+
+def take_slice(volume, index, axis=2):
+    """One slice of an array or a nibabel dataobj proxy; proxies only read that slice."""
+    key = tuple(index if a == axis else slice(None) for a in range(len(volume.shape)))
+    return np.asarray(volume[key])
+
+
+def mask_outline(mask):
+    """Pixels of a 2D mask with a 4-neighbour outside the mask (or the image)."""
+    mask = np.asarray(mask, dtype=bool)
+    padded = np.pad(mask, 1)
+    interior = padded[:-2, 1:-1] & padded[2:, 1:-1] & padded[1:-1, :-2] & padded[1:-1, 2:]
+    return mask & ~interior
+
+
+def render_key_image(ct, labels, label_id, index=None, axis=2, outlines=None, zoom=False,
+                     padding=20, size=None, window_center=None, window_width=None, image_format="PNG"):
+    """
+    Render the key image of label_id: the CT slice along axis with the most voxels of the
+    label (or slice index), windowed and outlined in place, as an encoded image buffer.
+    outlines maps label IDs to RGB colors (default: label_id in red). With zoom, the image
+    is cropped to the label's bounding box on the slice grown by padding pixels. size
+    scales the longer edge; masks are scaled with nearest-neighbour so outlines stay sharp.
+
+    ct and labels can be arrays or nibabel dataobj proxies. Returns None if the label does
+    not occur.
+    """
+    window_center = Constants.KEY_IMAGE_WINDOW_CENTER if window_center is None else window_center
+    window_width = Constants.KEY_IMAGE_WINDOW_WIDTH if window_width is None else window_width
+    outlines = outlines or {label_id: RED}
+    if index is None:
+        index = most_labeled_slices(labels, [label_id], axis).get(label_id)
+        if index is None:
+            return None
+
+    gray = display_orientation(window_slice(take_slice(ct, index, axis), window_center, window_width))
+    label_slice = display_orientation(as_label_array(take_slice(labels, index, axis)))
+    if gray.shape != label_slice.shape:
+        raise ValueError(f"Shape mismatch: CT slice {gray.shape}, label slice {label_slice.shape}")
+
+    if zoom:
+        rows, cols = np.nonzero(label_slice == label_id)
+        if rows.size == 0:
+            return None
+        top, left = max(rows.min() - padding, 0), max(cols.min() - padding, 0)
+        bottom, right = rows.max() + padding + 1, cols.max() + padding + 1
+        gray, label_slice = gray[top:bottom, left:right], label_slice[top:bottom, left:right]
+
+    gray_img = Image.fromarray(np.ascontiguousarray(gray))
+    if size is not None:
+        scale = size / max(gray.shape)
+        new_size = (max(round(gray.shape[1] * scale), 1), max(round(gray.shape[0] * scale), 1))
+        gray_img = gray_img.resize(new_size, Image.LANCZOS)
+        label_slice = np.asarray(Image.fromarray(np.ascontiguousarray(label_slice.astype(np.int32))).resize(new_size, Image.NEAREST))
+
+    rgb = np.repeat(np.asarray(gray_img)[..., None], 3, axis=2)
+    for outline_id, color in outlines.items():
+        rgb[mask_outline(label_slice == outline_id)] = color
+
+    buf = BytesIO()
+    Image.fromarray(rgb).save(buf, format=image_format)
+    buf.seek(0)
+    return buf
+
+
+def key_images(ct, labels, organs, axis=2, size=None):
+    """
+    Overview and zoomed key image of several organs with one slice search.
+    organs maps a name to (label_id, outlines) as in render_key_image. Returns
+    {name: (overview buffer, zoomed buffer)} for the organs present in labels; an organ
+    whose images cannot be rendered is logged and left out.
+    """
+    labels = as_label_array(labels)
+    size = size or Constants.KEY_IMAGE_SIZE
+    slices = most_labeled_slices(labels, [label_id for label_id, _ in organs.values()], axis)
+
+    images = {}
+    for name, (label_id, outlines) in organs.items():
+        if label_id not in slices:
+            continue
+        kwargs = dict(index=slices[label_id], axis=axis, outlines=outlines, size=size)
+        try:
+            overview = render_key_image(ct, labels, label_id, **kwargs)
+            zoomed = render_key_image(ct, labels, label_id, zoom=True, **kwargs)
+        except Exception as e:
+            print(f"❌ [KeyImages] Could not render {name}: {e}")
+            continue
+        if overview is not None and zoomed is not None:
+            images[name] = (overview, zoomed)
+    return images
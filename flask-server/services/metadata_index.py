@@ -0,0 +1,138 @@
+from constants import Constants
+from openpyxl import load_workbook
+import threading
+import sqlite3
+import os
+import re
+
+
+def normalise_column(header):
+    """'PanTS ID' -> 'id', 'ct phase' -> 'ct_phase', 'tumor?' -> 'tumor'."""
+    if header == "PanTS ID":
+        return "id"
+    return re.sub(r"[^0-9a-z]+", "_", str(header).lower()).strip("_")
+
+
+def parse_tuple(value, cast=float):
+    """'(0.625, 0.625, 0.8)' -> (0.625, 0.625, 0.8)"""
+    if value is None:
+        return None
+    return tuple(cast(x) for x in str(value).strip("()").split(",") if x.strip())
+
+
+class MetadataIndex(object):
+    """
+    Columnar, in-memory index of the PanTS_metadata sheet keyed by PanTS ID.
+
+    The workbook is parsed once; lookups are dict hits. Each lookup checks the xlsx
+    mtime and reloads if the file changed. The parsed table is also persisted to a small
+    SQLite file (METADATA_INDEX_PATH, next to the xlsx by default) so new workers skip
+    the openpyxl parse while the xlsx is unchanged.
+    """
+    _instance = None
+
+    def __init__(self, xlsx_path=None, sqlite_path=None, sheet_name="PanTS_metadata"):
+        self.xlsx_path = xlsx_path or os.path.join(Constants.PANTS_PATH, "data", "metadata.xlsx")
+        if sqlite_path is None:
+            sqlite_path = Constants.METADATA_INDEX_PATH or os.path.splitext(self.xlsx_path)[0] + ".index.sqlite"
+        self.sqlite_path = sqlite_path
+        self.sheet_name = sheet_name
+        self._lock = threading.Lock()
+        self._mtime_ns = None
+        self.columns = {}  # column name -> list of values
+        self._row_of = {}  # PanTS ID -> row index
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def _ensure_loaded(self):
+        mtime_ns = os.stat(self.xlsx_path).st_mtime_ns
+        if mtime_ns == self._mtime_ns:
+            return
+        with self._lock:
+            if mtime_ns == self._mtime_ns:
+                return
+            columns = self._load_sqlite(mtime_ns)
+            if columns is None:
+                print(f"[MetadataIndex] Parsing {self.xlsx_path}")
+                columns = self._parse_xlsx()
+                self._save_sqlite(columns, mtime_ns)
+            self.columns = columns
+            self._row_of = {panTS_id: i for i, panTS_id in enumerate(columns["id"])}
+            self._mtime_ns = mtime_ns
+
+    def _parse_xlsx(self):
+        wb = load_workbook(self.xlsx_path, read_only=True)
+        try:
+            rows = wb[self.sheet_name].iter_rows(values_only=True)
+            names = [normalise_column(h) for h in next(rows)]
+            columns = {name: [] for name in names}
+            for row in rows:
+                if row[0] is None:
+                    continue
+                for name, value in zip(names, row):
+                    columns[name].append(value)
+        finally:
+            wb.close()
+        return columns
+
+    def _load_sqlite(self, mtime_ns):
+        if not self.sqlite_path or not os.path.exists(self.sqlite_path):
+            return None
+        try:
+            with sqlite3.connect(self.sqlite_path) as conn:
+                source = conn.execute("SELECT value FROM meta WHERE key = 'source_mtime_ns'").fetchone()
+                if source is None or int(source[0]) != mtime_ns:
+                    return None
+                cursor = conn.execute("SELECT * FROM metadata ORDER BY rowid")
+                names = [d[0] for d in cursor.description]
+                rows = cursor.fetchall()
+        except sqlite3.Error as e:
+            print(f"⚠️ [MetadataIndex] Ignoring unreadable index {self.sqlite_path}: {e}")
+            return None
+        return {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+    def _save_sqlite(self, columns, mtime_ns):
+        if not self.sqlite_path:
+            return
+        names = list(columns)
+        column_defs = ", ".join(f'"{n}" PRIMARY KEY' if n == "id" else f'"{n}"' for n in names)
+        tmp_path = f"{self.sqlite_path}.{os.getpid()}.tmp"
+        try:
+            with sqlite3.connect(tmp_path) as conn:
+                conn.execute("CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)")
+                conn.execute("INSERT INTO meta VALUES ('source_mtime_ns', ?)", (str(mtime_ns),))
+                conn.execute(f"CREATE TABLE metadata ({column_defs})")
+                conn.executemany(
+                    f"INSERT INTO metadata VALUES ({', '.join('?' * len(names))})",
+                    zip(*(columns[n] for n in names))
+                )
+            conn.close()
+            os.replace(tmp_path, self.sqlite_path)
+        except (OSError, sqlite3.Error) as e:
+            # read-only dataset mounts still get the in-memory index
+            print(f"⚠️ [MetadataIndex] Could not persist index to {self.sqlite_path}: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, panTS_id):
+        """Return the metadata row for panTS_id as a dict, or None if it is not listed."""
+        self._ensure_loaded()
+        i = self._row_of.get(panTS_id)
+        if i is None:
+            return None
+        return {name: values[i] for name, values in self.columns.items()}
+
+    def get_many(self, panTS_ids):
+        return {panTS_id: self.get(panTS_id) for panTS_id in panTS_ids}
+
+    def spacing(self, panTS_id):
+        row = self.get(panTS_id)
+        return parse_tuple(row["spacing"]) if row else None
+
+    def shape(self, panTS_id):
+        row = self.get(panTS_id)
+        return parse_tuple(row["shape"], cast=int) if row else None
@@ -0,0 +1,61 @@
+from constants import Constants
+import scipy.ndimage as ndimage
+import numpy as np
+
+
+def structure_radius(structure):
+    """Per-axis reach of a structuring element, e.g. (2, 2, 2) for a 5x5x5 cube."""
+    return tuple(n // 2 for n in structure.shape)
+
+
+def label_boxes(labels):
+    """
+    Bounding boxes of every label in one pass: {label_id: tuple of slices}. Labels that do
+    not occur are left out.
+    """
+    labels = np.asarray(labels)
+    if not np.issubdtype(labels.dtype, np.integer):
+        labels = np.rint(labels).astype(np.int32)
+    return {i + 1: box for i, box in enumerate(ndimage.find_objects(labels)) if box is not None}
+
+
+def mask_box(mask):
+    """Bounding box of a boolean mask, or None if it is empty."""
+    boxes = ndimage.find_objects(np.asarray(mask).astype(bool, copy=False).view(np.uint8))
+    return boxes[0] if boxes else None
+
+
+def pad_box(box, radius, shape):
+    """Grow box by radius on every side, clipped to the volume."""
+    return tuple(slice(max(s.start - r, 0), min(s.stop + r, n)) for s, r, n in zip(box, radius, shape))
+
+
+def binary_op_roi(op, volume, structure=None, box=None, label_id=None):
+    """
+    Run a binary morphology op (ndimage.binary_erosion / binary_dilation) only on the
+    bounding box of a mask grown by the structuring-element radius. Returns
+    (region, result) where result is the op's output on the cropped mask; everything
+    outside region is False for both erosion and dilation, so the crop gives exactly the
+    full-volume result. (None, None) for an empty mask.
+
+    volume is a mask, or a label map when label_id is given; the label's mask is then
+    only ever built inside region. box (e.g. from label_boxes) skips the bounding-box
+    search.
+    """
+    structure = Constants.STRUCTURING_ELEMENT if structure is None else structure
+    if box is None:
+        box = mask_box(volume if label_id is None else volume == label_id)
+    if box is None:
+        return None, None
+    region = pad_box(box, structure_radius(structure), volume.shape)
+    mask = volume[region] if label_id is None else volume[region] == label_id
+    return region, op(mask, structure=structure)
+
+
+def binary_erosion_roi(volume, structure=None, box=None, label_id=None):
+    return binary_op_roi(ndimage.binary_erosion, volume, structure, box, label_id)
+
+
+def binary_dilation_roi(volume, structure=None, box=None, label_id=None):
+    return binary_op_roi(ndimage.binary_dilation, volume, structure, box, label_id)
+
@@ -6,6 +6,8 @@ import scipy.ndimage as ndimage
 import os
 import tempfile
 from scipy.ndimage import label
+from services.morphology import binary_dilation_roi, label_boxes
+from services.organ_metrics import summarise_organs, as_label_array
 
 
 def has_large_connected_component(slice_mask, threshold=8):
@@ -35,64 +37,25 @@ class NiftiProcessor:
     def calculate_metrics(self):    
         """
         Calculate volume and mean HU for each organ based on the segmentation.
+        All organs are measured together by services.organ_metrics (one bincount pass for
+        volumes, one over the eroded label map for the mean HU).
         """
         if self._organ_intensities is None or self._clabel_path is None or self._main_nifti_path is None:
             raise Exception("Cannot calculate metrics if self._organ_intensities, self._clabel_path, or self._main_nifti_path is None.")  
 
-        data = {"organ_metrics": []}
-
         clabel_obj = nib.load(self._clabel_path)
         main_nifti_obj = nib.load(self._main_nifti_path)
 
-        clabel_array = np.around(clabel_obj.get_fdata())
+        clabel_array = as_label_array(np.asanyarray(clabel_obj.dataobj))
         clabel_header = clabel_obj.header
-        main_nifti_array = main_nifti_obj.get_fdata()
-
-        intensities, frequencies = np.unique(clabel_array, return_counts=True)
-        int_freq = {round(intensities[i]): int(frequencies[i]) for i in range(len(intensities))}
+        main_nifti_array = main_nifti_obj.get_fdata(dtype=np.float32)
 
         voxel_dims_mm = clabel_header.get_zooms()
         voxel_volume_cm3 = np.prod(voxel_dims_mm) / 1000  # convert mm³ to cm³
 
-        for organ, label_val in self._organ_intensities.items():
-            binary_mask = (clabel_array == label_val)
-            slice_0 = binary_mask[:, :, 0]
-            slice_last = binary_mask[:, :, -1]
-
-            if has_large_connected_component(slice_0, 8) or has_large_connected_component(slice_last, 8):
-                data["organ_metrics"].append({
-                    "organ_name": organ,
-                    "volume_cm3": self.number_max,
-                    "mean_hu": self.number_max
-                })
-                continue
-
-            volume_cm3 = round(float(int_freq[label_val] * voxel_volume_cm3), Constants.DECIMAL_PRECISION_VOLUME)
-            mean_hu = self.calculate_mean_hu_with_erosion(binary_mask, main_nifti_array)
-
-            data["organ_metrics"].append({
-                "organ_name": organ,
-                "volume_cm3": volume_cm3,
-                "mean_hu": mean_hu
-            })
-
+        data, _ = summarise_organs(clabel_array, main_nifti_array, self._organ_intensities, voxel_volume_cm3, self.number_max)
         return data
 
-    def calculate_mean_hu_with_erosion(self, binary_mask, ct_array):
-        """
-        Calculate mean HU using erosion to avoid edge noise.
-        """
-        erosion_array = ndimage.binary_erosion(binary_mask, structure=Constants.STRUCTURING_ELEMENT)
-        hu_values = ct_array[erosion_array > 0]
-
-        if hu_values.size == 0:
-            hu_values = ct_array[binary_mask > 0]
-
-        if hu_values.size == 0:
-            return 0
-
-        return round(float(np.mean(hu_values)), Constants.DECIMAL_PRECISION_HU)
-
     def combine_labels(self, filenames: list[str], nifti_multi_dict: MultiDict, save=True):
         """
         Merge multiple label masks into one combined segmentation and re-index the labels.
@@ -177,30 +140,34 @@ class NiftiProcessor:
     def __str__(self):
         return f"NiftiProcessor Object\n main_nifti_path: {self._main_nifti_path}\n clabel_path: {self._clabel_path}"
 
-    def calculate_pdac_sma_staging(self):
+    def calculate_pdac_sma_staging(self, clabel_data=None):
         """
         Determine staging of pancreatic cancer based on SMA contact ratio.
+        clabel_data skips reloading the labels when the caller already has them.
         """
-        if self._clabel_path is None:
-            raise Exception("clabel path is not set.")
-
-        clabel_obj = nib.load(self._clabel_path)
-        clabel_data = np.around(clabel_obj.get_fdata()).astype(np.uint8)
+        if clabel_data is None:
+            if self._clabel_path is None:
+                raise Exception("clabel path is not set.")
+            clabel_obj = nib.load(self._clabel_path)
+            clabel_data = np.asanyarray(clabel_obj.dataobj)
+        clabel_data = as_label_array(clabel_data)
 
         PDAC_LABEL = 23  # pancreatic_pdac
         SMA_LABEL = 15   # superior_mesenteric_artery
 
-        pdac_mask = (clabel_data == PDAC_LABEL)
-        sma_mask = (clabel_data == SMA_LABEL)
+        # one find_objects pass locates both structures; the dilation and the contact
+        # count only touch the PDAC bounding box grown by the structuring-element radius
+        boxes = label_boxes(clabel_data)
 
-        if np.sum(pdac_mask) == 0:
+        if PDAC_LABEL not in boxes:
             return "Stage T1 (No PDAC tumor present)"
-        if np.sum(sma_mask) == 0:
+        if SMA_LABEL not in boxes:
             return "Unknown (SMA not found)"
 
-        pdac_dilated = ndimage.binary_dilation(pdac_mask, structure=Constants.STRUCTURING_ELEMENT)
-        contact_voxels = pdac_dilated & sma_mask
-        contact_ratio = np.sum(contact_voxels) / np.sum(sma_mask)
+        region, pdac_dilated = binary_dilation_roi(clabel_data, box=boxes[PDAC_LABEL], label_id=PDAC_LABEL)
+        contact_voxels = np.count_nonzero(pdac_dilated & (clabel_data[region] == SMA_LABEL))
+        sma_voxels = np.count_nonzero(clabel_data[boxes[SMA_LABEL]] == SMA_LABEL)
+        contact_ratio = contact_voxels / sma_voxels
 
         if contact_ratio > 0.7:
             return "Stage T4 (SMA encasement > 180°)"
@@ -1,13 +1,17 @@
 import nibabel as nib
 import numpy as np
 from constants import Constants
+from services.volume_store import VolumeStore
+from services.metadata_index import MetadataIndex
 from werkzeug.datastructures import MultiDict
 import scipy.ndimage as ndimage
 import os, sys
 import tempfile
 from scipy.ndimage import label
 import pathlib
-from openpyxl import load_workbook
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 def get_panTS_id(index):
     cur_case_id = str(index)
@@ -17,6 +21,23 @@ def get_panTS_id(index):
     cur_case_id = "PanTS_" + cur_case_id    
     return cur_case_id
 
+def get_ct_npz_path(index):
+    subfolder = "ImageTr" if int(index) < 9000 else "ImageTe"
+    return os.path.join(Constants.PANTS_PATH, "data", subfolder, get_panTS_id(int(index)), Constants.MAIN_NPZ_FILENAME)
+
+def get_clabel_npz_path(index):
+    subfolder = "LabelTr" if int(index) < 9000 else "LabelTe"
+    return os.path.join(Constants.PANTS_PATH, "data", subfolder, get_panTS_id(int(index)), Constants.COMBINED_LABELS_FILENAME)
+
+def get_segmentations_dir(index):
+    subfolder = "LabelTr" if int(index) < 9000 else "LabelTe"
+    return os.path.join(Constants.PANTS_PATH, "data", subfolder, get_panTS_id(int(index)), "segmentations")
+
+def case_organ_intensities(index):
+    """The filename -> label mapping NpzProcessor.combine_labels gives case index."""
+    npz_files = list(pathlib.Path(get_segmentations_dir(index)).glob("*.npz"))
+    return {npz_files[i].name: i + 1 for i in range(len(npz_files))}
+
 def has_large_connected_component(slice_mask, threshold=8):
     """
     Check if there is a connected component larger than a threshold in a 2D mask.
@@ -26,6 +47,52 @@ def has_large_connected_component(slice_mask, threshold=8):
     sizes[0] = 0  # ignore background
     return np.any(sizes > threshold)
 
+def label_dtype(n_labels):
+    """Smallest unsigned dtype that holds label IDs 0..n_labels."""
+    return np.uint8 if n_labels <= np.iinfo(np.uint8).max else np.uint16
+
+def paint_label(combined, mask, label_id, overlap="last"):
+    """
+    Write label_id into combined wherever mask is set, in place.
+    overlap="last" gives a voxel claimed by several organs to the highest label ID (what
+    the old np.maximum merge did, later files having higher IDs); overlap="first" gives
+    it to the lowest. Either way the result does not depend on the order masks are
+    painted in, so they can be painted as they finish decoding.
+    """
+    mask = np.asarray(mask).astype(bool, copy=False)
+    label_id = combined.dtype.type(label_id)
+    if overlap == "last":
+        np.maximum(combined, label_id, out=combined, where=mask)
+    elif overlap == "first":
+        np.copyto(combined, label_id, where=mask & ((combined == 0) | (combined > label_id)))
+    else:
+        raise ValueError(f"Unknown overlap policy: {overlap}")
+
+def iter_decoded_npz(paths, workers=None, key="data"):
+    """
+    Read and decompress npz files on a bounded thread pool (zlib releases the GIL) and
+    yield (index, array) in completion order. At most 2 * workers arrays are decoded
+    ahead of the consumer, which bounds memory.
+    """
+    workers = workers or Constants.SEGMENTATION_IO_WORKERS
+
+    def decode(path):
+        with np.load(path) as npz:
+            return npz[key]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {}
+        queued = iter(enumerate(paths))
+        for i, path in itertools.islice(queued, 2 * workers):
+            pending[pool.submit(decode, path)] = i
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = pending.pop(future)
+                for j, path in itertools.islice(queued, 1):
+                    pending[pool.submit(decode, path)] = j
+                yield i, future.result()
+
 
 class NpzProcessor:
     def __init__(self, main_npz_path=None, clabel_path=None, organ_intensities=None):
@@ -33,6 +100,7 @@ class NpzProcessor:
         self._clabel_path = clabel_path
         self.number_max = 999999
         self._organ_intensities = organ_intensities
+        self.timings = {}
     
     def set_organ_intensities(self, organ_intensities):
         self._organ_intensities = organ_intensities
@@ -42,22 +110,6 @@ class NpzProcessor:
         
         return cls(None, clabel_path)
     
-    # not used
-    def calculate_mean_hu_with_erosion(self, binary_mask, ct_array):
-        """
-        Calculate mean HU using erosion to avoid edge noise.
-        """
-        erosion_array = ndimage.binary_erosion(binary_mask, structure=Constants.STRUCTURING_ELEMENT)
-        hu_values = ct_array[erosion_array > 0]
-
-        if hu_values.size == 0:
-            hu_values = ct_array[binary_mask > 0]
-
-        if hu_values.size == 0:
-            return 0
-
-        return round(float(np.mean(hu_values)), Constants.DECIMAL_PRECISION_HU)
-    
     def npz_to_nifti(self, id: int, combined_label=True, save=True):
         subfolder = "LabelTr" if combined_label else "ImageTr"
         if id >= 9000:
@@ -68,26 +120,13 @@ class NpzProcessor:
         else:
             dir_path = pathlib.Path(f"{Constants.PANTS_PATH}/data/{subfolder}/{get_panTS_id(id)}/ct.npz")
         
-        metadata_path = pathlib.Path(f"{Constants.PANTS_PATH}/data/metadata.xlsx")
-        
-        wb = load_workbook(metadata_path)
-        sheet = wb["PanTS_metadata"]
-        spacing = []
-        # ! col_0 - id, col_1 - shape, col_2 - spacing, col_3  - ct_phase, col_4 - sex, col_5 - age
-        for row in sheet.iter_rows(values_only=True):
-            if row[0] == get_panTS_id(id):
-                # make into int
-                spacing = row[2].strip("()").split(", ")
-                break
-                            
-        if len(spacing) == 0:
-            f"Could not find metadata for PanTS ID: {get_panTS_id(id)}"
+        spacing = MetadataIndex.instance().spacing(get_panTS_id(id))
+        if not spacing:
+            print(f"Could not find metadata for PanTS ID: {get_panTS_id(id)}")
             return None
+        spacing = list(spacing)
 
-        for i in range(len(spacing)):
-            spacing[i] = float(spacing[i])
-
-        arr = np.load(dir_path)["data"].astype(np.float32)
+        arr = VolumeStore.instance().load(dir_path).astype(np.float32)
         affine = np.diag(spacing + [1])
         img = nib.nifti1.Nifti1Image(arr, affine=affine)
         img.header.set_zooms(spacing) 
@@ -95,10 +134,19 @@ class NpzProcessor:
         nib.save(img, dir_path.with_suffix(".nii.gz"))
             
             
-    def combine_labels(self, id: int, save=True):   
+    def combine_labels(self, id: int, save=True, overlap=None, workers=None):
         """
         Merge multiple label masks into one combined segmentation and re-index the labels.
+        Organ i (in segmentation folder order) gets label i + 1; the labels are painted in
+        place into a uint8 volume (uint16 past 255 organs). overlap picks which organ keeps
+        a voxel claimed by several masks, see paint_label (default
+        Constants.COMBINE_LABELS_OVERLAP). Masks are decoded on `workers` threads
+        (default Constants.SEGMENTATION_IO_WORKERS) and painted as they arrive; the
+        run's timings are kept in self.timings.
         """
+        start = time.time()
+        overlap = overlap or Constants.COMBINE_LABELS_OVERLAP
+        workers = workers or Constants.SEGMENTATION_IO_WORKERS
         organ_intensities = {}
         segment_subfolder = "LabelTr"
         if id >= 9000:
@@ -109,22 +157,30 @@ class NpzProcessor:
         
         combined_labels_img_data = None
 
-        for i in range(len(npz_files)):
-            filename = npz_files[i].name
-            data = np.load(dir_path /filename)["data"]
+        for i, data in iter_decoded_npz(npz_files, workers):
             # not contiguous, may need original ct to get shape
             if combined_labels_img_data is None:
-                combined_labels_img_data = np.ndarray(shape=data.shape, dtype=np.float64)
+                # same memory layout as the masks (Fortran order in PanTS), else painting strides across the volume
+                combined_labels_img_data = np.zeros_like(data, dtype=label_dtype(len(npz_files)))
 
-            scaled = data * np.float64(i + 1)
-            combined_labels_img_data = np.maximum(combined_labels_img_data, scaled)
+            paint_label(combined_labels_img_data, data, i + 1, overlap)
+            del data
 
-            organ_intensities[filename] = i + 1
+        for i in range(len(npz_files)):
+            organ_intensities[npz_files[i].name] = i + 1
+        combine_seconds = time.time() - start
 
         if save:
             save_path = f"{Constants.PANTS_PATH}/data/{segment_subfolder}/{get_panTS_id(id)}/{Constants.COMBINED_LABELS_FILENAME}"
             np.savez_compressed(save_path, data=combined_labels_img_data)
 
+        self.timings = {
+            "decode_workers": workers,
+            "masks": len(npz_files),
+            "combine_seconds": round(combine_seconds, 3),
+            "total_seconds": round(time.time() - start, 3),
+        }
+        print(f"[NpzProcessor] combine_labels {get_panTS_id(id)}: {self.timings}")
         return combined_labels_img_data, organ_intensities
 
     def __str__(self):
@@ -0,0 +1,75 @@
+from models.base import db
+from models.combined_labels import CombinedLabels
+from services.colormap_cache import file_fingerprint, file_sha256
+import hashlib
+
+
+def input_fingerprint(paths):
+    return {path: list(file_fingerprint(path)) for path in paths}
+
+
+def input_hash(paths):
+    """sha256 over the sha256 of each input, in order."""
+    digest = hashlib.sha256()
+    for path in paths:
+        digest.update(file_sha256(path).encode("ascii"))
+    return digest.hexdigest()
+
+
+class OrganMetadataStore(object):
+    """
+    Organ metrics persisted in CombinedLabels.organ_metadata.
+
+    Metrics are computed once per combined-labels artifact and stored together with
+    the fingerprint (mtime_ns, size) and a content hash of the files they were computed
+    from (CT and labels). A request whose inputs still have the stored fingerprint is
+    answered from the row; if the fingerprint changed but the content hash did not
+    (touched or copied files) only the fingerprint is refreshed; otherwise the metrics
+    are recomputed. Needs an app context.
+    """
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def get_row(self, combined_labels_id):
+        stmt = db.select(CombinedLabels).where(CombinedLabels.combined_labels_id == combined_labels_id)
+        return db.session.execute(stmt).scalar()
+
+    def get(self, combined_labels_id, input_paths, compute_fn, clabel_path=None, organ_intensities=None, force=False):
+        """
+        Stored organ metadata of combined_labels_id, recomputed with compute_fn() (which
+        returns a JSON-serialisable dict) when input_paths changed. A CombinedLabels row
+        is created for artifacts that have none yet (PanTS dataset cases).
+        """
+        row = self.get_row(combined_labels_id)
+        stored = (row.organ_metadata or {}) if row is not None else {}
+        fingerprint = input_fingerprint(input_paths)
+
+        if not force and stored.get("fingerprint") == fingerprint:
+            return dict(stored)
+
+        content_hash = input_hash(input_paths)
+        if not force and stored.get("input_hash") == content_hash:
+            organ_metadata = dict(stored, fingerprint=fingerprint)
+        else:
+            print(f"[OrganMetadataStore] Computing organ metrics for {combined_labels_id}")
+            organ_metadata = dict(compute_fn(), input_hash=content_hash, fingerprint=fingerprint)
+
+        if row is None:
+            row = CombinedLabels(
+                combined_labels_id=combined_labels_id,
+                combined_labels_path=clabel_path or input_paths[-1],
+                organ_intensities=organ_intensities or {},
+                organ_metadata=organ_metadata
+            )
+            db.session.add(row)
+        else:
+            row.organ_metadata = organ_metadata
+            if organ_intensities is not None:
+                row.organ_intensities = organ_intensities
+        db.session.commit()
+        return dict(organ_metadata)
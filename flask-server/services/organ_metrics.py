@@ -0,0 +1,159 @@
+from constants import Constants
+from services.npz_processor import label_dtype, has_large_connected_component
+from services.morphology import label_boxes, binary_erosion_roi
+import numpy as np
+
+
+CHUNK_VOXELS = 1 << 22  # bounds the float64 temporaries of a reduction
+
+
+def _flat_pair(labels, values):
+    """Ravel labels and values in the same voxel order without copying either if possible."""
+    order = "F" if labels.flags.f_contiguous and (values is None or values.flags.f_contiguous) else "C"
+    flat_values = None if values is None else np.ravel(values, order=order)
+    return np.ravel(labels, order=order), flat_values
+
+
+def as_label_array(labels):
+    """
+    Integer label volume. Float volumes (get_fdata(), older combined_labels.npz) are
+    rounded into the smallest unsigned dtype.
+    """
+    labels = np.asarray(labels)
+    if np.issubdtype(labels.dtype, np.integer):
+        return labels
+    labels = np.rint(labels)
+    return labels.astype(label_dtype(int(labels.max()) if labels.size else 0))
+
+
+def eroded_labels(labels, structure=None):
+    """
+    Erode every label of a label map: a voxel keeps its label only if every voxel of the
+    structuring element around it carries the same label, as ndimage.binary_erosion of
+    each label's mask (border_value=0) would give. Each label is eroded only inside its
+    bounding box grown by the structuring-element radius, so small organs do not cost a
+    pass over the whole volume.
+    """
+    labels = as_label_array(labels)
+    eroded = np.zeros_like(labels)
+    for label_id, box in label_boxes(labels).items():
+        region, result = binary_erosion_roi(labels, structure, box=box, label_id=label_id)
+        eroded[region][result] = label_id
+    return eroded
+
+
+class LabelStatistics(object):
+    """
+    Per-label voxel counts and value sums of a label volume, indexed by label ID.
+
+    Computed by label_statistics() with np.bincount in one pass over the volume;
+    count/mean/std accept a label ID and return 0 for labels that are not present.
+    """
+
+    def __init__(self, counts, sums=None, sums_sq=None):
+        self.counts = counts
+        self.sums = sums
+        self.sums_sq = sums_sq
+
+    def _at(self, array, label_id):
+        label_id = int(label_id)
+        return array[label_id] if 0 <= label_id < len(array) else 0
+
+    def count(self, label_id):
+        return int(self._at(self.counts, label_id))
+
+    def volume(self, label_id, voxel_volume):
+        return self.count(label_id) * voxel_volume
+
+    def mean(self, label_id):
+        n = self.count(label_id)
+        return float(self._at(self.sums, label_id) / n) if n else 0.0
+
+    def std(self, label_id):
+        n = self.count(label_id)
+        if not n:
+            return 0.0
+        mean = self._at(self.sums, label_id) / n
+        return float(np.sqrt(max(self._at(self.sums_sq, label_id) / n - mean * mean, 0.0)))
+
+    def labels(self):
+        """IDs of the non-background labels present in the volume."""
+        return [int(i) for i in np.flatnonzero(self.counts) if i != 0]
+
+    def to_dict(self):
+        """JSON-friendly form, e.g. for CombinedLabels.organ_metadata; only present labels."""
+        return {
+            str(i): {
+                "voxels": self.count(i),
+                "sum": float(self._at(self.sums, i)) if self.sums is not None else None,
+                "sum_sq": float(self._at(self.sums_sq, i)) if self.sums_sq is not None else None,
+            } for i in self.labels()
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        n = max((int(k) for k in data), default=0) + 1
+        counts, sums, sums_sq = np.zeros(n, dtype=np.int64), np.zeros(n), np.zeros(n)
+        for key, value in data.items():
+            counts[int(key)] = value["voxels"]
+            sums[int(key)] = value["sum"] or 0
+            sums_sq[int(key)] = value["sum_sq"] or 0
+        return cls(counts, sums, sums_sq)
+
+
+def label_statistics(labels, values=None, n_labels=None):
+    """
+    Voxel counts and, when values (e.g. the CT in HU) are given, sums and sums of squares
+    of values for every label in a single bincount pass. Works through CHUNK_VOXELS
+    sized pieces so the float64 temporaries stay small.
+    """
+    labels = as_label_array(labels)
+    if values is not None and values.shape != labels.shape:
+        raise ValueError(f"Label shape {labels.shape} does not match value shape {values.shape}")
+    minlength = (int(labels.max()) + 1 if labels.size else 1) if n_labels is None else n_labels
+    flat_labels, flat_values = _flat_pair(labels, values)
+
+    counts = np.zeros(minlength, dtype=np.int64)
+    sums = np.zeros(minlength) if values is not None else None
+    sums_sq = np.zeros(minlength) if values is not None else None
+    for start in range(0, flat_labels.size, CHUNK_VOXELS):
+        chunk = flat_labels[start:start + CHUNK_VOXELS]
+        counts += np.bincount(chunk, minlength=minlength)[:minlength]
+        if values is not None:
+            chunk_values = flat_values[start:start + CHUNK_VOXELS].astype(np.float64, copy=False)
+            sums += np.bincount(chunk, weights=chunk_values, minlength=minlength)[:minlength]
+            sums_sq += np.bincount(chunk, weights=chunk_values * chunk_values, minlength=minlength)[:minlength]
+    return LabelStatistics(counts, sums, sums_sq)
+
+
+def summarise_organs(labels, ct, organ_intensities, voxel_volume_cm3, number_max=999999):
+    """
+    The organ_metrics rows of NiftiProcessor.calculate_metrics ({"organ_name",
+    "volume_cm3", "mean_hu"}, mean HU over the eroded organ) for every organ in
+    organ_intensities. Organs cut off by the first or last slice report number_max.
+    Returns ({"organ_metrics": rows}, LabelStatistics of the un-eroded labels).
+    """
+    labels = as_label_array(labels)
+    stats = label_statistics(labels, ct)
+    eroded = label_statistics(eroded_labels(labels), ct, n_labels=len(stats.counts))
+
+    rows = []
+    for organ, label_val in organ_intensities.items():
+        slice_0 = labels[:, :, 0] == label_val
+        slice_last = labels[:, :, -1] == label_val
+
+        if has_large_connected_component(slice_0, 8) or has_large_connected_component(slice_last, 8):
+            rows.append({
+                "organ_name": organ,
+                "volume_cm3": number_max,
+                "mean_hu": number_max
+            })
+            continue
+
+        mean_hu = eroded.mean(label_val) if eroded.count(label_val) else stats.mean(label_val)
+        rows.append({
+            "organ_name": organ,
+            "volume_cm3": round(float(stats.volume(label_val, voxel_volume_cm3)), Constants.DECIMAL_PRECISION_VOLUME),
+            "mean_hu": round(float(mean_hu), Constants.DECIMAL_PRECISION_HU)
+        })
+    return {"organ_metrics": rows}, stats
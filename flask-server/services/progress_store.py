@@ -0,0 +1,82 @@
+from constants import Constants
+from models.base import db
+from models.segmentation_job import SegmentationJob
+from models.model_runtime import ModelRuntime
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime
+
+
+class ProgressStore(object):
+    """
+    Progress of auto-segmentation jobs, kept in the database so every server process
+    answers /progress the same way.
+
+    The percentage a model prints is written to SegmentationJob.progress as it runs.
+    Finished runs update a per-model exponential moving average of the runtime
+    (weight MODEL_RUNTIME_ALPHA for the newest run) in the model_runtime table, which
+    gives the ETA of queued jobs and of models that print no progress. Needs an app
+    context.
+    """
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def update(self, job_id, percent):
+        """Store percent for job_id; progress never goes backwards."""
+        stmt = db.update(SegmentationJob).where(
+            SegmentationJob.job_id == job_id,
+            (SegmentationJob.progress == None) | (SegmentationJob.progress < percent)  # noqa: E711
+        ).values(progress=percent)
+        db.session.execute(stmt)
+        db.session.commit()
+
+    def record_runtime(self, model_name, seconds):
+        """Fold a finished run into the moving average of model_name, atomically in SQL."""
+        alpha = Constants.MODEL_RUNTIME_ALPHA
+        stmt = db.update(ModelRuntime).where(ModelRuntime.model_name == model_name).values(
+            average_seconds=alpha * seconds + (1 - alpha) * ModelRuntime.average_seconds,
+            runs=ModelRuntime.runs + 1,
+            updated=datetime.now()
+        )
+        if db.session.execute(stmt).rowcount == 0:
+            db.session.add(ModelRuntime(model_name=model_name, average_seconds=seconds, runs=1, updated=datetime.now()))
+            try:
+                db.session.commit()
+                return
+            except IntegrityError:  # another process recorded the first run meanwhile
+                db.session.rollback()
+                db.session.execute(stmt)
+        db.session.commit()
+
+    def expected_seconds(self, model_name):
+        row = db.session.get(ModelRuntime, model_name)
+        return row.average_seconds if row is not None else Constants.DEFAULT_MODEL_SECONDS
+
+    def progress(self, job):
+        """
+        {"progress", "status", "eta_seconds", "expected_seconds"} of a job dict
+        (SegmentationJob.to_dict()). Running jobs extrapolate the printed percentage;
+        without one, progress follows the expected runtime and stops at 95%.
+        """
+        status = job["status"]
+        expected = self.expected_seconds(job["model_name"])
+        result = {"job_id": job["job_id"], "status": status, "expected_seconds": round(expected, 1)}
+
+        if status in ("done", "failed"):
+            return dict(result, progress=100, eta_seconds=0, error=job.get("error"))
+        if status == "queued" or not job.get("started"):
+            return dict(result, progress=0, eta_seconds=round(expected, 1))
+
+        elapsed = (datetime.now() - datetime.fromisoformat(job["started"])).total_seconds()
+        printed = job.get("progress")
+        if printed:
+            progress = min(printed, 99)
+            eta = elapsed * (100 - printed) / printed
+        else:
+            progress = min(95, int(elapsed / expected * 100)) if expected > 0 else 95
+            eta = max(expected - elapsed, 0)
+        return dict(result, progress=progress, eta_seconds=round(eta, 1))
@@ -0,0 +1,161 @@
+from constants import Constants
+from services.npz_processor import get_panTS_id
+from services.organ_metadata import input_fingerprint, input_hash
+from services.file_lock import file_lock
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from datetime import datetime
+import threading
+import hashlib
+import json
+import time
+import os
+
+
+class ReportQueue(object):
+    """
+    Background PDF report generation with an on-disk cache.
+
+    A report is identified by its job ID, <PanTS ID>-<16 hex digits>, a hash of
+    REPORT_FORMAT_VERSION and of every file the report is built from (CT, labels,
+    template, ...). The finished PDF is stored as <job ID>.pdf in REPORT_CACHE_DIR, so
+    the same inputs map onto the same job and a cached report is served without
+    queueing anything, also across restarts and workers. Jobs run on a thread pool of
+    REPORT_WORKERS threads; older reports of a case are removed once a newer one is done.
+
+    The state of a job (queued, running, done, error) is kept in <job ID>.json next to
+    the PDF, so every server process answers status requests for jobs queued by
+    another. A queued or running job whose status file has not changed for
+    REPORT_JOB_TIMEOUT_SECONDS belongs to a process that died; it reports an error and
+    is queued again on the next submit.
+    """
+    _instance = None
+    HASH_CACHE_SIZE = 256
+
+    def __init__(self, cache_dir=None, workers=None):
+        self.cache_dir = cache_dir or Constants.REPORT_CACHE_DIR
+        self._executor = ThreadPoolExecutor(max_workers=workers or Constants.REPORT_WORKERS)
+        self._lock = threading.Lock()
+        self._futures = {}  # job_id -> Future of the jobs queued by this process
+        self._hashes = OrderedDict()  # input fingerprint -> input hash, least recently used first
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def _input_hash(self, paths):
+        fingerprint = repr(sorted(input_fingerprint(paths).items()))
+        with self._lock:
+            if fingerprint in self._hashes:
+                self._hashes.move_to_end(fingerprint)
+                return self._hashes[fingerprint]
+        content_hash = input_hash(paths)
+        with self._lock:
+            self._hashes[fingerprint] = content_hash
+            while len(self._hashes) > self.HASH_CACHE_SIZE:
+                self._hashes.popitem(last=False)
+        return content_hash
+
+    def job_id(self, case_id, input_paths):
+        paths = [p for p in input_paths if p and os.path.exists(p)]
+        key = f"{Constants.REPORT_FORMAT_VERSION}:{self._input_hash(paths)}"
+        return f"{get_panTS_id(int(case_id))}-{hashlib.sha256(key.encode('ascii')).hexdigest()[:16]}"
+
+    def report_path(self, job_id):
+        return os.path.join(self.cache_dir, f"{job_id}.pdf")
+
+    def status_path(self, job_id):
+        return os.path.join(self.cache_dir, f"{job_id}.json")
+
+    def _read_status(self, job_id):
+        try:
+            with open(self.status_path(job_id), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_status(self, job_id, **fields):
+        job = dict(self._read_status(job_id) or {}, **fields, updated=time.time())
+        path = self.status_path(job_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(job, f)
+        os.replace(tmp_path, path)
+
+    def _is_abandoned(self, job):
+        return job["status"] in ("queued", "running") and \
+            time.time() - job.get("updated", 0) > Constants.REPORT_JOB_TIMEOUT_SECONDS
+
+    def submit(self, case_id, input_paths, build_fn):
+        """
+        Queue build_fn(output_pdf_path) for case_id unless a report for the same inputs is
+        cached or already queued (by any server process). Returns the job ID.
+        """
+        job_id = self.job_id(case_id, input_paths)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with file_lock(os.path.join(self.cache_dir, ".submit.lock")):
+            if os.path.exists(self.report_path(job_id)):
+                return job_id
+            job = self._read_status(job_id)
+            if job is not None and job["status"] in ("queued", "running") and not self._is_abandoned(job):
+                return job_id
+            self._write_status(job_id, status="queued", case_id=str(case_id), error=None,
+                               submitted=datetime.now().isoformat(), finished=None)
+            with self._lock:
+                self._futures[job_id] = self._executor.submit(self._run, job_id, build_fn)
+        print(f"[ReportQueue] Queued report {job_id}")
+        return job_id
+
+    def _run(self, job_id, build_fn):
+        self._write_status(job_id, status="running")
+        path = self.report_path(job_id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            build_fn(tmp_path)
+            os.replace(tmp_path, path)
+            self._remove_stale(job_id)
+            self._write_status(job_id, status="done", finished=datetime.now().isoformat())
+        except Exception as e:
+            print(f"❌ [ReportQueue] Report {job_id} failed: {e}")
+            self._write_status(job_id, status="error", error=str(e), finished=datetime.now().isoformat())
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            with self._lock:
+                self._futures.pop(job_id, None)
+
+    def _remove_stale(self, job_id):
+        case_prefix = job_id.rsplit("-", 1)[0] + "-"
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(case_prefix) and name.endswith((".pdf", ".json")) \
+                    and os.path.splitext(name)[0] != job_id:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+    def status(self, job_id):
+        """Status dict of job_id ("queued", "running", "done" or "error"), or None if unknown."""
+        job = self._read_status(job_id)
+        if job is None:
+            return {"job_id": job_id, "status": "done"} if os.path.exists(self.report_path(job_id)) else None
+        if self._is_abandoned(job):
+            job.update(status="error", error="Report job was abandoned by its server process")
+        job.pop("updated", None)
+        return dict(job, job_id=job_id)
+
+    def wait(self, job_id, timeout=None, poll=0.5):
+        """Block until job_id is done or failed (also when another process runs it); returns its status."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            future = self._futures.get(job_id)
+        if future is not None:
+            future.result(timeout=timeout)
+        status = self.status(job_id)
+        while status is not None and status["status"] in ("queued", "running") \
+                and (deadline is None or time.monotonic() < deadline):
+            time.sleep(poll)
+            status = self.status(job_id)
+        return status
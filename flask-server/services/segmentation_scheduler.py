@@ -0,0 +1,307 @@
+from constants import Constants
+from flask import current_app
+from models.base import db
+from models.segmentation_job import SegmentationJob
+from services.auto_segmentor import run_auto_segmentation
+from services.progress_store import ProgressStore
+from services.job_events import JobEvents
+from services.zip_stream import write_zip
+from services.blob_store import SegmentationCache
+from services.file_lock import file_lock
+from datetime import datetime
+import itertools
+import threading
+import socket
+import fcntl
+import queue
+import time
+import uuid
+import os
+
+
+def run_segmentation_job(job):
+    """
+    Run the model of job on its uploaded CT and zip the masks next to it as
+    auto_masks.zip. The progress the model prints goes to the ProgressStore and wakes
+    the progress streams of the session. Jobs with an input hash put their result in
+    the SegmentationCache. Returns (output path, zip path).
+    """
+    job_id, session_id = job.job_id, job.session_id
+
+    def report_progress(percent):
+        ProgressStore.instance().update(job_id, percent)
+        JobEvents.instance().publish(session_id)
+
+    session_path = os.path.dirname(job.input_path)
+    output_mask_dir = run_auto_segmentation(job.input_path, session_dir=session_path, model=job.model_name,
+                                            progress_callback=report_progress)
+    if output_mask_dir is None or not os.path.exists(output_mask_dir):
+        raise RuntimeError(f"{job.model_name} auto segmentation failed")
+
+    zip_path = os.path.join(session_path, "auto_masks.zip")
+    write_zip(zip_path, [
+        (filename, os.path.join(output_mask_dir, filename))
+        for filename in sorted(os.listdir(output_mask_dir)) if filename.endswith(".nii.gz")
+    ])
+    if job.input_hash:
+        try:
+            SegmentationCache.instance().put(job.input_hash, job.model_name, output_mask_dir, zip_path)
+        except OSError as e:
+            print(f"⚠️ [SegmentationScheduler] Could not cache the result of job {job_id}: {e}")
+    return output_mask_dir, zip_path
+
+
+# identifies this server process; PIDs repeat across container restarts, this does not
+BOOT_TOKEN = uuid.uuid4().hex
+_registrations = {}  # lock file path -> open file holding its shared lock
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{BOOT_TOKEN}"
+
+
+def _worker_lock_path(worker_dir, token):
+    return os.path.join(worker_dir, f"{token}.lock")
+
+
+def register_process(worker_dir):
+    """
+    Hold a shared lock on <worker_dir>/<BOOT_TOKEN>.lock for the life of this process.
+    The kernel drops it when the process exits or crashes, which is what
+    process_alive() probes for.
+    """
+    path = _worker_lock_path(worker_dir, BOOT_TOKEN)
+    if path in _registrations:
+        return
+    os.makedirs(worker_dir, exist_ok=True)
+    f = open(path, "a")
+    fcntl.flock(f, fcntl.LOCK_SH)
+    _registrations[path] = f
+
+
+def process_alive(worker_dir, token):
+    """Whether the server process with boot token token still holds its lock."""
+    if token == BOOT_TOKEN:
+        return True
+    path = _worker_lock_path(worker_dir, token)
+    if not token or not os.path.exists(path):
+        return False
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f, fcntl.LOCK_UN)
+    os.remove(path)
+    return False
+
+
+class SegmentationScheduler(object):
+    """
+    Bounded queue of auto-segmentation jobs.
+
+    Jobs are rows of the segmentation_job table (queued -> running -> done/failed, with
+    timings and output paths) and run on worker threads, highest priority first and
+    FIFO within a priority, in the app context they were submitted from. At most
+    SEGMENTATION_MAX_CONCURRENT jobs run at once across all server processes sharing
+    the database: a worker claims a job by switching its row from queued to running
+    only while fewer jobs are running, under a lock held by every claim (a file lock,
+    plus an advisory lock on PostgreSQL). A worker that finds the limit reached puts
+    the job back and retries after SEGMENTATION_CLAIM_RETRY_SECONDS. A job recovered
+    by several server processes still only runs once.
+
+    Running jobs record the <host>:<pid>:<boot token> of their process, which holds a
+    lock under SEGMENTATION_WORKER_DIR while it lives. On start-up, and whenever the
+    limit is reached, jobs of a dead process on this host are re-queued; queued jobs
+    are picked up again on start-up.
+
+    A job whose CT (by input_hash) was segmented by the same model before is finished
+    on submission from the SegmentationCache, without taking a worker.
+
+    Every state change wakes the JobEvents streams of the job's session; listeners added
+    with add_listener(fn) are called with the job dict as well.
+    """
+    _instance = None
+
+    _CLAIM_LOCK_KEY = 0x5E6A0B  # pg_advisory_xact_lock key of the claim
+
+    def __init__(self, max_concurrent=None, run_fn=None, worker_dir=None):
+        self.max_concurrent = max_concurrent or Constants.SEGMENTATION_MAX_CONCURRENT
+        self.run_fn = run_fn or run_segmentation_job
+        self.worker_dir = worker_dir or Constants.SEGMENTATION_WORKER_DIR
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._listeners = []
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def init_app(self, app):
+        """Pick up the unfinished jobs in app's database."""
+        with app.app_context():
+            self.recover()
+
+    def add_listener(self, fn):
+        self._listeners.append(fn)
+
+    def _notify(self, job):
+        data = job.to_dict()
+        JobEvents.instance().publish(job.session_id)
+        for fn in list(self._listeners):
+            try:
+                fn(data)
+            except Exception as e:
+                print(f"⚠️ [SegmentationScheduler] Listener failed for {job.job_id}: {e}")
+
+    def _start_workers(self):
+        with self._lock:
+            self._workers = [t for t in self._workers if t.is_alive()]
+            for _ in range(self.max_concurrent - len(self._workers)):
+                thread = threading.Thread(target=self._work, daemon=True, name="segmentation-worker")
+                thread.start()
+                self._workers.append(thread)
+
+    def _enqueue(self, job, app):
+        self._queue.put((-job.priority, next(self._order), job.job_id, app))
+        self._start_workers()
+
+    def submit(self, session_id, input_path, model_name, priority=0, input_hash=None):
+        """
+        Queue a model run on input_path for session_id (needs an app context), or answer
+        it from the SegmentationCache when input_hash was segmented by model_name
+        before. Returns the job dict.
+        """
+        job = SegmentationJob(
+            job_id=str(uuid.uuid4()),
+            session_id=session_id,
+            model_name=model_name,
+            priority=priority,
+            status="queued",
+            input_path=input_path,
+            input_hash=input_hash,
+            submitted=datetime.now()
+        )
+        cached = SegmentationCache.instance().restore(input_hash, model_name, os.path.dirname(input_path)) \
+            if input_hash else None
+        if cached is not None:
+            job.output_path, job.zip_path = cached
+            job.status, job.progress, job.worker = "done", 100, "cache"
+            job.started = job.finished = job.submitted
+        db.session.add(job)
+        db.session.commit()
+        self._notify(job)
+        if cached is not None:
+            print(f"✅ [SegmentationScheduler] Answered {model_name} job {job.job_id} for session {session_id} from the cache")
+        else:
+            print(f"[SegmentationScheduler] Queued {model_name} job {job.job_id} for session {session_id}")
+            self._enqueue(job, current_app._get_current_object())
+        return job.to_dict()
+
+    def requeue_dead(self):
+        """
+        Set the jobs left running by dead processes on this host back to queued (needs an
+        app context). Returns the re-queued jobs.
+        """
+        stmt = db.select(SegmentationJob).where(SegmentationJob.status == "running")
+        host = socket.gethostname()
+        requeued = []
+        for job in db.session.execute(stmt).scalars().all():
+            job_host, _, rest = (job.worker or "").partition(":")
+            _, _, token = rest.partition(":")
+            if job_host != host or process_alive(self.worker_dir, token):
+                continue
+            print(f"⚠️ [SegmentationScheduler] Re-queueing job {job.job_id} of dead worker {job.worker}")
+            reset = db.update(SegmentationJob).where(
+                SegmentationJob.job_id == job.job_id, SegmentationJob.worker == job.worker
+            ).values(status="queued", worker=None, started=None)
+            if db.session.execute(reset).rowcount == 1:
+                requeued.append(job)
+        db.session.commit()
+        return requeued
+
+    def recover(self):
+        """Queue the jobs of the table that are not finished (needs an app context)."""
+        self.requeue_dead()
+        stmt = db.select(SegmentationJob).where(SegmentationJob.status == "queued")
+        for job in db.session.execute(stmt).scalars().all():
+            self._enqueue(job, current_app._get_current_object())
+
+    def _claim(self, job_id):
+        """
+        Switch job_id from queued to running if fewer than max_concurrent jobs run.
+        Returns "claimed", "busy" (limit reached) or "gone" (not queued any more).
+        """
+        register_process(self.worker_dir)
+        with file_lock(os.path.join(self.worker_dir, "claim.lock")):
+            if db.engine.dialect.name == "postgresql":
+                db.session.execute(db.text("SELECT pg_advisory_xact_lock(:key)"), {"key": self._CLAIM_LOCK_KEY})
+            running = db.session.execute(
+                db.select(db.func.count()).select_from(SegmentationJob).where(SegmentationJob.status == "running")
+            ).scalar()
+            if running >= self.max_concurrent:
+                db.session.commit()
+                return "busy"
+            stmt = db.update(SegmentationJob).where(
+                SegmentationJob.job_id == job_id, SegmentationJob.status == "queued"
+            ).values(status="running", started=datetime.now(), worker=worker_name())
+            claimed = db.session.execute(stmt).rowcount == 1
+            db.session.commit()
+        return "claimed" if claimed else "gone"
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            job_id, app = item[2:]
+            try:
+                with app.app_context():
+                    if self._run(job_id) == "busy":
+                        time.sleep(Constants.SEGMENTATION_CLAIM_RETRY_SECONDS)
+                        for job in self.requeue_dead():
+                            self._enqueue(job, app)
+                        self._queue.put(item)  # keeps its place among jobs of the same priority
+            except Exception as e:
+                print(f"❌ [SegmentationScheduler] Worker error on job {job_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        claim = self._claim(job_id)
+        if claim != "claimed":
+            return claim
+        job = db.session.get(SegmentationJob, job_id)
+        self._notify(job)
+        print(f"[SegmentationScheduler] Running {job.model_name} job {job_id}")
+        try:
+            job.output_path, job.zip_path = self.run_fn(job)
+            job.status, job.progress = "done", 100
+            print(f"✅ [SegmentationScheduler] Finished job {job_id}")
+        except Exception as e:
+            print(f"❌ [SegmentationScheduler] Job {job_id} failed: {e}")
+            job.status, job.error = "failed", str(e)
+        job.finished = datetime.now()
+        db.session.commit()
+        if job.status == "done":
+            ProgressStore.instance().record_runtime(job.model_name, (job.finished - job.started).total_seconds())
+        self._notify(job)
+        return job.status
+
+    def get(self, job_id):
+        """Job dict of job_id, or None (needs an app context)."""
+        job = db.session.get(SegmentationJob, job_id)
+        return job.to_dict() if job is not None else None
+
+    def latest(self, session_id):
+        """Job dict of the most recent job of session_id, or None (needs an app context)."""
+        stmt = db.select(SegmentationJob).where(SegmentationJob.session_id == session_id) \
+            .order_by(SegmentationJob.submitted.desc()).limit(1)
+        job = db.session.execute(stmt).scalar()
+        return job.to_dict() if job is not None else None
+
+    def join(self):
+        """Block until every queued job has been processed."""
+        self._queue.join()
@@ -0,0 +1,61 @@
+from io import BytesIO
+from PIL import Image
+import numpy as np
+
+
+SLICE_AXES = {"sagittal": 0, "coronal": 1, "axial": 2}
+
+def window_slice(slice_, window_center=None, window_width=None):
+    """Map a CT slice to uint8 with a window centre/width, or min/max when no window is given."""
+    slice_ = np.asarray(slice_, dtype=np.float32)
+    if window_center is None or window_width is None:
+        min_val, max_val = float(np.min(slice_)), float(np.max(slice_))
+    else:
+        min_val = window_center - window_width / 2
+        max_val = window_center + window_width / 2
+    if max_val <= min_val:
+        return np.zeros(slice_.shape, dtype=np.uint8)
+    slice_norm = 255 * (np.clip(slice_, min_val, max_val) - min_val) / (max_val - min_val)
+    return slice_norm.astype(np.uint8)
+
+def overlay_labels(gray_slice, label_slice, color_map):
+    """Alpha-blend label colors (as returned by /get-label-colormap) onto a uint8 slice."""
+    rgb = np.repeat(gray_slice[..., None], 3, axis=2).astype(np.float32)
+    for label in np.unique(label_slice):
+        if label == 0:
+            continue
+        color = color_map.get(str(label)) or color_map.get(str(int(label)))
+        if color is None:
+            continue
+        mask = label_slice == label
+        alpha = color.get("A", 128) / 255
+        rgb[mask] = (1 - alpha) * rgb[mask] + alpha * np.array([color["R"], color["G"], color["B"]], dtype=np.float32)
+    return rgb.astype(np.uint8)
+
+def display_orientation(image):
+    """Turn an (x, y) slice of a volume into image rows/columns as the viewer shows them."""
+    return np.flip(np.rot90(image, k=1), axis=0)
+
+def volume_to_image(volume, axis=2, index=None, window_center=None, window_width=None,
+                    labels=None, color_map=None, image_format="PNG", max_size=None):
+    """
+    Render one slice of a volume to an encoded image buffer, optionally with a colored
+    label overlay. Only the requested slice is read, so memory-mapped volumes stay cheap.
+    max_size bounds the longer image edge, keeping the aspect ratio.
+    """
+    if index is None:
+        index = volume.shape[axis] // 2
+
+    image = window_slice(np.take(volume, index, axis=axis), window_center, window_width)
+    if labels is not None and color_map:
+        image = overlay_labels(image, np.take(labels, index, axis=axis), color_map)
+
+    image = display_orientation(image)
+
+    pil_img = Image.fromarray(np.ascontiguousarray(image))
+    if max_size is not None:
+        pil_img.thumbnail((max_size, max_size), Image.LANCZOS)
+    buf = BytesIO()
+    pil_img.save(buf, format=image_format)
+    buf.seek(0)
+    return buf
@@ -0,0 +1,174 @@
+from constants import Constants
+from services.volume_store import VolumeStore
+from services.slice_renderer import volume_to_image
+from services.npz_processor import get_panTS_id, get_ct_npz_path
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from io import BytesIO
+from PIL import Image
+import threading
+import time
+import os
+
+
+# cache misses decompress a whole CT volume, so only a few may render at once in a server process
+_render_slots = threading.BoundedSemaphore(Constants.THUMBNAIL_MAX_CONCURRENT_RENDERS)
+
+
+class ThumbnailCache(object):
+    """
+    On-disk cache of case preview images (middle axial slice, min/max windowed).
+
+    Thumbnails live in THUMBNAIL_DIR as <PanTS ID>.png and are considered fresh while
+    they are newer than the case's ct.npz. get_or_render() serves a fresh thumbnail
+    straight from disk and renders + stores it on a miss, at most
+    THUMBNAIL_MAX_CONCURRENT_RENDERS at a time per process; build_all() pre-generates every
+    case in ImageTr/ImageTe on a process pool and skips fresh ones, so an interrupted
+    run resumes where it stopped.
+    """
+    _instance = None
+
+    def __init__(self, cache_dir=None, max_size=None):
+        self.cache_dir = cache_dir or Constants.THUMBNAIL_DIR or os.path.join(Constants.PANTS_PATH, "data", "thumbnails")
+        self.max_size = max_size or Constants.THUMBNAIL_MAX_SIZE
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def thumbnail_path(self, clabel_id):
+        return os.path.join(self.cache_dir, f"{get_panTS_id(int(clabel_id))}.png")
+
+    def is_fresh(self, clabel_id):
+        path = self.thumbnail_path(clabel_id)
+        ct_path = get_ct_npz_path(clabel_id)
+        return os.path.exists(path) and (not os.path.exists(ct_path) or os.path.getmtime(path) >= os.path.getmtime(ct_path))
+
+    def render(self, clabel_id):
+        """Render the thumbnail of one case into the cache and return its path."""
+        ct_path = get_ct_npz_path(clabel_id)
+        volume = VolumeStore.instance().load(ct_path)
+        buf = volume_to_image(volume, max_size=self.max_size)
+
+        path = self.thumbnail_path(clabel_id)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buf.getbuffer())
+        os.replace(tmp_path, path)
+        return path
+
+    def get_or_render(self, clabel_id):
+        """Path of a fresh thumbnail for clabel_id, or None if the case has no CT."""
+        if self.is_fresh(clabel_id):
+            return self.thumbnail_path(clabel_id)
+        if not os.path.exists(get_ct_npz_path(clabel_id)):
+            return None
+        with _render_slots:
+            if self.is_fresh(clabel_id):  # rendered by another request while we waited
+                return self.thumbnail_path(clabel_id)
+            print(f"[ThumbnailCache] Cache miss for case {clabel_id}, rendering")
+            return self.render(clabel_id)
+
+    def get_or_render_many(self, clabel_ids, workers=None):
+        """
+        get_or_render() for a page of cases on a thread pool (renders still share the
+        process-wide limit); returns {clabel_id: path or None}.
+        Cases whose render fails map to None so one bad volume does not sink the page.
+        """
+        def fetch(clabel_id):
+            try:
+                return self.get_or_render(clabel_id)
+            except Exception as e:
+                print(f"❌ [ThumbnailCache] case {clabel_id}: {e}")
+                return None
+
+        workers = workers or Constants.THUMBNAIL_WORKERS
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return dict(zip(clabel_ids, pool.map(fetch, clabel_ids)))
+
+    def build_all(self, clabel_ids=None, workers=None, force=False):
+        """
+        Pre-generate thumbnails on a process pool. Returns (rendered, skipped, failed).
+        """
+        clabel_ids = list_case_ids() if clabel_ids is None else list(clabel_ids)
+        todo = [i for i in clabel_ids if force or not self.is_fresh(i)]
+        skipped = len(clabel_ids) - len(todo)
+        rendered, failed = 0, []
+        start = time.time()
+
+        workers = workers or Constants.THUMBNAIL_WORKERS
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(_render_in_worker, self.cache_dir, self.max_size, i): i for i in todo}
+            for future in as_completed(futures):
+                clabel_id = futures[future]
+                try:
+                    future.result()
+                    rendered += 1
+                except Exception as e:
+                    print(f"❌ [ThumbnailCache] case {clabel_id}: {e}")
+                    failed.append(clabel_id)
+                done = rendered + len(failed)
+                if done % 50 == 0 or done == len(todo):
+                    print(f"[ThumbnailCache] {done}/{len(todo)} rendered in {time.time() - start:.1f}s")
+
+        return rendered, skipped, failed
+
+
+def _render_in_worker(cache_dir, max_size, clabel_id):
+    return ThumbnailCache(cache_dir, max_size).render(clabel_id)
+
+
+def build_sprite_sheet(paths, tile_size, columns=10):
+    """
+    Paste thumbnails into one PNG sprite sheet of tile_size x tile_size cells, row-major.
+    paths maps key -> thumbnail path (or None). Returns (png bytes, {key: offsets or None})
+    where offsets is {"x", "y", "width", "height"} in sprite pixels.
+    """
+    keys = list(paths)
+    columns = max(1, min(columns, len(keys)))
+    rows = max(1, -(-len(keys) // columns))
+    sheet = Image.new("L", (columns * tile_size, rows * tile_size))
+
+    offsets = {}
+    for i, key in enumerate(keys):
+        if paths[key] is None:
+            offsets[key] = None
+            continue
+        x, y = (i % columns) * tile_size, (i // columns) * tile_size
+        with Image.open(paths[key]) as img:
+            img = img.convert("L")
+            img.thumbnail((tile_size, tile_size))
+            sheet.paste(img, (x, y))
+            offsets[key] = {"x": x, "y": y, "width": img.width, "height": img.height}
+
+    buf = BytesIO()
+    sheet.save(buf, format="PNG")
+    return buf.getvalue(), offsets
+
+
+def list_case_ids():
+    """Case numbers of every PanTS_XXXXXXXX folder with a ct.npz in ImageTr/ImageTe."""
+    ids = []
+    for subfolder in ("ImageTr", "ImageTe"):
+        root = os.path.join(Constants.PANTS_PATH, "data", subfolder)
+        if not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            if name.startswith("PanTS_") and os.path.exists(os.path.join(root, name, Constants.MAIN_NPZ_FILENAME)):
+                ids.append(int(name[len("PanTS_"):]))
+    return sorted(ids)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Pre-generate case preview thumbnails.")
+    parser.add_argument("ids", nargs="*", type=int, help="case numbers (default: every case in ImageTr/ImageTe)")
+    parser.add_argument("--workers", type=int, default=None, help=f"process pool size (default {Constants.THUMBNAIL_WORKERS})")
+    parser.add_argument("--force", action="store_true", help="re-render thumbnails that are already cached")
+    args = parser.parse_args()
+
+    rendered, skipped, failed = ThumbnailCache.instance().build_all(args.ids or None, workers=args.workers, force=args.force)
+    print(f"✅ rendered {rendered}, already cached {skipped}, failed {len(failed)}")
@@ -0,0 +1,223 @@
+from constants import Constants
+from services.volume_store import VolumeStore
+from services.npz_processor import get_panTS_id, get_ct_npz_path, get_clabel_npz_path
+from services.file_lock import file_lock
+import numpy as np
+import shutil
+import gzip
+import json
+import uuid
+import os
+
+
+MANIFEST_FILENAME = "manifest.json"
+
+
+def block_mean(volume, factor):
+    """Downsample by averaging factor^3 blocks; edge blocks average only the voxels they hold."""
+    if factor == 1:
+        return np.asarray(volume)
+    out_shape = tuple(-(-n // factor) for n in volume.shape)
+    total = np.zeros(out_shape, dtype=np.float64)
+    count = np.zeros(out_shape, dtype=np.float64)
+    for offsets in np.ndindex(factor, factor, factor):
+        part = volume[offsets[0]::factor, offsets[1]::factor, offsets[2]::factor]
+        region = tuple(slice(0, n) for n in part.shape)
+        total[region] += part
+        count[region] += 1
+    return total / count
+
+
+def block_mode(labels, factor, slab_rows=16):
+    """
+    Downsample a label map by taking the most frequent label of each factor^3 block.
+    Ties go to the smallest label so the result is deterministic. Works through slabs of
+    output rows so the per-voxel vote codes never cover the whole volume at once.
+    """
+    if factor == 1:
+        return np.asarray(labels)
+    out_shape = tuple(-(-n // factor) for n in labels.shape)
+    values = np.unique(labels)
+    n_values = len(values)
+    padded_yz = [n * factor for n in out_shape[1:]]
+    best_label = np.empty(out_shape, dtype=labels.dtype)
+
+    for row in range(0, out_shape[0], slab_rows):
+        rows = min(slab_rows, out_shape[0] - row)
+        slab = np.asarray(labels[row * factor:(row + rows) * factor])
+        # padding votes for an extra "no label" slot that is dropped before argmax
+        votes = np.full((rows * factor, *padded_yz), n_values, dtype=np.int64)
+        votes[:slab.shape[0], :slab.shape[1], :slab.shape[2]] = np.searchsorted(values, slab)
+        votes = votes.reshape(rows, factor, out_shape[1], factor, out_shape[2], factor)
+        votes = votes.transpose(0, 2, 4, 1, 3, 5).reshape(-1, factor ** 3)
+
+        n_blocks = votes.shape[0]
+        votes += (np.arange(n_blocks, dtype=np.int64) * (n_values + 1))[:, None]
+        counts = np.bincount(votes.ravel(), minlength=n_blocks * (n_values + 1))
+        winners = counts.reshape(n_blocks, n_values + 1)[:, :n_values].argmax(axis=1)
+        best_label[row:row + rows] = values[winners].reshape(rows, *out_shape[1:])
+    return best_label
+
+
+def storage_dtype(volume, is_label):
+    if is_label:
+        return np.uint8 if volume.max() < 256 else np.uint16
+    return volume.dtype
+
+
+class VolumePyramid(object):
+    """
+    Chunked multi-resolution copy of a volume for progressive loading.
+
+    Level factors are Constants.PYRAMID_LEVELS (1x, 2x, 4x by default). CT levels are
+    block means, label levels are block modes so no new label values appear. Each level
+    is cut into PYRAMID_CHUNK_SIZE^3 chunks stored as gzip-compressed, C-order raw
+    arrays ({level}/{cx}_{cy}_{cz}.raw.gz), which the API sends with
+    Content-Encoding: gzip. manifest.json describes dtype, shapes and chunk grid.
+
+    Builds hold a lock on <root>.lock (threads and processes) and write a new version
+    directory, <root>.<hex>, next to root. root itself is a symlink to the current
+    version that is swapped atomically (os.replace of a new link), so concurrent chunk
+    requests for a cold case build it once and always find a complete tree; the old
+    version is removed afterwards.
+    """
+
+    def __init__(self, root, levels=None, chunk_size=None):
+        self.root = root
+        self.levels = tuple(levels or Constants.PYRAMID_LEVELS)
+        self.chunk_size = chunk_size or Constants.PYRAMID_CHUNK_SIZE
+
+    @classmethod
+    def for_case(cls, index, kind):
+        if Constants.PYRAMID_DIR:
+            return cls(os.path.join(Constants.PYRAMID_DIR, get_panTS_id(int(index)), kind))
+        npz_path = get_ct_npz_path(index) if kind == "ct" else get_clabel_npz_path(index)
+        return cls(os.path.join(os.path.dirname(npz_path), "pyramid", kind))
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.root, MANIFEST_FILENAME)
+
+    def manifest(self):
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def is_fresh(self, source_path):
+        if not os.path.exists(self.manifest_path):
+            return False
+        manifest = self.manifest()
+        return (manifest.get("source_mtime_ns") == os.stat(source_path).st_mtime_ns
+                and manifest.get("levels") and [l["factor"] for l in manifest["levels"]] == list(self.levels)
+                and manifest.get("chunk_size") == self.chunk_size)
+
+    def lock(self):
+        return file_lock(f"{self.root}.lock")
+
+    def build(self, volume, is_label, source_path=None):
+        """Write every level of volume below self.root and return the manifest."""
+        with self.lock():
+            return self._build(volume, is_label, source_path)
+
+    def _build(self, volume, is_label, source_path=None):
+        version_root = f"{self.root}.{uuid.uuid4().hex}"
+        try:
+            manifest = self._write(volume, is_label, source_path, version_root)
+            self._install(version_root)
+        except Exception:
+            shutil.rmtree(version_root, ignore_errors=True)
+            raise
+        return manifest
+
+    def _write(self, volume, is_label, source_path, version_root):
+        dtype = storage_dtype(volume, is_label)
+        os.makedirs(version_root)
+
+        levels = []
+        for factor in self.levels:
+            level = block_mode(volume, factor) if is_label else block_mean(volume, factor)
+            if np.issubdtype(dtype, np.integer) and not np.issubdtype(level.dtype, np.integer):
+                level = np.rint(level)
+            level = level.astype(dtype, copy=False)
+
+            grid = [-(-n // self.chunk_size) for n in level.shape]
+            level_dir = os.path.join(version_root, str(factor))
+            os.makedirs(level_dir)
+            for cx, cy, cz in np.ndindex(*grid):
+                chunk = level[cx * self.chunk_size:(cx + 1) * self.chunk_size,
+                              cy * self.chunk_size:(cy + 1) * self.chunk_size,
+                              cz * self.chunk_size:(cz + 1) * self.chunk_size]
+                with gzip.open(os.path.join(level_dir, f"{cx}_{cy}_{cz}.raw.gz"), "wb", compresslevel=6) as f:
+                    f.write(np.ascontiguousarray(chunk).astype(chunk.dtype.newbyteorder("<"), copy=False).tobytes())
+            levels.append({"factor": factor, "shape": list(level.shape), "grid": grid})
+
+        manifest = {
+            "kind": "labels" if is_label else "ct",
+            "dtype": np.dtype(dtype).newbyteorder("<").str,
+            "order": "C",
+            "chunk_size": self.chunk_size,
+            "shape": list(volume.shape),
+            "levels": levels,
+            "source_mtime_ns": os.stat(source_path).st_mtime_ns if source_path else None,
+        }
+        with open(os.path.join(version_root, MANIFEST_FILENAME), "w") as f:
+            json.dump(manifest, f)
+        return manifest
+
+    def _install(self, version_root):
+        link = f"{self.root}.{uuid.uuid4().hex}.link"
+        os.symlink(os.path.basename(version_root), link)
+        old_root = None
+        if os.path.islink(self.root):
+            old_root = os.path.realpath(self.root)
+        elif os.path.isdir(self.root):
+            # a plain directory left by an older build: a link cannot replace it, move it aside
+            old_root = f"{self.root}.{uuid.uuid4().hex}.old"
+            os.replace(self.root, old_root)
+        os.replace(link, self.root)
+        if old_root is not None:
+            shutil.rmtree(old_root, ignore_errors=True)
+
+    def build_from_npz(self, npz_path, is_label, force=False):
+        if not force and self.is_fresh(npz_path):
+            return self.manifest()
+        with self.lock():
+            if not force and self.is_fresh(npz_path):  # built by another request while we waited
+                return self.manifest()
+            print(f"[VolumePyramid] Building {self.root} from {npz_path}")
+            volume = VolumeStore.instance().load(npz_path)
+            return self._build(volume, is_label, source_path=npz_path)
+
+    def chunk_path(self, factor, cx, cy, cz):
+        return os.path.join(self.root, str(int(factor)), f"{int(cx)}_{int(cy)}_{int(cz)}.raw.gz")
+
+    def chunk_shape(self, manifest, factor, cx, cy, cz):
+        level = next(l for l in manifest["levels"] if l["factor"] == int(factor))
+        return [min(self.chunk_size, n - c * self.chunk_size) for n, c in zip(level["shape"], (cx, cy, cz))]
+
+    def read_chunk(self, factor, cx, cy, cz, manifest=None):
+        manifest = manifest or self.manifest()
+        with gzip.open(self.chunk_path(factor, cx, cy, cz), "rb") as f:
+            data = f.read()
+        return np.frombuffer(data, dtype=manifest["dtype"]).reshape(self.chunk_shape(manifest, factor, cx, cy, cz))
+
+
+def build_case_pyramids(index, force=False):
+    """Precompute the CT and label pyramids of one PanTS case."""
+    built = {}
+    for kind, npz_path in (("ct", get_ct_npz_path(index)), ("labels", get_clabel_npz_path(index))):
+        if os.path.exists(npz_path):
+            built[kind] = VolumePyramid.for_case(index, kind).build_from_npz(npz_path, kind == "labels", force=force)
+    return built
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Precompute multi-resolution volume pyramids for PanTS cases.")
+    parser.add_argument("ids", nargs="+", type=int, help="PanTS case numbers, e.g. 1 17 9001")
+    parser.add_argument("--force", action="store_true", help="rebuild even if the pyramid is up to date")
+    args = parser.parse_args()
+
+    for case_id in args.ids:
+        built = build_case_pyramids(case_id, force=args.force)
+        print(f"✅ case {case_id}: {', '.join(built) or 'no volumes found'}")
@@ -0,0 +1,88 @@
+from constants import Constants
+import numpy as np
+import threading
+import os
+
+
+class VolumeStore(object):
+    """
+    Uncompressed, memory-mappable copies of the dataset's zlib-compressed .npz volumes.
+
+    The first access to e.g. ImageTr/PanTS_00000001/ct.npz decompresses it once into
+    ct.npy (under VOLUME_STORE_DIR if set, otherwise next to the npz). Later accesses
+    open the .npy with np.load(mmap_mode="r"), so callers that only read a slice or a
+    region touch just those pages. Volumes are written in Fortran order, matching
+    NIfTI, which keeps axial (axis 2) slices contiguous on disk. A .npy older than its
+    .npz is considered stale and rebuilt.
+
+    With VOLUME_STORE_ENABLED=false every call falls back to np.load(npz)["data"].
+    """
+    _instance = None
+
+    def __init__(self, root=Constants.VOLUME_STORE_DIR, enabled=Constants.VOLUME_STORE_ENABLED):
+        self.root = root
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def npy_path(self, npz_path):
+        npz_path = os.path.abspath(npz_path)
+        npy_name = os.path.splitext(os.path.basename(npz_path))[0] + ".npy"
+        if self.root is None:
+            return os.path.join(os.path.dirname(npz_path), npy_name)
+
+        data_dir = os.path.abspath(os.path.join(Constants.PANTS_PATH or "", "data"))
+        relative_dir = os.path.relpath(os.path.dirname(npz_path), data_dir)
+        if relative_dir.startswith(".."):
+            # not part of the dataset, e.g. a session upload
+            relative_dir = os.path.dirname(npz_path).lstrip(os.sep)
+        return os.path.join(self.root, relative_dir, npy_name)
+
+    def is_fresh(self, npz_path):
+        npy_path = self.npy_path(npz_path)
+        return os.path.exists(npy_path) and os.path.getmtime(npy_path) >= os.path.getmtime(npz_path)
+
+    def materialise(self, npz_path):
+        """Decompress npz_path into the store if it is missing or stale; return the .npy path."""
+        npy_path = self.npy_path(npz_path)
+        with self._lock:
+            if self.is_fresh(npz_path):
+                return npy_path
+
+            print(f"[VolumeStore] Materialising {npz_path} -> {npy_path}")
+            os.makedirs(os.path.dirname(npy_path), exist_ok=True)
+            arr = np.asfortranarray(np.load(npz_path)["data"])
+            tmp_path = f"{npy_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    np.save(f, arr)
+                os.replace(tmp_path, npy_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+        return npy_path
+
+    def load(self, npz_path, mmap=True):
+        """
+        Return the "data" array of npz_path, as a read-only memmap when the store is enabled.
+        """
+        if not self.enabled:
+            return np.load(npz_path)["data"]
+
+        try:
+            npy_path = self.materialise(npz_path)
+        except OSError as e:
+            print(f"⚠️ [VolumeStore] Could not materialise {npz_path}, reading npz directly: {e}")
+            return np.load(npz_path)["data"]
+        return np.load(npy_path, mmap_mode="r" if mmap else None)
+
+    def invalidate(self, npz_path):
+        try:
+            os.remove(self.npy_path(npz_path))
+        except FileNotFoundError:
+            pass
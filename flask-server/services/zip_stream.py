@@ -0,0 +1,134 @@
+from constants import Constants
+from services.organ_metadata import input_fingerprint
+import hashlib
+import threading
+import zipfile
+import os
+
+
+# members that are compressed already; deflating them again costs CPU and saves nothing
+COMPRESSED_SUFFIXES = (".npz", ".gz", ".zip", ".png", ".jpg", ".jpeg", ".pdf")
+CHUNK_SIZE = 1 << 20
+
+
+def compress_type(name):
+    return zipfile.ZIP_STORED if name.lower().endswith(COMPRESSED_SUFFIXES) else zipfile.ZIP_DEFLATED
+
+
+class _ChunkBuffer(object):
+    """Write-only, unseekable file object collecting what ZipFile writes until it is drained."""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_zip(members, chunk_size=CHUNK_SIZE):
+    """
+    Yield a zip archive of members ((arcname, path) pairs) piece by piece as it is
+    written, so at most about chunk_size bytes are held in memory. Compressed members
+    (COMPRESSED_SUFFIXES) are stored as they are, everything else is deflated. Sizes and
+    CRCs follow each member in a data descriptor, since the output is not seekable.
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        for arcname, path in members:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            info.compress_type = compress_type(arcname)
+            with open(path, "rb") as src, archive.open(info, "w", force_zip64=info.file_size > zipfile.ZIP64_LIMIT) as dest:
+                for block in iter(lambda: src.read(chunk_size), b""):
+                    dest.write(block)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            data = buffer.drain()
+            if data:
+                yield data
+    yield buffer.drain()
+
+
+def write_zip(zip_path, members):
+    """Write iter_zip(members) to zip_path atomically, so readers never see a partial archive."""
+    tmp_path = f"{zip_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            for data in iter_zip(members):
+                f.write(data)
+        os.replace(tmp_path, zip_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return zip_path
+
+
+class ZipArchiveCache(object):
+    """
+    Finished zip downloads kept in ZIP_CACHE_DIR as <key>-<member digest>.zip.
+
+    The digest covers the member names and the fingerprint (mtime_ns, size) of their
+    files, so changed segmentations get a new archive and older archives of the key are
+    removed once it is complete. A cache miss is streamed to the client while the same
+    bytes are written next to the cached path; the archive is only installed when the
+    stream ran to the end, so aborted downloads leave nothing behind.
+    """
+    _instance = None
+
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or Constants.ZIP_CACHE_DIR
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def archive_path(self, key, members):
+        fingerprint = input_fingerprint([path for _, path in members])
+        digest = hashlib.sha256(repr([(arcname, fingerprint[path]) for arcname, path in members]).encode("utf-8"))
+        return os.path.join(self.cache_dir, f"{key}-{digest.hexdigest()[:16]}.zip")
+
+    def get(self, key, members):
+        """Path of the cached archive of members, or None."""
+        path = self.archive_path(key, members)
+        return path if os.path.exists(path) else None
+
+    def stream(self, key, members):
+        """Generator of the archive bytes that caches the archive once fully sent."""
+        path = self.archive_path(key, members)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                for data in iter_zip(members):
+                    f.write(data)
+                    yield data
+            os.replace(tmp_path, path)
+            self._remove_stale(key, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _remove_stale(self, key, path):
+        prefix = f"{key}-"
+        for name in os.listdir(self.cache_dir):
+            if name.startswith(prefix) and name.endswith(".zip") and name != os.path.basename(path):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
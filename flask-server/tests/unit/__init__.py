@@ -0,0 +1,4 @@
+import os
+
+# unit tests get a fresh in-memory database per app unless they set up a file themselves
+os.environ.setdefault("SQLITE_PATH", ":memory:")
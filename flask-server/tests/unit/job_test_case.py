@@ -0,0 +1,37 @@
+import unittest
+import tempfile
+import shutil
+import os
+from unittest import mock
+
+from app import create_app
+from constants import Constants
+from models.base import db
+from services.job_events import JobEvents
+from services.segmentation_scheduler import SegmentationScheduler
+
+
+class JobTestCase(unittest.TestCase):
+    """
+    App with its own database file, scheduler worker directory and JobEvents, for tests
+    that run segmentation jobs. Subclasses extending setUp/tearDown call super() first/last.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.worker_dir = mock.patch.object(Constants, "SEGMENTATION_WORKER_DIR", os.path.join(self.tmp_dir, "workers"))
+        self.worker_dir.start()
+        # a database file: worker threads must not share the in-memory database's single connection
+        with mock.patch.object(Constants, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{os.path.join(self.tmp_dir, 'app.sqlite')}"):
+            self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        JobEvents._instance = JobEvents()
+
+    def tearDown(self):
+        db.session.remove()
+        self.app_context.pop()
+        SegmentationScheduler._instance = None
+        JobEvents._instance = None
+        self.worker_dir.stop()
+        shutil.rmtree(self.tmp_dir)
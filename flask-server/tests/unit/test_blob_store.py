@@ -0,0 +1,72 @@
+import unittest
+import tempfile
+import hashlib
+import shutil
+import io
+import os
+
+from services.blob_store import BlobStore, SegmentationCache, file_suffix, link_or_copy
+
+
+class TestBlobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.store = BlobStore(os.path.join(self.tmp_dir, "blobs"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_put_stream_dedupes(self):
+        data = os.urandom(3 * 1024 * 1024 + 5)
+        digest, path = self.store.put_stream(io.BytesIO(data), suffix=".nii.gz")
+        self.assertEqual(digest, hashlib.sha256(data).hexdigest())
+        self.assertEqual(path, os.path.join(self.tmp_dir, "blobs", digest[:2], f"{digest}.nii.gz"))
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+        inode = os.stat(path).st_ino
+        self.assertEqual(self.store.put_stream(io.BytesIO(data), suffix=".nii.gz"), (digest, path))
+        self.assertEqual(os.stat(path).st_ino, inode)
+        self.assertEqual(sorted(os.listdir(self.store.root)), [digest[:2]])
+
+    def test_link_or_copy(self):
+        _, path = self.store.put_stream(io.BytesIO(b"ct"))
+        dst = os.path.join(self.tmp_dir, "session", "ct.nii.gz")
+        with self.assertRaises(FileNotFoundError):
+            link_or_copy(os.path.join(self.tmp_dir, "missing"), dst)
+        link_or_copy(path, dst)
+        link_or_copy(path, dst)  # replaces an existing file
+        self.assertTrue(os.path.samefile(path, dst))
+
+    def test_file_suffix(self):
+        self.assertEqual(file_suffix("CT.NII.GZ"), ".nii.gz")
+        self.assertEqual(file_suffix("dir/ct.nii"), ".nii")
+        self.assertEqual(file_suffix(None), "")
+
+    def test_segmentation_cache(self):
+        cache = SegmentationCache(os.path.join(self.tmp_dir, "cache"))
+        output_dir = os.path.join(self.tmp_dir, "outputs")
+        os.makedirs(output_dir)
+        for filename in ("liver.nii.gz", "log.txt"):
+            with open(os.path.join(output_dir, filename), "wb") as f:
+                f.write(b"mask")
+        zip_path = os.path.join(self.tmp_dir, "auto_masks.zip")
+        with open(zip_path, "wb") as f:
+            f.write(b"PK masks")
+
+        self.assertIsNone(cache.restore("abc", "fake", os.path.join(self.tmp_dir, "s1")))
+        cache.put("abc", "fake", output_dir, zip_path)
+        cache.put("abc", "fake", output_dir, zip_path)  # already cached
+        self.assertIsNone(cache.get("abc", "SuPreM"))
+
+        masks_dir, restored_zip = cache.restore("abc", "fake", os.path.join(self.tmp_dir, "s1"))
+        self.assertEqual(os.listdir(masks_dir), ["liver.nii.gz"])
+        self.assertEqual(restored_zip, os.path.join(self.tmp_dir, "s1", "auto_masks.zip"))
+        with open(restored_zip, "rb") as f:
+            self.assertEqual(f.read(), b"PK masks")
+        self.assertEqual(os.listdir(os.path.join(self.tmp_dir, "cache", "fake")), ["abc"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+
+from services.colormap_cache import ColormapCache
+
+
+class TestColormapCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.clabel_path = os.path.join(self.tmp_dir, "combined_labels.npz")
+        labels = np.zeros((8, 8, 8), dtype=np.uint8)
+        labels[:4] = 1
+        labels[4:] = 2
+        np.savez_compressed(self.clabel_path, data=labels)
+        self.calls = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def compute(self, clabel_path):
+        self.calls += 1
+        labels = np.load(clabel_path)["data"]
+        return {str(v): {"R": int(v), "G": 0, "B": 0, "A": 128} for v in np.unique(labels) if v != 0}
+
+    def test_memory_hit(self):
+        cache = ColormapCache(max_entries=4)
+        first = cache.get(self.clabel_path, self.compute)
+        second = cache.get(self.clabel_path, self.compute)
+
+        self.assertEqual(first, second)
+        self.assertEqual(self.calls, 1)
+        self.assertTrue(os.path.exists(ColormapCache.sidecar_path(self.clabel_path)))
+
+    def test_sidecar_survives_new_process(self):
+        ColormapCache().get(self.clabel_path, self.compute)
+        # a fresh cache stands in for another gunicorn worker
+        color_map = ColormapCache().get(self.clabel_path, self.compute)
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(set(color_map), {"1", "2"})
+
+    def test_touch_without_change_reuses_sidecar(self):
+        ColormapCache().get(self.clabel_path, self.compute)
+        stat = os.stat(self.clabel_path)
+        os.utime(self.clabel_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        ColormapCache().get(self.clabel_path, self.compute)
+        self.assertEqual(self.calls, 1)
+
+    def test_regenerated_labels_invalidate(self):
+        cache = ColormapCache()
+        cache.get(self.clabel_path, self.compute)
+
+        labels = np.zeros((8, 8, 8), dtype=np.uint8)
+        labels[:2] = 3
+        np.savez_compressed(self.clabel_path, data=labels)
+        stat = os.stat(self.clabel_path)
+        os.utime(self.clabel_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        color_map = cache.get(self.clabel_path, self.compute)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(set(color_map), {"3"})
+
+    def test_lru_eviction(self):
+        cache = ColormapCache(max_entries=1)
+        other_path = os.path.join(self.tmp_dir, "other.npz")
+        np.savez_compressed(other_path, data=np.ones((2, 2, 2), dtype=np.uint8))
+
+        cache.get(self.clabel_path, self.compute)
+        cache.get(other_path, self.compute)
+        os.remove(ColormapCache.sidecar_path(self.clabel_path))
+        cache.get(self.clabel_path, self.compute)
+
+        self.assertEqual(self.calls, 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import threading
+import time
+import os
+from unittest import mock
+
+import api.api_blueprint as api_blueprint_module
+from constants import Constants
+from services.job_events import JobEvents
+from services.segmentation_scheduler import SegmentationScheduler
+from tests.unit.job_test_case import JobTestCase
+
+
+class TestGetResult(JobTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = self.app.test_client()
+        self.api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+        self.gate = threading.Event()
+        self.old_sessions_dir, api_blueprint_module.SESSIONS_DIR = api_blueprint_module.SESSIONS_DIR, self.tmp_dir
+        SegmentationScheduler._instance = self.scheduler = SegmentationScheduler(run_fn=self.run_job)
+
+    def tearDown(self):
+        self.gate.set()
+        self.scheduler.join()
+        api_blueprint_module.SESSIONS_DIR = self.old_sessions_dir
+        super().tearDown()
+
+    def run_job(self, job):
+        self.gate.wait(10)
+        if job.session_id == "broken":
+            raise RuntimeError("model crashed")
+        zip_path = os.path.join(self.tmp_dir, f"{job.session_id}.zip")
+        with open(zip_path, "wb") as f:
+            f.write(b"PK masks")
+        return self.tmp_dir, zip_path
+
+    def test_not_ready(self):
+        self.scheduler.submit("s1", "ct.nii.gz", "fake")
+        begin = time.monotonic()
+        resp = self.client.get(f"{self.api}/get_result/s1")
+        self.assertLess(time.monotonic() - begin, 1)
+        self.assertEqual(resp.status_code, 202)
+        self.assertTrue(1 <= int(resp.headers["Retry-After"]) <= Constants.RESULT_RETRY_AFTER_MAX_SECONDS)
+        self.assertIn(resp.get_json()["status"], ("queued", "running"))
+
+    def test_wait_is_woken_by_the_job(self):
+        self.scheduler.submit("s1", "ct.nii.gz", "fake")
+        threading.Timer(0.2, self.gate.set).start()
+        begin = time.monotonic()
+        with mock.patch.object(Constants, "PROGRESS_STREAM_POLL_SECONDS", 30):
+            resp = self.client.get(f"{self.api}/get_result/s1?wait=20")
+        self.assertLess(time.monotonic() - begin, 5)
+        self.assertEqual((resp.status_code, resp.data), (200, b"PK masks"))
+        self.assertEqual(resp.headers["X-Session-Id"], "s1")
+        self.assertEqual(JobEvents.instance().subscriber_count("s1"), 0)
+
+    def test_failed_and_unknown(self):
+        self.scheduler.submit("broken", "ct.nii.gz", "fake")
+        self.gate.set()
+        self.scheduler.join()
+        resp = self.client.get(f"{self.api}/get_result/broken")
+        self.assertEqual((resp.status_code, resp.get_json()["error"]), (500, "model crashed"))
+
+        self.assertEqual(self.client.get(f"{self.api}/get_result/nobody").status_code, 404)
+        self.assertEqual(self.client.get(f"{self.api}/get_result/broken?wait=soon").status_code, 400)
+
+    def test_zip_without_job(self):
+        os.makedirs(os.path.join(self.tmp_dir, "old-session"))
+        with open(os.path.join(self.tmp_dir, "old-session", "auto_masks.zip"), "wb") as f:
+            f.write(b"PK old")
+        resp = self.client.get(f"{self.api}/get_result/old-session")
+        self.assertEqual((resp.status_code, resp.data), (200, b"PK old"))
+
+
+if __name__ == "__main__":
+    unittest.main()
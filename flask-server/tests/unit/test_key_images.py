@@ -0,0 +1,138 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import nibabel as nib
+from PIL import Image
+from PyPDF2 import PdfReader
+from unittest import mock
+
+import services.key_images
+from services.key_images import slice_label_counts, most_labeled_slices, mask_outline, render_key_image, key_images, RED, YELLOW
+from services.metadata_index import MetadataIndex
+from api.utils import get_most_labeled_slice, zoom_into_labeled_area, generate_pdf_with_template
+from tests.unit.test_metadata_index import write_workbook
+
+
+class TestKeyImages(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.ct = np.linspace(-300, 400, 64 * 48 * 20, dtype=np.float32).reshape(64, 48, 20)
+        self.labels = np.zeros(self.ct.shape, dtype=np.uint8)
+        self.labels[10:40, 10:30, 2:15] = 13  # pancreas
+        self.labels[8:42, 8:32, 6] = 13  # widest on slice 6 ...
+        self.labels[20:28, 15:22, 5:9] = 23  # ... with a PDAC inside
+        self.labels[44:60, 30:44, 9] = 12  # liver on slice 9 only
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def save_nifti(self, name, data):
+        path = os.path.join(self.tmp_dir, name)
+        nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+        return path
+
+    def test_slice_label_counts(self):
+        expected = np.stack([(self.labels == i).sum(axis=(0, 1)) for i in range(24)])
+        np.testing.assert_array_equal(slice_label_counts(self.labels), expected)
+        np.testing.assert_array_equal(slice_label_counts(np.asfortranarray(self.labels)), expected)
+
+        counts = slice_label_counts(self.labels, axis=0, n_labels=14)
+        self.assertEqual(counts.shape, (14, 64))
+        self.assertEqual(counts[12].sum(), (self.labels == 12).sum())
+
+    def test_most_labeled_slices(self):
+        slices = most_labeled_slices(self.labels)
+        self.assertEqual(slices[12], 9)
+        self.assertEqual(slices[13], 6)
+        self.assertEqual(set(slices), {12, 13, 23})
+        self.assertEqual(most_labeled_slices(self.labels, [13, 40]), {13: slices[13]})
+
+    def test_mask_outline(self):
+        mask = np.zeros((7, 7), dtype=bool)
+        mask[1:6, 1:6] = True
+        outline = mask_outline(mask)
+        self.assertEqual(outline.sum(), 16)
+        self.assertFalse(outline[2:5, 2:5].any())
+        self.assertTrue(mask_outline(np.ones((3, 3), dtype=bool))[0].all())
+
+    def test_render_key_image(self):
+        buf = render_key_image(self.ct, self.labels, 12, outlines={12: RED})
+        image = np.asarray(Image.open(buf).convert("RGB"))
+        self.assertEqual(image.shape[:2], (48, 64))
+        red = np.all(image == RED, axis=2)
+        self.assertEqual(red.sum(), 2 * 16 + 2 * 12)
+
+        zoomed = Image.open(render_key_image(self.ct, self.labels, 12, zoom=True, padding=2, size=100))
+        self.assertEqual(max(zoomed.size), 100)
+        self.assertEqual(zoomed.size, (100, 90))  # 20 x 18 crop scaled by 5
+
+        self.assertIsNone(render_key_image(self.ct, self.labels, 17))
+        with self.assertRaises(ValueError):
+            render_key_image(self.ct[:10], self.labels, 12, index=9)
+
+    def test_key_images_from_proxy(self):
+        ct_proxy = nib.load(self.save_nifti("ct.nii.gz", self.ct)).dataobj
+        images = key_images(ct_proxy, self.labels, {
+            "pancreas": (13, {13: RED, 23: YELLOW}),
+            "kidney_left": (10, {10: RED}),
+        }, size=120)
+
+        self.assertEqual(set(images), {"pancreas"})
+        overview = np.asarray(Image.open(images["pancreas"][0]).convert("RGB"))
+        self.assertEqual(max(overview.shape[:2]), 120)
+        self.assertTrue(np.all(overview == RED, axis=2).any())
+        self.assertTrue(np.all(overview == YELLOW, axis=2).any())
+
+    def test_key_images_skip_failed_organ(self):
+        render = services.key_images.render_key_image
+
+        def render_or_fail(ct, labels, label_id, **kwargs):
+            if label_id == 12:
+                raise ValueError("odd orientation")
+            return render(ct, labels, label_id, **kwargs)
+
+        with mock.patch.object(services.key_images, "render_key_image", render_or_fail):
+            images = key_images(self.ct, self.labels, {"liver": (12, {12: RED}), "pancreas": (13, {13: RED})}, size=120)
+        self.assertEqual(set(images), {"pancreas"})
+
+    def test_file_wrappers(self):
+        ct_path = self.save_nifti("ct.nii.gz", self.ct)
+        mask_path = self.save_nifti("liver.nii.gz", (self.labels == 12).astype(np.uint8))
+        empty_path = self.save_nifti("kidney.nii.gz", np.zeros(self.ct.shape, dtype=np.uint8))
+        overlay_png = os.path.join(self.tmp_dir, "overlay.png")
+        zoom_png = os.path.join(self.tmp_dir, "zoom.png")
+
+        self.assertTrue(get_most_labeled_slice(ct_path, mask_path, overlay_png))
+        self.assertEqual(Image.open(overlay_png).size, (64, 48))
+        self.assertTrue(zoom_into_labeled_area(ct_path, mask_path, zoom_png))
+        self.assertEqual(max(Image.open(zoom_png).size), 400)
+        self.assertFalse(zoom_into_labeled_area(ct_path, empty_path, zoom_png))
+
+    def test_report_key_images(self):
+        xlsx_path = os.path.join(self.tmp_dir, "metadata.xlsx")
+        write_workbook(xlsx_path, [("PanTS_00000001", "(64, 48, 20)", "(1, 1, 1)", "Venous", "F", 66, 1)])
+        MetadataIndex._instance = MetadataIndex(xlsx_path, os.path.join(self.tmp_dir, "index.sqlite"))
+        try:
+            output_pdf = os.path.join(self.tmp_dir, "report.pdf")
+            generate_pdf_with_template(
+                output_pdf, "PanTS_00000001",
+                self.save_nifti("ct.nii.gz", self.ct),
+                self.save_nifti("combined_labels.nii.gz", self.labels),
+                "report_template_3.pdf", os.path.join(self.tmp_dir, "content.pdf"), 1,
+            )
+        finally:
+            MetadataIndex._instance = None
+
+        pages = PdfReader(output_pdf).pages
+        self.assertIn("PANCREAS TUMORS", pages[-1].extract_text())
+        xobjects = pages[-1]["/Resources"]["/XObject"].values()
+        key_image_sizes = sorted((x.get_object()["/Width"], x.get_object()["/Height"]) for x in xobjects
+                                 if x.get_object()["/Subtype"] == "/Image" and x.get_object()["/Width"] <= 400)
+        self.assertEqual(len(key_image_sizes), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,157 @@
+import unittest
+import itertools
+from unittest import mock
+import numpy as np
+from scipy.ndimage import distance_transform_edt
+
+from api.utils import build_adjacency_graph, extract_adjacent_label_pairs
+from api.utils import fill_voids_with_nearest_label, _slab_bytes_per_voxel
+from api.utils import assign_colors_with_high_contrast
+from api import utils
+
+
+def brute_force_adjacency(label_array):
+    adjacency = {}
+    for idx in itertools.product(*(range(n) for n in label_array.shape)):
+        for axis in range(label_array.ndim):
+            nbr = list(idx)
+            nbr[axis] += 1
+            if nbr[axis] >= label_array.shape[axis]:
+                continue
+            a, b = label_array[idx], label_array[tuple(nbr)]
+            if a != b and a != 0 and b != 0:
+                adjacency.setdefault(a, set()).add(b)
+                adjacency.setdefault(b, set()).add(a)
+    return adjacency
+
+
+class TestAdjacencyGraph(unittest.TestCase):
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        label_array = rng.integers(0, 6, size=(9, 7, 5)).astype(np.float64)
+
+        adjacency = build_adjacency_graph(label_array)
+
+        self.assertEqual(dict(adjacency), brute_force_adjacency(label_array))
+
+    def test_no_wrap_around(self):
+        label_array = np.zeros((6, 4, 4), dtype=np.uint8)
+        label_array[0] = 1
+        label_array[-1] = 2
+
+        self.assertEqual(len(build_adjacency_graph(label_array)), 0)
+
+    def test_pairs_are_unique_and_ordered(self):
+        label_array = np.zeros((4, 4, 4), dtype=np.uint8)
+        label_array[:2] = 3
+        label_array[2:] = 1
+
+        pairs = extract_adjacent_label_pairs(label_array)
+
+        self.assertEqual(pairs.tolist(), [[1, 3]])
+        self.assertEqual(pairs.dtype, label_array.dtype)
+
+
+def whole_volume_fill(label_array):
+    mask = label_array == 0
+    _, indices = distance_transform_edt(mask, return_indices=True)
+    filled = label_array.copy()
+    filled[mask] = label_array[tuple(indices[:, mask])]
+    return filled
+
+
+class TestFillVoids(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.label_array = np.zeros((40, 24, 20), dtype=np.float64)
+        # sparse blobs with large empty gaps between them
+        for label in range(1, 6):
+            x, y, z = rng.integers(4, 16, size=3)
+            x += 6 * (label - 1)
+            self.label_array[x:x + 3, y:y + 4, z:z + 2] = label
+        self.expected = whole_volume_fill(self.label_array)
+
+    def fill_in_slabs(self, label_array, memory_budget_mb):
+        with mock.patch("api.utils._fill_slab", wraps=utils._fill_slab) as fill_slab:
+            filled = fill_voids_with_nearest_label(label_array, memory_budget_mb=memory_budget_mb)
+        slabs = [(c.args[1], c.args[2]) for c in fill_slab.call_args_list]
+        return filled, slabs
+
+    def test_small_budget_matches_whole_volume(self):
+        plane_bytes = _slab_bytes_per_voxel(self.label_array.dtype) * 24 * 20
+        budget_mb = 3.5 * plane_bytes / (1024 * 1024)
+        filled, slabs = self.fill_in_slabs(self.label_array, budget_mb)
+
+        np.testing.assert_array_equal(filled, self.expected)
+        self.assertGreater(len(slabs), 1)
+        self.assertEqual([stop - start for start, stop in slabs][:-1], [3] * (len(slabs) - 1))
+        self.assertEqual(slabs[-1][1], 40)
+        for start, stop in slabs:
+            self.assertLessEqual((stop - start) * plane_bytes, budget_mb * 1024 * 1024)
+
+    def test_ties_match_whole_volume(self):
+        rng = np.random.default_rng(2)
+        label_array = ((rng.random((12, 9, 11)) < 0.03) * rng.integers(1, 4, size=(12, 9, 11))).astype(np.uint8)
+        filled, slabs = self.fill_in_slabs(label_array, 1e-6)
+
+        np.testing.assert_array_equal(filled, whole_volume_fill(label_array))
+        self.assertEqual(len(slabs), 12)
+
+    def test_far_field_keeps_contacts(self):
+        filled, _ = self.fill_in_slabs(self.label_array, 0.05)
+
+        self.assertEqual(dict(build_adjacency_graph(filled)), dict(build_adjacency_graph(self.expected)))
+
+    def test_no_voids(self):
+        label_array = np.ones((3, 3, 3), dtype=np.uint8)
+        self.assertIs(fill_voids_with_nearest_label(label_array), label_array)
+
+
+class TestAssignColors(unittest.TestCase):
+
+    def setUp(self):
+        # a wheel: hub 0 touches every rim label, rim labels touch their neighbours
+        rim = list(range(1, 9))
+        self.adjacency = {0: set(rim)}
+        for i, label in enumerate(rim):
+            self.adjacency[label] = {0, rim[i - 1], rim[(i + 1) % len(rim)]}
+
+    def assert_proper(self, color_map, adjacency):
+        for label, nbrs in adjacency.items():
+            for nbr in nbrs:
+                self.assertNotEqual(color_map[str(label)], color_map[str(nbr)])
+
+    def test_adjacent_labels_differ(self):
+        color_map, _ = assign_colors_with_high_contrast(list(self.adjacency), self.adjacency)
+
+        self.assertEqual(set(color_map), {str(label) for label in self.adjacency})
+        self.assert_proper(color_map, self.adjacency)
+        for color in color_map.values():
+            self.assertEqual(set(color), {"R", "G", "B", "A"})
+            self.assertEqual(color["A"], 128)
+
+    def test_deterministic(self):
+        first, _ = assign_colors_with_high_contrast(list(self.adjacency), self.adjacency)
+        second, _ = assign_colors_with_high_contrast(list(reversed(list(self.adjacency))), self.adjacency)
+
+        self.assertEqual(first, second)
+
+    def test_palette_grows_in_one_pass(self):
+        # a 6-clique needs more than the 4 initial colors
+        clique = {a: {b for b in range(6) if b != a} for a in range(6)}
+        color_map, usage = assign_colors_with_high_contrast(list(clique), clique, min_initial_colors=4)
+
+        self.assertEqual(len(usage), 6)
+        self.assert_proper(color_map, clique)
+
+    def test_usage_is_balanced(self):
+        isolated = {label: set() for label in range(10)}
+        _, usage = assign_colors_with_high_contrast(list(isolated), isolated, min_initial_colors=5)
+
+        self.assertEqual(set(usage.values()), {2})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import tempfile
+import shutil
+import os
+from openpyxl import Workbook
+
+from services.metadata_index import MetadataIndex
+
+
+HEADER = ("PanTS ID", "shape", "spacing", "ct phase", "sex", "age", "tumor?")
+
+
+def write_workbook(path, rows):
+    wb = Workbook()
+    sheet = wb.active
+    sheet.title = "PanTS_metadata"
+    sheet.append(HEADER)
+    for row in rows:
+        sheet.append(row)
+    wb.save(path)
+
+
+class TestMetadataIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.xlsx_path = os.path.join(self.tmp_dir, "metadata.xlsx")
+        self.sqlite_path = os.path.join(self.tmp_dir, "metadata.index.sqlite")
+        write_workbook(self.xlsx_path, [
+            ("PanTS_00000001", "(512, 333, 200)", "(0.625, 0.625, 0.8)", "Non-contrast", "F", 66, 0),
+            ("PanTS_00000003", "(495, 349, 40)", "(0.818359, 0.818359, 7.5)", "Venous", None, None, 1),
+        ])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_lookup(self):
+        index = MetadataIndex(self.xlsx_path, self.sqlite_path)
+
+        self.assertEqual(index.get("PanTS_00000001")["sex"], "F")
+        self.assertEqual(index.get("PanTS_00000001")["age"], 66)
+        self.assertEqual(index.get("PanTS_00000003")["ct_phase"], "Venous")
+        self.assertIsNone(index.get("PanTS_00000003")["age"])
+        self.assertIsNone(index.get("PanTS_00000002"))
+        self.assertEqual(index.spacing("PanTS_00000001"), (0.625, 0.625, 0.8))
+        self.assertEqual(index.shape("PanTS_00000003"), (495, 349, 40))
+
+    def test_persisted_index_skips_parse(self):
+        MetadataIndex(self.xlsx_path, self.sqlite_path).get("PanTS_00000001")
+
+        index = MetadataIndex(self.xlsx_path, self.sqlite_path)
+        index._parse_xlsx = lambda: self.fail("workbook should not be parsed again")
+        self.assertEqual(index.get("PanTS_00000001")["tumor"], 0)
+
+    def test_reload_on_change(self):
+        index = MetadataIndex(self.xlsx_path, self.sqlite_path)
+        self.assertEqual(index.get("PanTS_00000001")["age"], 66)
+
+        write_workbook(self.xlsx_path, [
+            ("PanTS_00000001", "(512, 333, 200)", "(0.625, 0.625, 0.8)", "Non-contrast", "F", 67, 0),
+        ])
+        stat = os.stat(self.xlsx_path)
+        os.utime(self.xlsx_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+        self.assertEqual(index.get("PanTS_00000001")["age"], 67)
+        self.assertIsNone(index.get("PanTS_00000003"))
+
+    def test_unwritable_index_path(self):
+        index = MetadataIndex(self.xlsx_path, os.path.join(self.tmp_dir, "missing", "index.sqlite"))
+        self.assertEqual(index.get("PanTS_00000001")["sex"], "F")
+
+
+if __name__ == "__main__":
+    unittest.main()
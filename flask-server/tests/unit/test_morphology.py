@@ -0,0 +1,66 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import nibabel as nib
+import scipy.ndimage as ndimage
+
+from constants import Constants
+from services.nifti_processor import NiftiProcessor
+from services.morphology import label_boxes, binary_erosion_roi, binary_dilation_roi
+
+
+def paste_roi(region, result, shape):
+    full = np.zeros(shape, dtype=bool)
+    full[region] = result
+    return full
+
+
+class TestMorphology(unittest.TestCase):
+
+    def setUp(self):
+        self.labels = np.zeros((30, 26, 20), dtype=np.uint8)
+        self.labels[0:9, 4:15, 3:12] = 1  # touches the volume edge
+        self.labels[12:20, 10:25, 8:20] = 2
+        self.labels[22:24, 2:4, 5:7] = 3  # vanishes under erosion
+        self.structure = Constants.STRUCTURING_ELEMENT
+
+    def test_roi_ops_match_full_volume(self):
+        boxes = label_boxes(self.labels)
+        self.assertEqual(sorted(boxes), [1, 2, 3])
+
+        for label_id in (1, 2, 3):
+            mask = self.labels == label_id
+            for op, roi_op in ((ndimage.binary_erosion, binary_erosion_roi), (ndimage.binary_dilation, binary_dilation_roi)):
+                expected = op(mask, structure=self.structure)
+                region, result = roi_op(mask)
+                np.testing.assert_array_equal(paste_roi(region, result, mask.shape), expected)
+                region, result = roi_op(self.labels, box=boxes[label_id], label_id=label_id)
+                np.testing.assert_array_equal(paste_roi(region, result, mask.shape), expected)
+
+        self.assertEqual(binary_erosion_roi(self.labels == 7), (None, None))
+
+    def test_pdac_sma_staging(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            clabel_path = os.path.join(tmp_dir, "combined_labels.nii.gz")
+            labels = np.zeros((40, 40, 30), dtype=np.uint8)
+            labels[10:20, 10:20, 10:20] = 23  # PDAC
+            labels[21:24, 5:35, 12:16] = 15  # SMA, partly within reach of the tumour
+            nib.save(nib.Nifti1Image(labels, np.eye(4)), clabel_path)
+
+            dilated = ndimage.binary_dilation(labels == 23, structure=self.structure)
+            ratio = np.sum(dilated & (labels == 15)) / np.sum(labels == 15)
+            self.assertTrue(0 < ratio <= 0.3)
+            self.assertEqual(NiftiProcessor(None, clabel_path).calculate_pdac_sma_staging(), "Stage T2 (SMA contact < 90°)")
+
+            labels[labels == 23] = 0
+            nib.save(nib.Nifti1Image(labels, np.eye(4)), clabel_path)
+            self.assertEqual(NiftiProcessor(None, clabel_path).calculate_pdac_sma_staging(), "Stage T1 (No PDAC tumor present)")
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
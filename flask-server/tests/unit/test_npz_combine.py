@@ -0,0 +1,90 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+
+from constants import Constants
+from services.npz_processor import NpzProcessor, get_panTS_id, label_dtype, paint_label, iter_decoded_npz
+
+
+class TestNpzCombineLabels(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+
+        self.seg_dir = os.path.join(self.tmp_dir, "data", "LabelTr", get_panTS_id(1), "segmentations")
+        os.makedirs(self.seg_dir)
+        rng = np.random.default_rng(0)
+        for organ in ("aorta", "liver", "pancreas", "spleen"):
+            mask = (rng.random((12, 10, 8)) < 0.3).astype(np.uint8)
+            np.savez_compressed(os.path.join(self.seg_dir, f"{organ}.npz"), data=mask)
+
+    def tearDown(self):
+        Constants.PANTS_PATH = self.old_pants_path
+        shutil.rmtree(self.tmp_dir)
+
+    def load_masks(self, organ_intensities):
+        return {label: np.load(os.path.join(self.seg_dir, filename))["data"]
+                for filename, label in organ_intensities.items()}
+
+    def test_matches_maximum_merge(self):
+        combined, organ_intensities = NpzProcessor().combine_labels(1, save=False)
+
+        masks = self.load_masks(organ_intensities)
+        expected = np.zeros(combined.shape)
+        for label, mask in masks.items():
+            expected = np.maximum(expected, mask * np.float64(label))
+
+        self.assertEqual(combined.dtype, np.uint8)
+        self.assertEqual(sorted(organ_intensities.values()), [1, 2, 3, 4])
+        np.testing.assert_array_equal(combined, expected)
+
+    def test_first_overlap_policy(self):
+        combined, organ_intensities = NpzProcessor().combine_labels(1, save=False, overlap="first")
+
+        expected = np.zeros(combined.shape, dtype=np.uint8)
+        for label, mask in sorted(self.load_masks(organ_intensities).items(), reverse=True):
+            expected[mask > 0] = label
+        np.testing.assert_array_equal(combined, expected)
+
+    def test_decode_workers(self):
+        processor = NpzProcessor()
+        serial, serial_intensities = processor.combine_labels(1, save=False, workers=1)
+        parallel, parallel_intensities = processor.combine_labels(1, save=False, workers=3)
+
+        np.testing.assert_array_equal(parallel, serial)
+        self.assertEqual(parallel_intensities, serial_intensities)
+        self.assertEqual(processor.timings["decode_workers"], 3)
+        self.assertEqual(processor.timings["masks"], 4)
+
+    def test_iter_decoded_npz(self):
+        paths = sorted(os.path.join(self.seg_dir, f) for f in os.listdir(self.seg_dir))
+        decoded = dict(iter_decoded_npz(paths, workers=2))
+
+        self.assertEqual(sorted(decoded), [0, 1, 2, 3])
+        for i, path in enumerate(paths):
+            np.testing.assert_array_equal(decoded[i], np.load(path)["data"])
+
+    def test_save(self):
+        combined, _ = NpzProcessor().combine_labels(1, save=True)
+        saved = np.load(os.path.join(os.path.dirname(self.seg_dir), Constants.COMBINED_LABELS_FILENAME))["data"]
+        np.testing.assert_array_equal(saved, combined)
+
+    def test_paint_label(self):
+        self.assertEqual(label_dtype(255), np.uint8)
+        self.assertEqual(label_dtype(256), np.uint16)
+        combined = np.zeros(4, dtype=np.uint16)
+        mask = np.array([True, True, False, False])
+        paint_label(combined, mask, 300)
+        paint_label(combined, np.array([0, 1, 1, 0]), 2, overlap="first")
+        np.testing.assert_array_equal(combined, [300, 2, 2, 0])
+        np.testing.assert_array_equal(mask, [True, True, False, False])
+        with self.assertRaises(ValueError):
+            paint_label(combined, mask, 1, overlap="max")
+
+
+if __name__ == "__main__":
+    unittest.main()
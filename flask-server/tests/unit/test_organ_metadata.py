@@ -0,0 +1,101 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+from unittest import mock
+
+import api.utils
+from app import create_app
+from constants import Constants
+from models.base import db
+from api.utils import get_mask_data_internal
+from services.npz_processor import get_panTS_id, get_ct_npz_path, get_clabel_npz_path
+from services.metadata_index import MetadataIndex
+from services.organ_metadata import OrganMetadataStore
+from tests.unit.test_metadata_index import write_workbook
+
+
+class TestOrganMetadata(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+        MetadataIndex._instance = None
+
+        labels = np.zeros((20, 16, 12), dtype=np.uint8)
+        labels[2:10, 3:12, 2:9] = 1
+        labels[11:18, 2:8, 3:10] = 2
+        seg_dir = os.path.join(os.path.dirname(get_clabel_npz_path(1)), "segmentations")
+        os.makedirs(seg_dir)
+        os.makedirs(os.path.dirname(get_ct_npz_path(1)))
+        np.savez_compressed(os.path.join(seg_dir, "liver.npz"), data=(labels == 1).astype(np.uint8))
+        np.savez_compressed(os.path.join(seg_dir, "spleen.npz"), data=(labels == 2).astype(np.uint8))
+        self.ct = np.random.default_rng(0).integers(-100, 200, size=labels.shape).astype(np.int16)
+        np.savez_compressed(get_ct_npz_path(1), data=self.ct)
+        write_workbook(os.path.join(self.tmp_dir, "data", "metadata.xlsx"), [
+            (get_panTS_id(1), "(20, 16, 12)", "(1, 1, 2)", "Venous", "F", 50, 0),
+        ])
+
+        self.app = create_app()
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.app_context.pop()
+        MetadataIndex._instance = None
+        Constants.PANTS_PATH = self.old_pants_path
+        shutil.rmtree(self.tmp_dir)
+
+    def test_computed_once_and_stored(self):
+        compute = mock.Mock(wraps=api.utils.compute_case_organ_metadata)
+        with mock.patch.object(api.utils, "compute_case_organ_metadata", compute):
+            first = get_mask_data_internal(1)
+            second = get_mask_data_internal("1")
+
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(first, second)
+        metrics = {m["organ_name"]: m for m in first["organ_metrics"]}
+        self.assertEqual(set(metrics), {"liver.npz", "spleen.npz"})
+        self.assertEqual(first["label_stats"]["1"]["voxels"] + first["label_stats"]["2"]["voxels"], 8 * 9 * 7 + 7 * 6 * 7)
+
+        row = OrganMetadataStore.instance().get_row(get_panTS_id(1))
+        self.assertEqual(row.organ_metadata["input_hash"], first["input_hash"])
+
+    def test_recompute_only_when_labels_change(self):
+        compute = mock.Mock(wraps=api.utils.compute_case_organ_metadata)
+        with mock.patch.object(api.utils, "compute_case_organ_metadata", compute):
+            first = get_mask_data_internal(1)
+
+            clabel_path = get_clabel_npz_path(1)
+            stat = os.stat(clabel_path)
+            os.utime(clabel_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            touched = get_mask_data_internal(1)
+            self.assertEqual(compute.call_count, 1)
+            self.assertEqual(touched["input_hash"], first["input_hash"])
+
+            labels = np.load(clabel_path)["data"]
+            labels[labels == 2] = 0
+            np.savez_compressed(clabel_path, data=labels)
+            changed = get_mask_data_internal(1)
+
+        self.assertEqual(compute.call_count, 2)
+        self.assertNotEqual(changed["input_hash"], first["input_hash"])
+        self.assertNotIn("2", changed["label_stats"])
+
+    def test_mask_data_endpoint(self):
+        client = self.app.test_client()
+        resp = client.post(f"{Constants.BASE_PATH.rstrip('/')}/api/mask-data", data={"sessionKey": "1"})
+
+        data = resp.get_json()
+        self.assertEqual(len(data["organ_metrics"]), 2)
+        self.assertEqual(list(data), ["organ_metrics"])
+        self.assertEqual(get_mask_data_internal("no-such-session").get("error"), "No combined labels found for session no-such-session")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import nibabel as nib
+import scipy.ndimage as ndimage
+
+from constants import Constants
+from services.nifti_processor import NiftiProcessor
+from services.organ_metrics import label_statistics, eroded_labels
+
+
+def make_labels(shape=(30, 28, 24)):
+    """A few blobs, one of them too thin to survive erosion."""
+    labels = np.zeros(shape, dtype=np.uint8)
+    labels[2:15, 3:20, 2:12] = 1
+    labels[10:25, 10:26, 8:20] = 2
+    labels[20:28, 2:6, 3:] = 3
+    labels[5:7, 22:27, 14:22] = 4
+    return labels
+
+
+class TestOrganMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.labels = make_labels()
+        self.ct = np.random.default_rng(0).normal(40, 25, size=self.labels.shape)
+
+    def test_label_statistics_match_masks(self):
+        stats = label_statistics(np.asfortranarray(self.labels.astype(np.float64)), self.ct)
+
+        self.assertEqual(stats.labels(), [1, 2, 3, 4])
+        for label_id in range(5):
+            mask = self.labels == label_id
+            self.assertEqual(stats.count(label_id), mask.sum())
+            self.assertAlmostEqual(stats.mean(label_id), self.ct[mask].mean())
+            self.assertAlmostEqual(stats.std(label_id), self.ct[mask].std())
+        self.assertEqual(stats.count(9), 0)
+        self.assertEqual(stats.mean(9), 0.0)
+
+    def test_eroded_labels_match_binary_erosion(self):
+        eroded = eroded_labels(self.labels)
+
+        for label_id in range(1, 5):
+            expected = ndimage.binary_erosion(self.labels == label_id, structure=Constants.STRUCTURING_ELEMENT)
+            np.testing.assert_array_equal(eroded == label_id, expected)
+
+    def test_calculate_metrics(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            affine = np.diag([0.8, 0.8, 2.0, 1])
+            ct_path = os.path.join(tmp_dir, "ct.nii.gz")
+            clabel_path = os.path.join(tmp_dir, "combined_labels.nii.gz")
+            nib.save(nib.Nifti1Image(np.rint(self.ct).astype(np.int16), affine), ct_path)
+            nib.save(nib.Nifti1Image(self.labels, affine), clabel_path)
+
+            nifti_processor = NiftiProcessor(ct_path, clabel_path)
+            nifti_processor.set_organ_intensities({"liver": 1, "spleen": 2, "aorta": 3, "kidney_left": 4, "colon": 5})
+            metrics = {m["organ_name"]: m for m in nifti_processor.calculate_metrics()["organ_metrics"]}
+
+            ct = np.rint(self.ct)
+            # kidney_left (label 4) vanishes under erosion and falls back to the plain mean
+            for organ, label_id in (("liver", 1), ("spleen", 2), ("kidney_left", 4)):
+                mask = self.labels == label_id
+                eroded = ndimage.binary_erosion(mask, structure=Constants.STRUCTURING_ELEMENT)
+                expected_hu = ct[eroded].mean() if eroded.any() else ct[mask].mean()
+                self.assertEqual(metrics[organ]["volume_cm3"], round(mask.sum() * 0.8 * 0.8 * 2.0 / 1000, 2))
+                self.assertEqual(metrics[organ]["mean_hu"], round(expected_hu, 1))
+            # aorta touches the last slice
+            self.assertEqual(metrics["aorta"]["mean_hu"], nifti_processor.number_max)
+            self.assertEqual(metrics["colon"]["volume_cm3"], 0)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,107 @@
+import unittest
+import subprocess
+import os
+import numpy as np
+import nibabel as nib
+from datetime import datetime, timedelta
+from unittest import mock
+
+from app import create_app
+from constants import Constants
+from services.auto_segmentor import parse_progress, run_with_progress
+from services.progress_store import ProgressStore
+from services.segmentation_scheduler import SegmentationScheduler
+from tests.unit.job_test_case import JobTestCase
+
+
+class TestProgressStore(JobTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = ProgressStore()
+
+    def test_parse_progress(self):
+        self.assertEqual(parse_progress(" 45%|████▌     | 9/20 [00:03<00:04]"), 45)
+        self.assertEqual(parse_progress("progress: 100%"), 100)
+        self.assertEqual(parse_progress("step 2.5 % done, 7.5%"), 7)
+        self.assertIsNone(parse_progress("loading weights"))
+        self.assertIsNone(parse_progress("gpu util 250%"))
+
+    def test_run_with_progress(self):
+        seen = []
+        run_with_progress("printf '10%%|#\\r10%%|#\\r50%%|##\\nwriting masks\\n100%%\\n'", seen.append)
+        self.assertEqual(seen, [10, 50, 100])
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_with_progress("echo 20%; exit 3", seen.append)
+
+    def test_runtime_moving_average(self):
+        self.assertEqual(self.store.expected_seconds("fake"), Constants.DEFAULT_MODEL_SECONDS)
+        self.store.record_runtime("fake", 10)
+        self.assertEqual(self.store.expected_seconds("fake"), 10)
+        self.store.record_runtime("fake", 20)
+        self.assertAlmostEqual(self.store.expected_seconds("fake"), 0.3 * 20 + 0.7 * 10)
+
+    def test_progress(self):
+        self.store.record_runtime("fake", 100)
+        job = {"job_id": "j", "model_name": "fake", "status": "queued", "progress": None, "started": None}
+        self.assertEqual(self.store.progress(job)["progress"], 0)
+        self.assertEqual(self.store.progress(job)["eta_seconds"], 100)
+
+        job.update(status="running", started=(datetime.now() - timedelta(seconds=40)).isoformat())
+        self.assertEqual(self.store.progress(job)["progress"], 40)
+        self.assertAlmostEqual(self.store.progress(job)["eta_seconds"], 60, delta=1)
+
+        job["progress"] = 80  # printed by the model: 40 s for 80 %
+        self.assertEqual(self.store.progress(job)["progress"], 80)
+        self.assertAlmostEqual(self.store.progress(job)["eta_seconds"], 10, delta=1)
+
+        job.update(status="failed", error="model crashed")
+        self.assertEqual(self.store.progress(job), {"job_id": "j", "status": "failed", "expected_seconds": 100,
+                                                    "progress": 100, "eta_seconds": 0, "error": "model crashed"})
+
+    def test_progress_across_workers(self):
+        db_path = os.path.join(self.tmp_dir, "jobs.sqlite")
+        seen = []
+
+        def run(job):
+            store = ProgressStore.instance()
+            store.update(job.job_id, 30)
+            store.update(job.job_id, 20)  # never backwards
+            seen.append(other_client.get(f"{api}/progress/s1").get_json())
+            return None, None
+
+        with mock.patch.object(Constants, "SQLALCHEMY_DATABASE_URI", f"sqlite:///{db_path}"):
+            worker_app, other_app = create_app(), create_app()
+        other_client = other_app.test_client()
+        api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+        SegmentationScheduler._instance = scheduler = SegmentationScheduler(run_fn=run)
+
+        self.assertEqual(other_client.get(f"{api}/progress/s1").get_json(), {"progress": 0, "status": "pending"})
+        with worker_app.app_context():
+            scheduler.submit("s1", "ct.nii.gz", "fake")
+        scheduler.join()
+
+        self.assertEqual((seen[0]["status"], seen[0]["progress"]), ("running", 30))
+        done = other_client.get(f"{api}/progress/s1").get_json()
+        self.assertEqual((done["status"], done["progress"], done["eta_seconds"]), ("done", 100, 0))
+        self.assertLess(done["expected_seconds"], Constants.DEFAULT_MODEL_SECONDS)  # the run's runtime
+
+    def test_fake_model_progress(self):
+        old_fake, Constants.FAKE_MODEL_ENABLED = Constants.FAKE_MODEL_ENABLED, True
+        SegmentationScheduler._instance = scheduler = SegmentationScheduler()
+        updates = []
+        try:
+            ct_path = os.path.join(self.tmp_dir, "ct.nii.gz")
+            nib.save(nib.Nifti1Image(np.zeros((8, 8, 4), dtype=np.int16), np.eye(4)), ct_path)
+            with mock.patch.dict(os.environ, {"FAKE_MODEL_SECONDS": "0"}), \
+                    mock.patch.object(ProgressStore, "update", lambda store, job_id, percent: updates.append(percent)):
+                scheduler.submit("s1", ct_path, "fake")
+                scheduler.join()
+            self.assertEqual(updates, list(range(10, 101, 10)))
+            self.assertEqual(scheduler.latest("s1")["status"], "done")
+        finally:
+            Constants.FAKE_MODEL_ENABLED = old_fake
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+import unittest
+import threading
+import os
+from unittest import mock
+import json
+import time
+import signal
+import runpy
+
+from constants import Constants
+from api.api_blueprint import progress_events
+from services.job_events import JobEvents, format_sse
+from services.progress_store import ProgressStore
+from services.segmentation_scheduler import SegmentationScheduler
+from tests.unit.job_test_case import JobTestCase
+
+
+def parse_events(messages):
+    events = []
+    for message in messages:
+        if message.startswith(":"):
+            events.append(("heartbeat", None))
+            continue
+        fields = dict(line.split(": ", 1) for line in message.strip().split("\n"))
+        events.append((fields.get("event"), json.loads(fields["data"])))
+    return events
+
+
+class TestProgressStream(JobTestCase):
+
+    def test_format_sse(self):
+        self.assertEqual(format_sse({"progress": 5}, event="progress", retry=3000),
+                         'retry: 3000\nevent: progress\ndata: {"progress": 5}\n\n')
+
+    def test_pushes_progress_and_completion(self):
+        started, halfway = threading.Event(), threading.Event()
+
+        def run(job):
+            started.wait(5)
+            ProgressStore.instance().update(job.job_id, 50)
+            JobEvents.instance().publish(job.session_id)
+            halfway.wait(5)
+            return None, None
+
+        SegmentationScheduler._instance = scheduler = SegmentationScheduler(run_fn=run)
+        scheduler.submit("s1", "ct.nii.gz", "fake")
+        messages = []
+
+        def consume():
+            with self.app.app_context():
+                # polling every 30 s: only pushed notifications can deliver these events in time
+                messages.extend(progress_events("s1", heartbeat=30, poll=30))
+
+        consumer = threading.Thread(target=consume)
+        begin = time.monotonic()
+        consumer.start()
+        while not any('"running"' in m for m in messages) and time.monotonic() - begin < 5:
+            time.sleep(0.01)
+        started.set()
+        while not any('"progress": 50' in m for m in messages) and time.monotonic() - begin < 5:
+            time.sleep(0.01)
+        halfway.set()
+        consumer.join(10)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertLess(time.monotonic() - begin, 5)
+        events = parse_events(messages)
+        self.assertEqual([(name, data["status"], data["progress"]) for name, data in events[-3:]], [
+            ("progress", "running", 50), ("progress", "done", 100), ("complete", "done", 100)
+        ])
+        self.assertTrue(messages[0].startswith("retry: "))
+        self.assertEqual(JobEvents.instance().subscriber_count("s1"), 0)
+
+    def test_heartbeat_and_timeout(self):
+        events = parse_events(progress_events("nobody", heartbeat=0.05, poll=1, max_seconds=0.3))
+        self.assertEqual(events[0], ("progress", {"progress": 0, "status": "pending"}))
+        self.assertIn(("heartbeat", None), events)
+        self.assertEqual(events[-1], ("timeout", {"session_id": "nobody"}))
+
+    def test_shutdown(self):
+        stream = progress_events("s1", heartbeat=30, poll=30)
+        self.assertEqual(parse_events([next(stream)])[0][0], "progress")
+        self.assertEqual(JobEvents.instance().subscriber_count("s1"), 1)
+        JobEvents.instance().shutdown()
+        self.assertEqual(parse_events(list(stream)), [("shutdown", {"session_id": "s1"})])
+        self.assertEqual(JobEvents.instance().subscriber_count("s1"), 0)
+
+    def test_worker_stop_signal_ends_open_streams(self):
+        stopped = []
+        gunicorn_conf = runpy.run_path(os.path.join(os.path.dirname(__file__), "..", "..", "gunicorn.conf.py"))
+        previous = {signum: signal.getsignal(signum) for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT)}
+        try:
+            # stands in for the handler gunicorn's worker installed before post_worker_init
+            signal.signal(signal.SIGTERM, lambda sig, frame: stopped.append(sig))
+            gunicorn_conf["post_worker_init"](mock.Mock())
+            messages = []
+
+            def consume():
+                with self.app.app_context():
+                    messages.extend(progress_events("s1", heartbeat=30, poll=30))
+
+            consumer = threading.Thread(target=consume)
+            consumer.start()
+            while JobEvents.instance().subscriber_count("s1") == 0:
+                time.sleep(0.01)
+            os.kill(os.getpid(), signal.SIGTERM)
+            consumer.join(5)
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+        self.assertFalse(consumer.is_alive())
+        self.assertEqual(parse_events(messages)[-1], ("shutdown", {"session_id": "s1"}))
+        self.assertEqual(stopped, [signal.SIGTERM])
+
+    def test_endpoint(self):
+        SegmentationScheduler._instance = scheduler = SegmentationScheduler(run_fn=lambda job: (None, None))
+        scheduler.submit("s1", "ct.nii.gz", "fake")
+        scheduler.join()
+
+        resp = self.app.test_client().get(f"{Constants.BASE_PATH.rstrip('/')}/api/progress/stream/s1")
+        self.assertEqual(resp.mimetype, "text/event-stream")
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+        events = parse_events(m + "\n\n" for m in resp.get_data(as_text=True).split("\n\n") if m)
+        self.assertEqual([name for name, _ in events], ["progress", "complete"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import nibabel as nib
+
+from app import create_app
+from constants import Constants
+from api.utils import get_panTS_id
+
+
+class TestRangeRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+
+        label_dir = os.path.join(self.tmp_dir, "data", "LabelTr", get_panTS_id(1))
+        os.makedirs(label_dir)
+        self.nifti_path = os.path.join(label_dir, Constants.COMBINED_LABELS_NIFTI_FILENAME)
+        labels = np.random.default_rng(0).integers(0, 5, size=(20, 20, 20)).astype(np.uint8)
+        nib.save(nib.Nifti1Image(labels, affine=np.eye(4)), self.nifti_path)
+        with open(self.nifti_path, "rb") as f:
+            self.body = f.read()
+
+        self.client = create_app().test_client()
+        self.url = f"{Constants.BASE_PATH.rstrip('/')}/api/get-segmentations/1"
+
+    def tearDown(self):
+        Constants.PANTS_PATH = self.old_pants_path
+        shutil.rmtree(self.tmp_dir)
+
+    def test_full_response_advertises_ranges(self):
+        resp = self.client.get(self.url)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Accept-Ranges"], "bytes")
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.data, self.body)
+
+    def test_single_range(self):
+        resp = self.client.get(self.url, headers={"Range": "bytes=10-19"})
+
+        self.assertEqual(resp.status_code, 206)
+        self.assertEqual(resp.headers["Content-Range"], f"bytes 10-19/{len(self.body)}")
+        self.assertEqual(resp.data, self.body[10:20])
+
+    def test_suffix_and_open_ranges(self):
+        self.assertEqual(self.client.get(self.url, headers={"Range": "bytes=-7"}).data, self.body[-7:])
+        self.assertEqual(self.client.get(self.url, headers={"Range": "bytes=100-"}).data, self.body[100:])
+
+    def test_multiple_ranges(self):
+        resp = self.client.get(self.url, headers={"Range": "bytes=0-3,50-59"})
+
+        self.assertEqual(resp.status_code, 206)
+        self.assertTrue(resp.content_type.startswith("multipart/byteranges; boundary="))
+        self.assertEqual(int(resp.headers["Content-Length"]), len(resp.data))
+        self.assertIn(self.body[0:4], resp.data)
+        self.assertIn(self.body[50:60], resp.data)
+        self.assertIn(f"Content-Range: bytes 50-59/{len(self.body)}".encode(), resp.data)
+
+    def test_unsatisfiable_range(self):
+        resp = self.client.get(self.url, headers={"Range": f"bytes={len(self.body) + 5}-"})
+
+        self.assertEqual(resp.status_code, 416)
+        self.assertEqual(resp.headers["Content-Range"], f"bytes */{len(self.body)}")
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        resp = self.client.get(self.url, headers={"Range": "bytes=0-9", "If-Range": '"stale"'})
+        self.assertEqual(resp.status_code, 200)
+
+        etag = self.client.get(self.url).headers["ETag"]
+        resp = self.client.get(self.url, headers={"Range": "bytes=0-9", "If-Range": etag})
+        self.assertEqual(resp.status_code, 206)
+
+    def test_file_mode_is_plain_gzip(self):
+        resp = self.client.get(f"{self.url}?mode=file", headers={"Range": "bytes=0-1"})
+
+        self.assertEqual(resp.status_code, 206)
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.mimetype, "application/gzip")
+        self.assertEqual(resp.data, b"\x1f\x8b")
+
+
+if __name__ == "__main__":
+    unittest.main()
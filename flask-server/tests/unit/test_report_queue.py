@@ -0,0 +1,132 @@
+import unittest
+import tempfile
+import shutil
+import json
+import time
+import os
+import numpy as np
+from unittest import mock
+
+import api.api_blueprint as api_blueprint_module
+from app import create_app
+from constants import Constants
+from services.report_queue import ReportQueue
+from services.npz_processor import get_ct_npz_path, get_clabel_npz_path
+from api.utils import get_template_page
+
+
+def fake_build(output_pdf_path):
+    with open(output_pdf_path, "wb") as f:
+        f.write(b"%PDF-1.4 report")
+
+
+class TestReportQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.input_path = os.path.join(self.tmp_dir, "labels.npz")
+        with open(self.input_path, "wb") as f:
+            f.write(b"labels v1")
+        self.queue = ReportQueue(os.path.join(self.tmp_dir, "reports"), workers=2)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_cached_by_input_hash(self):
+        build = mock.Mock(side_effect=fake_build)
+        job_id = self.queue.submit(1, [self.input_path], build)
+        self.assertTrue(job_id.startswith("PanTS_00000001-"))
+        self.assertEqual(self.queue.wait(job_id)["status"], "done")
+
+        self.assertEqual(self.queue.submit(1, [self.input_path], build), job_id)
+        self.assertEqual(ReportQueue(self.queue.cache_dir).status(job_id)["status"], "done")
+        self.assertEqual(build.call_count, 1)
+
+        with open(self.input_path, "wb") as f:
+            f.write(b"labels v2")
+        new_job_id = self.queue.submit(1, [self.input_path], build)
+        self.assertNotEqual(new_job_id, job_id)
+        self.queue.wait(new_job_id)
+        self.assertEqual(build.call_count, 2)
+        self.assertFalse(os.path.exists(self.queue.report_path(job_id)))
+
+    def test_failed_job(self):
+        def broken_build(output_pdf_path):
+            raise RuntimeError("no CT")
+
+        job_id = self.queue.submit(1, [self.input_path], broken_build)
+        status = self.queue.wait(job_id)
+        self.assertEqual((status["status"], status["error"]), ("error", "no CT"))
+        self.assertEqual([n for n in os.listdir(self.queue.cache_dir) if not n.startswith(".")], [f"{job_id}.json"])
+        self.assertIsNone(self.queue.status("PanTS_00000002-0000000000000000"))
+
+    def test_status_shared_across_processes(self):
+        build = mock.Mock(side_effect=fake_build)
+        with mock.patch.object(self.queue, "_executor"):  # a job that another process is running
+            job_id = self.queue.submit(1, [self.input_path], build)
+        other = ReportQueue(self.queue.cache_dir)
+        self.assertEqual(other.status(job_id)["status"], "queued")
+        self.assertEqual(other.submit(1, [self.input_path], build), job_id)
+        build.assert_not_called()
+
+        # its process died: the job is reported as failed and queued again
+        with open(self.queue.status_path(job_id)) as f:
+            job = json.load(f)
+        job["updated"] = time.time() - Constants.REPORT_JOB_TIMEOUT_SECONDS - 1
+        with open(self.queue.status_path(job_id), "w") as f:
+            json.dump(job, f)
+        self.assertEqual(other.status(job_id)["status"], "error")
+        self.assertEqual(other.submit(1, [self.input_path], build), job_id)
+        self.assertEqual(other.wait(job_id)["status"], "done")
+        self.assertEqual(self.queue.status(job_id)["status"], "done")
+        build.assert_called_once()
+
+    def test_format_version_in_job_id(self):
+        job_id = self.queue.job_id(1, [self.input_path])
+        with mock.patch.object(Constants, "REPORT_FORMAT_VERSION", Constants.REPORT_FORMAT_VERSION + 1):
+            self.assertNotEqual(self.queue.job_id(1, [self.input_path]), job_id)
+
+    def test_template_page_cached(self):
+        template_pdf = os.path.join(self.tmp_dir, "template.pdf")
+        shutil.copy("report_template_3.pdf", template_pdf)
+
+        page = get_template_page(template_pdf)
+        self.assertIs(get_template_page(template_pdf), page)
+        stat = os.stat(template_pdf)
+        os.utime(template_pdf, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        self.assertIsNot(get_template_page(template_pdf), page)
+
+    def test_endpoints(self):
+        old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+        ReportQueue._instance = self.queue
+        try:
+            for path in (get_ct_npz_path(1), get_clabel_npz_path(1)):
+                os.makedirs(os.path.dirname(path))
+                np.savez_compressed(path, data=np.zeros((4, 4, 4), dtype=np.uint8))
+            client = create_app().test_client()
+            api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+
+            with mock.patch.object(api_blueprint_module, "build_case_report", lambda id, path: fake_build(path)):
+                resp = client.post(f"{api}/report/1")
+                self.assertIn(resp.status_code, (200, 202))
+                job_id = resp.get_json()["job_id"]
+                self.queue.wait(job_id)
+
+                self.assertEqual(client.get(f"{api}/report/status/{job_id}").get_json()["status"], "done")
+                download = client.get(f"{api}/report/download/{job_id}")
+                self.assertEqual((download.status_code, download.mimetype), (200, "application/pdf"))
+                self.assertEqual(download.data, b"%PDF-1.4 report")
+
+                self.assertEqual(client.post(f"{api}/report/1").status_code, 200)
+                self.assertEqual(client.post(f"{api}/get-report/1").data, b"%PDF-1.4 report")
+
+            self.assertEqual(client.get(f"{api}/report/status/unknown").status_code, 404)
+            self.assertEqual(client.post(f"{api}/report/abc").status_code, 400)
+        finally:
+            Constants.PANTS_PATH = old_pants_path
+            ReportQueue._instance = None
+
+
+if __name__ == "__main__":
+    unittest.main()
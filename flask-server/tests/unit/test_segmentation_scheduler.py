@@ -0,0 +1,182 @@
+import unittest
+import threading
+import zipfile
+import socket
+import fcntl
+import uuid
+import time
+import os
+from unittest import mock
+import numpy as np
+import nibabel as nib
+from datetime import datetime
+
+import api.api_blueprint as api_blueprint_module
+from constants import Constants
+from models.base import db
+from models.segmentation_job import SegmentationJob
+from services.segmentation_scheduler import SegmentationScheduler, worker_name
+from services.blob_store import BlobStore, SegmentationCache
+from tests.unit.job_test_case import JobTestCase
+
+
+class TestSegmentationScheduler(JobTestCase):
+
+    def test_priority_and_fifo(self):
+        gate = threading.Event()
+        order = []
+
+        def run(job):
+            if job.session_id == "first":
+                gate.wait(5)
+            order.append(job.session_id)
+            return None, None
+
+        scheduler = SegmentationScheduler(max_concurrent=1, run_fn=run)
+        scheduler.submit("first", "ct.nii.gz", "fake")
+        for session_id, priority in (("low-1", 0), ("high", 5), ("low-2", 0)):
+            scheduler.submit(session_id, "ct.nii.gz", "fake", priority=priority)
+        gate.set()
+        scheduler.join()
+        self.assertEqual(order, ["first", "high", "low-1", "low-2"])
+        self.assertEqual(scheduler.latest("high")["status"], "done")
+
+    def test_max_concurrent(self):
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def run(job):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            threading.Event().wait(0.05)
+            with lock:
+                running[0] -= 1
+            return None, None
+
+        scheduler = SegmentationScheduler(max_concurrent=2, run_fn=run)
+        for i in range(6):
+            scheduler.submit(f"session-{i}", "ct.nii.gz", "fake")
+        scheduler.join()
+        self.assertEqual(peak[0], 2)
+
+    def test_failed_job_and_listeners(self):
+        def run(job):
+            raise RuntimeError("model crashed")
+
+        events = []
+        scheduler = SegmentationScheduler(run_fn=run)
+        scheduler.add_listener(lambda job: events.append(job["status"]))
+        job_id = scheduler.submit("session", "ct.nii.gz", "fake")["job_id"]
+        scheduler.join()
+
+        job = scheduler.get(job_id)
+        self.assertEqual((job["status"], job["error"]), ("failed", "model crashed"))
+        self.assertIsNotNone(job["run_seconds"])
+        self.assertEqual(events, ["queued", "running", "failed"])
+
+    def test_recover(self):
+        host = socket.gethostname()
+        # another server process that is still alive holds the lock of its boot token
+        os.makedirs(Constants.SEGMENTATION_WORKER_DIR)
+        other_token = uuid.uuid4().hex
+        other_lock = open(os.path.join(Constants.SEGMENTATION_WORKER_DIR, f"{other_token}.lock"), "a")
+        fcntl.flock(other_lock, fcntl.LOCK_SH)
+        calls = []
+        for job_id, status, worker in (
+            ("queued-job", "queued", None),
+            # a restarted container reuses the host name and PIDs, even our own
+            ("dead-worker-job", "running", f"{host}:{os.getpid()}:{uuid.uuid4().hex}"),
+            ("old-format-job", "running", f"{host}:{os.getpid()}"),
+            ("live-worker-job", "running", worker_name()),
+            ("other-process-job", "running", f"{host}:1:{other_token}"),
+            ("other-host-job", "running", f"elsewhere:1:{uuid.uuid4().hex}"),
+            ("done-job", "done", None),
+        ):
+            db.session.add(SegmentationJob(job_id=job_id, session_id=job_id, model_name="fake", priority=0,
+                                           status=status, input_path="ct.nii.gz", worker=worker, submitted=datetime.now()))
+        db.session.commit()
+
+        try:
+            scheduler = SegmentationScheduler(max_concurrent=4, run_fn=lambda job: calls.append(job.job_id) or (None, None))
+            scheduler.init_app(self.app)
+            scheduler.recover()  # a second server process recovering the same rows
+            scheduler.join()
+        finally:
+            other_lock.close()
+
+        self.assertEqual(sorted(calls), ["dead-worker-job", "old-format-job", "queued-job"])
+        for job_id in ("live-worker-job", "other-process-job", "other-host-job"):
+            self.assertEqual(scheduler.get(job_id)["status"], "running")
+
+    def test_limit_is_shared_between_processes(self):
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def run(job):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return None, None
+
+        # two schedulers on one database stand in for two server processes
+        schedulers = [SegmentationScheduler(max_concurrent=1, run_fn=run) for _ in range(2)]
+        with mock.patch.object(Constants, "SEGMENTATION_CLAIM_RETRY_SECONDS", 0.01):
+            for i in range(6):
+                schedulers[i % 2].submit(f"session-{i}", "ct.nii.gz", "fake")
+            for scheduler in schedulers:
+                scheduler.join()
+        self.assertEqual(peak[0], 1)
+        self.assertTrue(all(schedulers[0].latest(f"session-{i}")["status"] == "done" for i in range(6)))
+
+    def test_auto_segment_with_fake_model(self):
+        old_sessions_dir, old_fake = api_blueprint_module.SESSIONS_DIR, Constants.FAKE_MODEL_ENABLED
+        api_blueprint_module.SESSIONS_DIR, Constants.FAKE_MODEL_ENABLED = self.tmp_dir, True
+        os.environ["FAKE_MODEL_SECONDS"] = "0"
+        SegmentationScheduler._instance = scheduler = SegmentationScheduler()
+        BlobStore._instance = BlobStore(os.path.join(self.tmp_dir, "blobs"))
+        SegmentationCache._instance = SegmentationCache(os.path.join(self.tmp_dir, "segmentation_cache"))
+        try:
+            ct_path = os.path.join(self.tmp_dir, "upload.nii.gz")
+            nib.save(nib.Nifti1Image(np.zeros((10, 10, 5), dtype=np.int16), np.eye(4)), ct_path)
+            client = self.app.test_client()
+            api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+
+            with open(ct_path, "rb") as f:
+                resp = client.post(f"{api}/auto_segment/s1", data={"MAIN_NIFTI": (f, "ct.nii.gz"), "MODEL_NAME": "fake"})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.get_json()["status"], "queued")
+            scheduler.join()
+
+            status = client.get(f"{api}/auto_segment/status/s1").get_json()
+            self.assertEqual(status["status"], "done")
+            with zipfile.ZipFile(os.path.join(self.tmp_dir, "s1", "auto_masks.zip")) as archive:
+                self.assertEqual(archive.namelist(), ["liver.nii.gz", "pancreas.nii.gz", "spleen.nii.gz"])
+
+            # the same CT again: answered from the cache without a model run
+            with open(ct_path, "rb") as f, mock.patch.object(scheduler, "run_fn", side_effect=AssertionError):
+                resp = client.post(f"{api}/auto_segment/s3", data={"MAIN_NIFTI": (f, "other-name.nii.gz"), "MODEL_NAME": "fake"})
+            self.assertEqual(resp.get_json()["status"], "done")
+            status = client.get(f"{api}/auto_segment/status/s3").get_json()
+            self.assertEqual((status["status"], status["cached"]), ("done", True))
+            with open(os.path.join(self.tmp_dir, "s1", "auto_masks.zip"), "rb") as a, \
+                    open(os.path.join(self.tmp_dir, "s3", "auto_masks.zip"), "rb") as b:
+                self.assertEqual(a.read(), b.read())
+            self.assertEqual(os.stat(os.path.join(self.tmp_dir, "s1", "ct.nii.gz")).st_ino,
+                             os.stat(os.path.join(self.tmp_dir, "s3", "other-name.nii.gz")).st_ino)
+
+            with open(ct_path, "rb") as f:
+                resp = client.post(f"{api}/auto_segment/s2", data={"MAIN_NIFTI": (f, "ct.nii.gz"), "MODEL_NAME": "unknown"})
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(client.get(f"{api}/auto_segment/status/s2").status_code, 404)
+        finally:
+            api_blueprint_module.SESSIONS_DIR, Constants.FAKE_MODEL_ENABLED = old_sessions_dir, old_fake
+            BlobStore._instance = SegmentationCache._instance = None
+            os.environ.pop("FAKE_MODEL_SECONDS", None)
+
+
+if __name__ == "__main__":
+    unittest.main()
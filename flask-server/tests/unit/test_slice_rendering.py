@@ -0,0 +1,79 @@
+import unittest
+import tempfile
+import shutil
+import os
+import io
+import numpy as np
+from PIL import Image
+
+from app import create_app
+from constants import Constants
+from api.utils import volume_to_image, window_slice, get_panTS_id
+
+
+class TestSliceRendering(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+
+        self.ct = np.linspace(-1000, 1000, 16 * 12 * 10, dtype=np.float32).reshape(16, 12, 10)
+        self.labels = np.zeros(self.ct.shape, dtype=np.float64)
+        self.labels[2:8, 2:8, :] = 1
+        self.labels[8:14, 2:8, :] = 2
+
+        case_dir = os.path.join(self.tmp_dir, "data", "ImageTr", get_panTS_id(1))
+        label_dir = os.path.join(self.tmp_dir, "data", "LabelTr", get_panTS_id(1))
+        os.makedirs(case_dir)
+        os.makedirs(label_dir)
+        np.savez_compressed(os.path.join(case_dir, Constants.MAIN_NPZ_FILENAME), data=self.ct)
+        np.savez_compressed(os.path.join(label_dir, Constants.COMBINED_LABELS_FILENAME), data=self.labels)
+
+        self.client = create_app().test_client()
+        self.api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+
+    def tearDown(self):
+        Constants.PANTS_PATH = self.old_pants_path
+        shutil.rmtree(self.tmp_dir)
+
+    def test_window_slice(self):
+        out = window_slice(np.array([-200, 40, 240, 1000]), window_center=40, window_width=400)
+        self.assertEqual(out.tolist(), [0, 127, 255, 255])
+
+    def test_volume_to_image_overlay(self):
+        color_map = {"1.0": {"R": 255, "G": 0, "B": 0, "A": 255}}
+        buf = volume_to_image(self.ct, axis=2, index=5, labels=self.labels, color_map=color_map)
+        image = np.array(Image.open(buf))
+
+        self.assertEqual(image.shape, (12, 16, 3))
+        self.assertTrue(np.any(np.all(image == [255, 0, 0], axis=2)))
+
+    def test_get_slice_png(self):
+        resp = self.client.get(f"{self.api}/get_slice/1/axial/5?wc=40&ww=400")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "image/png")
+        self.assertEqual(Image.open(io.BytesIO(resp.data)).size, (16, 12))
+
+    def test_get_slice_webp_overlay(self):
+        resp = self.client.get(f"{self.api}/get_slice/1/0/4?overlay=true&format=webp")
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, "image/webp")
+        self.assertEqual(Image.open(io.BytesIO(resp.data)).mode, "RGB")
+
+    def test_get_slice_out_of_bounds(self):
+        self.assertEqual(self.client.get(f"{self.api}/get_slice/1/2/10").status_code, 400)
+        self.assertEqual(self.client.get(f"{self.api}/get_slice/1/3/0").status_code, 400)
+        self.assertEqual(self.client.get(f"{self.api}/get_slice/2/2/0").status_code, 404)
+
+    def test_get_slice_bad_window(self):
+        for query in ("wc=abc", "ww=", "ww=nan", "wc=inf", "ww=0", "ww=-400"):
+            resp = self.client.get(f"{self.api}/get_slice/1/axial/5?{query}")
+            self.assertEqual(resp.status_code, 400, query)
+            self.assertIn(query.split("=")[0], resp.get_json()["error"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import unittest
+import threading
+import time
+import tempfile
+import shutil
+import base64
+import os
+import numpy as np
+from io import BytesIO
+from PIL import Image
+
+from app import create_app
+from constants import Constants
+from services.thumbnail_cache import ThumbnailCache, build_sprite_sheet, list_case_ids
+from services.npz_processor import get_panTS_id
+from services.metadata_index import MetadataIndex
+from tests.unit.test_metadata_index import write_workbook
+
+
+class TestThumbnailCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+
+        rng = np.random.default_rng(0)
+        for case_id, subfolder in ((1, "ImageTr"), (2, "ImageTr"), (9001, "ImageTe")):
+            case_dir = os.path.join(self.tmp_dir, "data", subfolder, get_panTS_id(case_id))
+            os.makedirs(case_dir)
+            ct = rng.integers(-1000, 1000, size=(60, 40, 5)).astype(np.int16)
+            np.savez_compressed(os.path.join(case_dir, Constants.MAIN_NPZ_FILENAME), data=ct)
+        self.cache = ThumbnailCache(os.path.join(self.tmp_dir, "thumbnails"), max_size=30)
+
+    def tearDown(self):
+        Constants.PANTS_PATH = self.old_pants_path
+        shutil.rmtree(self.tmp_dir)
+
+    def test_list_case_ids(self):
+        self.assertEqual(list_case_ids(), [1, 2, 9001])
+
+    def test_get_or_render_fills_cache(self):
+        path = self.cache.get_or_render(1)
+
+        self.assertTrue(self.cache.is_fresh(1))
+        with Image.open(path) as img:
+            self.assertEqual(sorted(img.size), [20, 30])
+        self.cache.render = lambda clabel_id: self.fail("fresh thumbnail should be served from disk")
+        self.assertEqual(self.cache.get_or_render(1), path)
+        self.assertIsNone(self.cache.get_or_render(3))
+
+    def test_concurrent_renders_are_limited(self):
+        lock = threading.Lock()
+        running, peak = [0], [0]
+        render = self.cache.render
+
+        def counting_render(clabel_id):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.05)
+            with lock:
+                running[0] -= 1
+            return render(clabel_id)
+
+        self.cache.render = counting_render
+        paths = self.cache.get_or_render_many([1, 2, 9001], workers=3)
+        self.assertTrue(all(paths.values()))
+        self.assertLessEqual(peak[0], Constants.THUMBNAIL_MAX_CONCURRENT_RENDERS)
+
+    def test_build_all_is_resumable(self):
+        self.cache.get_or_render(2)
+
+        rendered, skipped, failed = self.cache.build_all(workers=2)
+        self.assertEqual((rendered, skipped, failed), (2, 1, []))
+        self.assertEqual(self.cache.build_all(workers=2), (0, 3, []))
+
+    def test_endpoint(self):
+        client = create_app().test_client()
+        api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+        ThumbnailCache._instance = None
+        try:
+            resp = client.get(f"{api}/get_image_preview/9001")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.mimetype, "image/png")
+            self.assertTrue(os.path.exists(ThumbnailCache.instance().thumbnail_path(9001)))
+            self.assertEqual(client.get(f"{api}/get_image_preview/5").status_code, 404)
+        finally:
+            ThumbnailCache._instance = None
+
+    def test_sprite_sheet_offsets(self):
+        paths = self.cache.get_or_render_many([1, 2, 3, 9001])
+        self.assertIsNone(paths[3])
+
+        sprite, offsets = build_sprite_sheet(paths, 30, columns=2)
+        self.assertIsNone(offsets[3])
+        self.assertEqual((offsets[9001]["x"], offsets[9001]["y"]), (30, 30))
+        with Image.open(BytesIO(sprite)) as sheet, Image.open(paths[9001]) as thumb:
+            o = offsets[9001]
+            tile = sheet.crop((o["x"], o["y"], o["x"] + o["width"], o["y"] + o["height"]))
+            np.testing.assert_array_equal(np.asarray(tile), np.asarray(thumb.convert("L")))
+
+    def test_bundle_endpoint(self):
+        write_workbook(os.path.join(self.tmp_dir, "data", "metadata.xlsx"), [
+            ("PanTS_00000001", "(60, 40, 5)", "(1, 1, 1)", "Venous", "M", 70, 0),
+        ])
+        client = create_app().test_client()
+        api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+        ThumbnailCache._instance = None
+        MetadataIndex._instance = None
+        try:
+            data = client.get(f"{api}/get_preview_bundle/1,5,9001").get_json()
+            self.assertEqual(set(data["cases"]), {"1", "5", "9001"})
+            self.assertEqual((data["cases"]["1"]["sex"], data["cases"]["1"]["age"]), ("M", 70))
+            self.assertIsNone(data["cases"]["5"]["thumbnail"])
+            self.assertEqual(data["cases"]["9001"]["thumbnail"]["x"], 2 * data["tile_size"])
+            sprite = base64.b64decode(data["sprite"].split(",", 1)[1])
+            with Image.open(BytesIO(sprite)) as sheet:
+                self.assertEqual(sheet.size, (3 * data["tile_size"], data["tile_size"]))
+
+            self.assertEqual(client.get(f"{api}/get_preview_bundle/1,abc").status_code, 400)
+        finally:
+            ThumbnailCache._instance = None
+            MetadataIndex._instance = None
+
+
+if __name__ == "__main__":
+    unittest.main()
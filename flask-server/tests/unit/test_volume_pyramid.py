@@ -0,0 +1,137 @@
+import unittest
+import threading
+import tempfile
+import shutil
+import gzip
+import os
+import numpy as np
+
+from app import create_app
+from constants import Constants
+from services.volume_pyramid import VolumePyramid, block_mean, block_mode
+from services.volume_store import VolumeStore
+from services.npz_processor import get_panTS_id
+
+
+class TestVolumePyramid(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        rng = np.random.default_rng(0)
+        self.labels = rng.integers(0, 4, size=(13, 10, 9)).astype(np.float64)
+        self.ct = rng.integers(-1000, 1000, size=(13, 10, 9)).astype(np.int16)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_block_mode(self):
+        down = block_mode(self.labels, 2, slab_rows=3)
+
+        self.assertEqual(down.shape, (7, 5, 5))
+        for i, j, k in np.ndindex(*down.shape):
+            block = self.labels[2 * i:2 * i + 2, 2 * j:2 * j + 2, 2 * k:2 * k + 2].ravel()
+            values, counts = np.unique(block, return_counts=True)
+            self.assertEqual(down[i, j, k], values[counts.argmax()])
+
+    def test_block_mean(self):
+        down = block_mean(self.ct, 4)
+
+        self.assertEqual(down.shape, (4, 3, 3))
+        self.assertAlmostEqual(down[3, 2, 2], self.ct[12:, 8:, 8:].mean())
+
+    def test_chunks_reassemble_each_level(self):
+        pyramid = VolumePyramid(os.path.join(self.tmp_dir, "labels"), levels=(1, 2, 4), chunk_size=4)
+        manifest = pyramid.build(self.labels, is_label=True)
+
+        self.assertEqual(manifest["dtype"], "|u1")
+        for level in manifest["levels"]:
+            volume = np.zeros(level["shape"], dtype=np.uint8)
+            for cx, cy, cz in np.ndindex(*level["grid"]):
+                chunk = pyramid.read_chunk(level["factor"], cx, cy, cz, manifest)
+                volume[cx * 4:cx * 4 + chunk.shape[0], cy * 4:cy * 4 + chunk.shape[1], cz * 4:cz * 4 + chunk.shape[2]] = chunk
+            np.testing.assert_array_equal(volume, block_mode(self.labels, level["factor"]))
+
+    def test_concurrent_builds(self):
+        npz_path = os.path.join(self.tmp_dir, "ct.npz")
+        np.savez_compressed(npz_path, data=self.ct)
+        root = os.path.join(self.tmp_dir, "pyramid", "ct")
+        VolumePyramid(root, levels=(1, 2), chunk_size=4).build(self.ct, is_label=False)  # stale: no source
+        store = VolumeStore(enabled=False)
+        loads, errors = [], []
+        load = store.load
+        store.load = lambda path: loads.append(path) or load(path)
+
+        def request_manifest():
+            try:
+                VolumePyramid(root, levels=(1, 2), chunk_size=4).build_from_npz(npz_path, is_label=False)
+            except Exception as e:
+                errors.append(e)
+
+        old_store, VolumeStore._instance = VolumeStore._instance, store
+        try:
+            threads = [threading.Thread(target=request_manifest) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            VolumeStore._instance = old_store
+
+        self.assertEqual((errors, len(loads)), ([], 1))
+        pyramid = VolumePyramid(root, levels=(1, 2), chunk_size=4)
+        self.assertTrue(pyramid.is_fresh(npz_path))
+        np.testing.assert_array_equal(pyramid.read_chunk(1, 0, 0, 0), self.ct[:4, :4, :4])
+        self.assertTrue(os.path.islink(root))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(root))), sorted(["ct", "ct.lock", os.readlink(root)]))
+
+    def test_rebuild_never_hides_the_tree(self):
+        root = os.path.join(self.tmp_dir, "labels")
+        # a plain directory as written before versioned installs
+        VolumePyramid(root, levels=(1,), chunk_size=4)._write(self.labels, True, None, root)
+        stop, missing = threading.Event(), []
+
+        def read_manifest():
+            while not stop.is_set():
+                if not os.path.exists(VolumePyramid(root).manifest_path):
+                    missing.append(True)
+
+        reader = threading.Thread(target=read_manifest)
+        reader.start()
+        try:
+            for _ in range(20):
+                VolumePyramid(root, levels=(1, 2), chunk_size=4).build(self.labels, is_label=True)
+        finally:
+            stop.set()
+            reader.join()
+
+        self.assertEqual(missing, [])
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), sorted(["labels", "labels.lock", os.readlink(root)]))
+
+    def test_endpoints(self):
+        old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+        try:
+            case_dir = os.path.join(self.tmp_dir, "data", "ImageTr", get_panTS_id(1))
+            os.makedirs(case_dir)
+            np.savez_compressed(os.path.join(case_dir, Constants.MAIN_NPZ_FILENAME), data=self.ct)
+            client = create_app().test_client()
+            api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+
+            manifest = client.get(f"{api}/pyramid/1/ct/manifest").get_json()
+            self.assertEqual([l["factor"] for l in manifest["levels"]], list(Constants.PYRAMID_LEVELS))
+
+            resp = client.get(f"{api}/pyramid/1/ct/2/0/0/0")
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+            shape = [int(n) for n in resp.headers["X-Chunk-Shape"].split(",")]
+            chunk = np.frombuffer(gzip.decompress(resp.data), dtype=resp.headers["X-Chunk-Dtype"]).reshape(shape)
+            np.testing.assert_array_equal(chunk, np.rint(block_mean(self.ct, 2)).astype(np.int16))
+
+            self.assertEqual(client.get(f"{api}/pyramid/1/ct/2/9/0/0").status_code, 404)
+            self.assertEqual(client.get(f"{api}/pyramid/1/mri/manifest").status_code, 400)
+        finally:
+            Constants.PANTS_PATH = old_pants_path
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+
+from services.volume_store import VolumeStore
+
+
+class TestVolumeStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.npz_path = os.path.join(self.tmp_dir, "ct.npz")
+        self.volume = np.arange(4 * 5 * 6, dtype=np.int16).reshape(4, 5, 6)
+        np.savez_compressed(self.npz_path, data=self.volume)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_load_materialises_memmap(self):
+        store = VolumeStore(root=None, enabled=True)
+        arr = store.load(self.npz_path)
+
+        self.assertIsInstance(arr, np.memmap)
+        self.assertTrue(arr.flags.f_contiguous)
+        np.testing.assert_array_equal(arr, self.volume)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir, "ct.npy")))
+
+    def test_separate_root(self):
+        root = os.path.join(self.tmp_dir, "store")
+        store = VolumeStore(root=root, enabled=True)
+        npy_path = store.materialise(self.npz_path)
+
+        self.assertTrue(npy_path.startswith(root))
+        np.testing.assert_array_equal(store.load(self.npz_path), self.volume)
+
+    def test_stale_npy_is_rebuilt(self):
+        store = VolumeStore(root=None, enabled=True)
+        store.load(self.npz_path)
+
+        np.savez_compressed(self.npz_path, data=self.volume * 2)
+        npy_mtime = os.path.getmtime(store.npy_path(self.npz_path))
+        os.utime(self.npz_path, (npy_mtime + 10, npy_mtime + 10))
+
+        np.testing.assert_array_equal(store.load(self.npz_path), self.volume * 2)
+
+    def test_disabled_reads_npz(self):
+        store = VolumeStore(root=None, enabled=False)
+        arr = store.load(self.npz_path)
+
+        self.assertNotIsInstance(arr, np.memmap)
+        np.testing.assert_array_equal(arr, self.volume)
+        self.assertFalse(os.path.exists(store.npy_path(self.npz_path)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+import tempfile
+import shutil
+import zipfile
+import io
+import os
+import numpy as np
+
+from app import create_app
+from constants import Constants
+from services.zip_stream import iter_zip, write_zip, ZipArchiveCache
+from services.npz_processor import get_panTS_id
+
+
+class TestZipStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.npz_path = os.path.join(self.tmp_dir, "liver.npz")
+        np.savez_compressed(self.npz_path, data=np.arange(1000, dtype=np.uint8))
+        self.txt_path = os.path.join(self.tmp_dir, "notes.txt")
+        with open(self.txt_path, "w") as f:
+            f.write("pancreas " * 1000)
+        self.members = [("liver.npz", self.npz_path), ("notes.txt", self.txt_path)]
+        self.cache = ZipArchiveCache(os.path.join(self.tmp_dir, "zips"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_archive(self, data):
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            infos = {info.filename: info for info in archive.infolist()}
+            self.assertEqual(infos["liver.npz"].compress_type, zipfile.ZIP_STORED)
+            self.assertEqual(infos["notes.txt"].compress_type, zipfile.ZIP_DEFLATED)
+            with open(self.npz_path, "rb") as f:
+                self.assertEqual(archive.read("liver.npz"), f.read())
+
+    def test_iter_zip(self):
+        chunks = list(iter_zip(self.members, chunk_size=256))
+        self.assertGreater(len(chunks), 2)
+        self.check_archive(b"".join(chunks))
+
+        zip_path = write_zip(os.path.join(self.tmp_dir, "out.zip"), self.members)
+        with open(zip_path, "rb") as f:
+            self.check_archive(f.read())
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ["liver.npz", "notes.txt", "out.zip"])
+
+    def test_cache(self):
+        self.assertIsNone(self.cache.get("case", self.members))
+
+        stream = self.cache.stream("case", self.members)
+        next(stream)
+        stream.close()  # client went away
+        self.assertEqual(os.listdir(self.cache.cache_dir), [])
+
+        data = b"".join(self.cache.stream("case", self.members))
+        self.check_archive(data)
+        path = self.cache.get("case", self.members)
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), data)
+
+        with open(self.txt_path, "a") as f:
+            f.write("changed")
+        self.assertIsNone(self.cache.get("case", self.members))
+        b"".join(self.cache.stream("case", self.members))
+        self.assertEqual(len(os.listdir(self.cache.cache_dir)), 1)
+        self.assertFalse(os.path.exists(path))
+
+    def test_download_endpoint(self):
+        old_pants_path = Constants.PANTS_PATH
+        Constants.PANTS_PATH = self.tmp_dir
+        ZipArchiveCache._instance = self.cache
+        try:
+            seg_dir = os.path.join(self.tmp_dir, "data", "LabelTr", get_panTS_id(1), "segmentations")
+            os.makedirs(seg_dir)
+            shutil.copy(self.npz_path, seg_dir)
+            client = create_app().test_client()
+            api = f"{Constants.BASE_PATH.rstrip('/')}/api"
+
+            first = client.get(f"{api}/download/1")
+            self.assertEqual((first.status_code, first.mimetype), (200, "application/zip"))
+            self.assertIsNone(first.content_length)
+            self.assertIn("case_1_segmentations.zip", first.headers["Content-Disposition"])
+            with zipfile.ZipFile(io.BytesIO(first.data)) as archive:
+                self.assertEqual(archive.namelist(), ["liver.npz"])
+
+            second = client.get(f"{api}/download/1")
+            self.assertEqual(len(os.listdir(self.cache.cache_dir)), 1)
+            self.assertEqual(second.content_length, len(first.data))  # served from the cache
+            self.assertEqual(second.data, first.data)
+            self.assertEqual(client.get(f"{api}/download/1", headers={"Range": "bytes=0-3"}).data, b"PK\x03\x04")
+            self.assertEqual(client.get(f"{api}/download/2").status_code, 404)
+        finally:
+            Constants.PANTS_PATH = old_pants_path
+            ZipArchiveCache._instance = None
+
+
+if __name__ == "__main__":
+    unittest.main()